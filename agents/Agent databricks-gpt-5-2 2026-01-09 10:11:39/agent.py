@@ -1,30 +1,57 @@
+import asyncio
 import json
-from typing import Any, Callable, Generator, Optional
+import threading
+from typing import Any, AsyncGenerator, Callable, Generator, Optional, Union
 from uuid import uuid4
 import warnings
 
-import backoff
-import mlflow
-import openai
-from databricks.sdk import WorkspaceClient
-from databricks_openai import UCFunctionToolkit, VectorSearchRetrieverTool
-from mlflow.entities import SpanType
-from mlflow.pyfunc import ResponsesAgent
-from mlflow.types.responses import (
-    ResponsesAgentRequest,
-    ResponsesAgentResponse,
-    ResponsesAgentStreamEvent,
-    output_to_responses_items_stream,
-    to_chat_completions_input,
-)
-from openai import OpenAI
-from pydantic import BaseModel
-from unitycatalog.ai.core.base import get_uc_function_client
+# repo modules: the repo root is on sys.path in a Git folder, and code/ once logged with code_paths
+from src.lib.startup import Lazy, StartupProfiler, format_report, run_concurrently
+
+# cold start: imports, client construction and warmup are timed per component (AGENT.startup_report())
+STARTUP = StartupProfiler()
+
+with STARTUP.step("import:mlflow"):
+    import mlflow
+    from mlflow.entities import SpanType
+    from mlflow.pyfunc import ResponsesAgent
+    from mlflow.types.responses import (
+        ResponsesAgentRequest,
+        ResponsesAgentResponse,
+        ResponsesAgentStreamEvent,
+        output_to_responses_items_stream,
+        to_chat_completions_input,
+    )
+with STARTUP.step("import:openai"):
+    import backoff
+    import openai
+    from openai import OpenAI
+    from pydantic import BaseModel
+with STARTUP.step("import:databricks"):
+    from databricks.sdk import WorkspaceClient
+    from databricks.vector_search.client import VectorSearchClient
+    from databricks_openai import UCFunctionToolkit, VectorSearchRetrieverTool
+    from unitycatalog.ai.core.base import get_uc_function_client
+with STARTUP.step("import:repo"):
+    from src.lib.aio import SyncBridge, databricks_async_openai_client
+    from src.lib.answer_cache import CachedAnswer, SemanticAnswerCache, answer_namespace
+    from src.lib.bm25 import BM25Index, HybridRetriever, hybrid_tool_spec, vector_search_fn
+    from src.lib.context_compaction import CompactionTotals, ContextCompactor
+    from src.lib.embeddings import ServingEndpointEmbedder
+    from src.lib.history import HistoryManager, render_turns
+    from src.lib.index_sync import indexed_version
+    from src.lib.llm_client import ResilientLLMClient
+    from src.lib.metrics import AGENT_BUCKETS, LLMCallMeter, Metrics, format_snapshot
+    from src.lib.prefetch import Prefetch, RetrievalPrefetcher
+    from src.lib.retrieval_cache import RetrievalCache, VersionPoller
+    from src.lib.tool_exec import ParallelToolRunner, ToolCapacityExhausted, run_in_thread
 
 ############################################
 # Define your LLM endpoint and system prompt
 ############################################
 LLM_ENDPOINT_NAME = "databricks-gpt-5-2"
+# tried in order when the primary endpoint's retries are exhausted or its circuit breaker is open
+LLM_FALLBACK_ENDPOINTS = []
 
 SYSTEM_PROMPT = """Você é uma analista de compras e responde perguntas sobre contratos. Não investe respostas se não encontrar nos documentos. Responda educadamente e com termos da área de contratos específicos. responda sempre em pt-br e de forma cordial e educada."""
 
@@ -41,14 +68,16 @@ class ToolInfo(BaseModel):
     - "name" (str): The name of the tool.
     - "spec" (dict): JSON description of the tool (matches OpenAI Responses format)
     - "exec_fn" (Callable): Function that implements the tool logic
+    - "cacheable" (bool): read-only retrieval tool whose results can be served from the retrieval cache
     """
 
     name: str
     spec: dict
     exec_fn: Callable
+    cacheable: bool = False
 
 
-def create_tool_info(tool_spec, exec_fn_param: Optional[Callable] = None):
+def create_tool_info(tool_spec, exec_fn_param: Optional[Callable] = None, cacheable: bool = False):
     tool_spec["function"].pop("strict", None)
     tool_name = tool_spec["function"]["name"]
     udf_name = tool_name.replace("__", ".")
@@ -56,42 +85,160 @@ def create_tool_info(tool_spec, exec_fn_param: Optional[Callable] = None):
     # Define a wrapper that accepts kwargs for the UC tool call,
     # then passes them to the UC tool execution client
     def exec_fn(**kwargs):
-        function_result = uc_function_client.execute_function(udf_name, kwargs)
+        function_result = UC_FUNCTION_CLIENT.get().execute_function(udf_name, kwargs)
         if function_result.error is not None:
             return function_result.error
         else:
             return function_result.value
-    return ToolInfo(name=tool_name, spec=tool_spec, exec_fn=exec_fn_param or exec_fn)
+    return ToolInfo(name=tool_name, spec=tool_spec, exec_fn=exec_fn_param or exec_fn, cacheable=cacheable)
 
 
-TOOL_INFOS = []
+# Clients and tools are built on first use (or by AGENT.warmup()), not when agent.py is imported:
+# logging and validating the model do not wait on the workspace.
 
 # You can use UDFs in Unity Catalog as agent tools
 # TODO: Add additional tools
 UC_TOOL_NAMES = []
 
-uc_toolkit = UCFunctionToolkit(function_names=UC_TOOL_NAMES)
-uc_function_client = get_uc_function_client()
-for tool_spec in uc_toolkit.tools:
-    TOOL_INFOS.append(create_tool_info(tool_spec))
+UC_FUNCTION_CLIENT = Lazy(get_uc_function_client, "uc_function_client", STARTUP)
 
 
-# Use Databricks vector search indexes as tools
-# See [docs](https://docs.databricks.com/generative-ai/agent-framework/unstructured-retrieval-tools.html) for details
+def uc_tools() -> list[ToolInfo]:
+    if not UC_TOOL_NAMES:
+        return []
+    uc_toolkit = UCFunctionToolkit(function_names=UC_TOOL_NAMES)
+    return [create_tool_info(tool_spec) for tool_spec in uc_toolkit.tools]
+
 
 # Use Databricks vector search indexes as tools
 # See the [Databricks Documentation](https://docs.databricks.com/generative-ai/agent-framework/unstructured-retrieval-tools.html) for details
-VECTOR_SEARCH_TOOLS = []
-VECTOR_SEARCH_TOOLS.append(
+VECTOR_SEARCH_INDEX = "fabio_goncalves.contract_agent.contracts_chunks_vs"
+
+
+def vector_search_tools() -> list[VectorSearchRetrieverTool]:
+    return [
         VectorSearchRetrieverTool(
-            index_name="fabio_goncalves.contract_agent.contracts_chunks_vs",
+            index_name=VECTOR_SEARCH_INDEX,
             # TODO: specify index description for better agent tool selection
             # tool_description=""
         )
-    )
-for vs_tool in VECTOR_SEARCH_TOOLS:
-    TOOL_INFOS.append(create_tool_info(vs_tool.tool, vs_tool.execute))
+    ]
+
+
+VECTOR_SEARCH_TOOLS = Lazy(vector_search_tools, "vector_search_tools", STARTUP)
+# one index handle for the hybrid retriever and the version poller
+VECTOR_INDEX = Lazy(
+    lambda: VectorSearchClient(disable_notice=True).get_index(index_name=VECTOR_SEARCH_INDEX), "vector_index", STARTUP
+)
+
+
+# Hybrid search: BM25 (built by src/notebooks/02, exact terms like "D+30" or "cláusula 7") fused
+# with the vector index above. Logged as the "bm25_index" artifact; the Volume path is used when
+# the agent runs from the notebook.
+BM25_INDEX_PATH = "/Volumes/fabio_goncalves/contract_agent/contracts_ptbr/_bm25/contracts_chunks_dedup_bm25.npz"
+HYBRID_COLUMNS = ["chunk_uid", "doc_name", "page", "content"]
+
+_hybrid = {"path": BM25_INDEX_PATH, "retriever": None}
+_hybrid_lock = threading.Lock()
+
+
+def get_hybrid_retriever() -> HybridRetriever:
+    # built on first use: importing agent.py (logging, validation) does not read the index
+    with _hybrid_lock:
+        if _hybrid["retriever"] is None:
+            index = VECTOR_INDEX.get()
+            with STARTUP.step("init:bm25_index"):
+                bm25 = BM25Index.load(_hybrid["path"])
+            _hybrid["retriever"] = HybridRetriever(bm25, vector_search_fn(index, HYBRID_COLUMNS), columns=HYBRID_COLUMNS)
+        return _hybrid["retriever"]
+
+
+def hybrid_search(query: str) -> list[dict]:
+    rows = get_hybrid_retriever().retrieve(query, k=5)
+    return [{"doc_name": r["doc_name"], "page": r["page"], "content": r["content"]} for r in rows]
+
+
+def load_tools() -> list[ToolInfo]:
+    """The agent's tools. The UC toolkit and the Vector Search tool are built at the same time."""
+    built, errors = run_concurrently({"uc_tools": uc_tools, "vector_search_tools": VECTOR_SEARCH_TOOLS.get}, STARTUP, kind="tools")
+    if errors:
+        raise next(iter(errors.values()))
+    tools = built["uc_tools"]
+    tools += [create_tool_info(vs_tool.tool, vs_tool.execute, cacheable=True) for vs_tool in built["vector_search_tools"]]
+    tools.append(create_tool_info(hybrid_tool_spec(), hybrid_search, cacheable=True))
+    return tools
+
+
+TOOL_INFOS = Lazy(load_tools, "tools", STARTUP)
+
+
+# Retrieval cache: repeat questions skip the Vector Search round trip. Entries are dropped when the
+# index has processed a new version of its source table (checked at most every 30 s).
+def vector_index_version() -> Optional[int]:
+    return indexed_version(VECTOR_INDEX.get().describe())
+
+
+INDEX_VERSION = VersionPoller(vector_index_version, check_s=30)
+RETRIEVAL_CACHE = RetrievalCache(
+    max_entries=1024, max_bytes=32 << 20, ttl_s=600, version_fn=INDEX_VERSION.current, version_check_s=0
+)
 
+# Semantic answer cache (opt-in): a single-turn question close enough (cosine >= threshold) to one
+# already answered under the same system prompt, model and index version is answered from the cache,
+# without calling the LLM. Requests with custom_inputs {"bypass_answer_cache": true} skip the lookup
+# and refresh the cached answer.
+ANSWER_CACHE_ENABLED = False
+ANSWER_CACHE_EMBEDDING_ENDPOINT = "databricks-bge-large-en"
+ANSWER_CACHE = SemanticAnswerCache(
+    ServingEndpointEmbedder(ANSWER_CACHE_EMBEDDING_ENDPOINT), threshold=0.95, max_entries=512,
+    ttl_s=3600, version_fn=INDEX_VERSION.current, version_check_s=0,
+) if ANSWER_CACHE_ENABLED else None
+MAX_ITERATIONS_MESSAGE = "Max iterations reached. Stopping."
+
+# function calls of one LLM turn run at the same time (a turn costs its slowest call, not the sum), at most
+# MAX_PARALLEL_TOOL_CALLS at once per request, each on its own thread; TOOL_TIMEOUT_S counts from the call's start
+MAX_PARALLEL_TOOL_CALLS = 4
+TOOL_TIMEOUT_S = 30
+
+# retrieval outputs enter the prompt as compact citations, without chunks the conversation already has,
+# within this many (estimated) tokens per request; None sends str() of the raw results
+TOOL_OUTPUT_BUDGET_TOKENS = 4000
+
+# LLM streams: jittered exponential retries before the first token, a time-to-first-token deadline, a
+# circuit breaker per endpoint and, with LLM_HEDGE, a second request when no token came within the p95
+LLM_MAX_RETRIES = 3
+LLM_TTFT_TIMEOUT_S = 30
+LLM_HEDGE = False
+# ask the endpoint for token usage at the end of each stream (metrics); estimated when it sends none
+LLM_STREAM_USAGE = True
+
+# speculative retrieval (opt-in): PREFETCH_TOOL searches the user's question while the first LLM call is in
+# flight; when the model then calls that tool with a query whose terms are (PREFETCH_MIN_SIMILARITY of them)
+# in the question, it gets the prefetched result. Prefetching pauses while more than PREFETCH_MAX_WASTE of the
+# recent prefetches go unused (probing one request in 10)
+PREFETCH_RETRIEVAL = False
+PREFETCH_TOOL = hybrid_tool_spec()["function"]["name"]
+PREFETCH_MIN_SIMILARITY = 0.8
+PREFETCH_MAX_WASTE = 0.5
+
+# long sessions: the last HISTORY_KEEP_TURNS turns are sent verbatim, older ones as a rolling summary kept per
+# session_id and extended incrementally; history + tool outputs stay under MAX_PROMPT_TOKENS (estimated)
+HISTORY_KEEP_TURNS = 6
+MAX_PROMPT_TOKENS = 16000
+HISTORY_SUMMARY_PROMPT = """Resuma a conversa entre o analista e a assistente de contratos para que ela continue sem o histórico completo. Em tópicos curtos e em pt-br, mantenha as perguntas feitas, as respostas dadas (valores, prazos, percentuais, cláusulas) e as fontes citadas (documento e página). Não acrescente informações que não estejam na conversa."""
+
+# AsyncToolCallingAgent: conversations waiting on the LLM stream hold no thread when a native async host awaits
+# apredict_stream. Behind ResponsesAgent's synchronous predict/predict_stream (model serving) every request still
+# blocks its serving thread until the stream ends, so throughput matches the sync agent (python -m src.lib.agent_bench)
+USE_ASYNC_AGENT = False
+ASYNC_IO_THREADS = 32
+
+# model serving: build the tools, clients, index handle and BM25 index in load_context (concurrently), so
+# the first request does not pay for them; the startup report is printed to the serving logs
+WARMUP_ON_LOAD = True
+
+# MLflow traces of the OpenAI SDK calls, turned on with the first client
+OPENAI_TRACING = Lazy(mlflow.openai.autolog, "mlflow_openai_autolog", STARTUP)
 
 
 class ToolCallingAgent(ResponsesAgent):
@@ -99,74 +246,344 @@ class ToolCallingAgent(ResponsesAgent):
     Class representing a tool-calling Agent
     """
 
-    def __init__(self, llm_endpoint: str, tools: list[ToolInfo]):
-        """Initializes the ToolCallingAgent with tools."""
+    def __init__(
+        self,
+        llm_endpoint: str,
+        tools: Union[list[ToolInfo], Callable[[], list[ToolInfo]]],
+        retrieval_cache: Optional[RetrievalCache] = None,
+        answer_cache: Optional[SemanticAnswerCache] = None,
+        max_parallel_tools: int = MAX_PARALLEL_TOOL_CALLS,
+        tool_timeout_s: float = TOOL_TIMEOUT_S,
+        tool_budget_tokens: Optional[int] = TOOL_OUTPUT_BUDGET_TOKENS,
+        history_keep_turns: int = HISTORY_KEEP_TURNS,
+        max_prompt_tokens: Optional[int] = MAX_PROMPT_TOKENS,
+        fallback_endpoints: tuple[str, ...] = tuple(LLM_FALLBACK_ENDPOINTS),
+        llm_max_retries: int = LLM_MAX_RETRIES,
+        llm_ttft_timeout_s: float = LLM_TTFT_TIMEOUT_S,
+        llm_hedge: bool = LLM_HEDGE,
+        metrics: Optional[Metrics] = None,
+        prefetch_tool: Optional[str] = PREFETCH_TOOL if PREFETCH_RETRIEVAL else None,
+    ):
+        """Initializes the ToolCallingAgent with tools (a list, or a function building it on first use)."""
         self.llm_endpoint = llm_endpoint
-        self.workspace_client = WorkspaceClient()
-        self.model_serving_client: OpenAI = (
-            self.workspace_client.serving_endpoints.get_open_ai_client()
+        # per-stage latency, token and cache histograms/counters, apart from MLflow traces: see metrics_snapshot()
+        self.metrics = metrics or Metrics(buckets=AGENT_BUCKETS)
+        self.tool_budget_tokens = tool_budget_tokens
+        self.compaction_totals = CompactionTotals()
+        # the tool outputs of a request get their own budget: the history has what is left of the ceiling
+        self.history = HistoryManager(
+            self.summarize_history, keep_turns=history_keep_turns,
+            max_tokens=max_prompt_tokens - (tool_budget_tokens or 0),
+        ) if max_prompt_tokens else None
+        self.retrieval_cache = retrieval_cache
+        self.answer_cache = answer_cache
+        self.prefetcher = RetrievalPrefetcher(
+            prefetch_tool, min_similarity=PREFETCH_MIN_SIMILARITY, max_in_flight=max_parallel_tools,
+            max_waste=PREFETCH_MAX_WASTE, wait_s=tool_timeout_s, metrics=self.metrics,
+        ) if prefetch_tool else None
+        self.tool_runner = ParallelToolRunner(max_workers=max_parallel_tools, timeout_s=tool_timeout_s)
+        # clients are created on first use: see warmup()
+        self._workspace_client = Lazy(WorkspaceClient, "workspace_client", STARTUP)
+        self._model_serving_client = Lazy(self.create_openai_client, "openai_client", STARTUP)
+        # retries are left to self.llm: the SDK's own would retry after tokens were streamed
+        self._llm_stream_client = Lazy(lambda: self.model_serving_client.with_options(max_retries=0), "llm_stream_client")
+        self.llm = ResilientLLMClient(
+            self.open_llm_stream,
+            [llm_endpoint, *fallback_endpoints],
+            max_retries=llm_max_retries,
+            ttft_timeout_s=llm_ttft_timeout_s,
+            hedge=llm_hedge,
+            wait_gen=lambda: backoff.expo(factor=0.5, max_value=8),
+            jitter=backoff.full_jitter,
         )
-        self._tools_dict = {tool.name: tool for tool in tools}
+        self._tools = Lazy(lambda: {tool.name: tool for tool in (tools() if callable(tools) else tools)}, "agent_tools")
+
+    @property
+    def workspace_client(self) -> WorkspaceClient:
+        return self._workspace_client.get()
+
+    @property
+    def model_serving_client(self) -> OpenAI:
+        return self._model_serving_client.get()
+
+    @property
+    def llm_stream_client(self) -> OpenAI:
+        return self._llm_stream_client.get()
+
+    @property
+    def _tools_dict(self) -> dict[str, ToolInfo]:
+        return self._tools.get()
+
+    def create_openai_client(self) -> OpenAI:
+        OPENAI_TRACING.get()
+        return self.workspace_client.serving_endpoints.get_open_ai_client()
+
+    def load_context(self, context):
+        """Uses the BM25 index logged with the model when served, then warms up (WARMUP_ON_LOAD)."""
+        path = (context.artifacts or {}).get("bm25_index")
+        if path:
+            with _hybrid_lock:
+                _hybrid["path"], _hybrid["retriever"] = path, None
+        if WARMUP_ON_LOAD:
+            print(format_report(self.warmup()))
+
+    def warmup_steps(self) -> dict[str, Callable[[], Any]]:
+        """What the first request would otherwise build, as independent steps."""
+        return {
+            "tools": self.get_tool_specs,
+            # authenticates against the workspace and fails fast on a wrong endpoint name
+            "llm_endpoint": lambda: self.workspace_client.serving_endpoints.get(self.llm_endpoint),
+            "llm_stream_client": lambda: self.llm_stream_client,
+            "index_version": INDEX_VERSION.current,
+            "hybrid_retriever": get_hybrid_retriever,
+        }
+
+    def warmup(self) -> dict:
+        """
+        Builds the tools, clients, vector index handle and version, and the BM25 index concurrently.
+        A failed step is reported, not raised: the request that needs it builds it again.
+        Returns the startup report.
+        """
+        _, errors = run_concurrently(self.warmup_steps(), STARTUP, kind="warmup")
+        return self.startup_report(errors)
+
+    def startup_report(self, errors: Optional[dict[str, Exception]] = None) -> dict:
+        """Import, init and warmup timings per component since agent.py started loading."""
+        report = STARTUP.report()
+        if errors:
+            report["errors"] = {name: f"{type(e).__name__}: {e}" for name, e in errors.items()}
+        return report
 
     def get_tool_specs(self) -> list[dict]:
         """Returns tool specifications in the format OpenAI expects."""
         return [tool_info.spec for tool_info in self._tools_dict.values()]
 
+    def retrieval_cache_stats(self) -> dict:
+        """Hit/miss counters of the retrieval cache (empty when caching is off)."""
+        return self.retrieval_cache.stats if self.retrieval_cache else {}
+
+    def answer_cache_stats(self) -> dict:
+        """Lookup/hit/store counters of the semantic answer cache (empty when it is off)."""
+        return self.answer_cache.stats if self.answer_cache else {}
+
+    def context_compaction_stats(self) -> dict:
+        """Tool output tokens received vs sent to the LLM, summed over requests."""
+        return self.compaction_totals.stats
+
+    def llm_client_stats(self) -> dict:
+        """Retries, TTFT timeouts, hedges, fallbacks and circuit state per endpoint of the LLM client."""
+        return self.llm.stats
+
+    def prefetch_stats(self) -> dict:
+        """Speculative retrieval: started/hit/miss/unused/skipped/throttled, hit rate, recent waste (empty when off)."""
+        return self.prefetcher.stats if self.prefetcher else {}
+
+    def metrics_snapshot(self) -> dict:
+        """
+        Per-stage histograms (count, mean, p50/p95/p99, max): request_seconds, llm_ttft_seconds, llm_call_seconds,
+        tool_seconds per tool, agent_iterations, llm_prompt_tokens, llm_completion_tokens; counters; cache hit rates.
+        """
+        snapshot = self.metrics.snapshot()
+        snapshot["hit_rates"] = {name: self.metrics.hit_rate(name) for name in ("retrieval_cache", "answer_cache")}
+        if self.prefetcher:
+            snapshot["hit_rates"]["prefetch"] = self.prefetcher.stats["hit_rate"]
+        return snapshot
+
+    def metrics_prometheus(self) -> str:
+        """The same metrics in the Prometheus text exposition format."""
+        return self.metrics.prometheus(prefix="contract_agent_")
+
+    def profile(self):
+        """`with AGENT.profile() as p:` collects the metrics of the requests made in the block in p (a Metrics)."""
+        return self.metrics.profile()
+
+    def history_stats(self) -> dict:
+        """Summary cache and truncation counters of the history manager (empty when it is off)."""
+        return self.history.stats if self.history else {}
+
+    def summarize_history(self, previous: str, turns: list[list[dict[str, Any]]]) -> str:
+        """Extends the rolling summary of a session with the turns that left the verbatim window."""
+        content = (f"Resumo até aqui:\n{previous}\n\n" if previous else "") + "Conversa a resumir:\n" + render_turns(turns)
+        response = self.model_serving_client.chat.completions.create(
+            model=self.llm_endpoint,
+            messages=[{"role": "system", "content": HISTORY_SUMMARY_PROMPT}, {"role": "user", "content": content}],
+        )
+        return response.choices[0].message.content or ""
+
+    def fit_history(self, messages: list[dict[str, Any]], session_id: Optional[str]) -> list[dict[str, Any]]:
+        """The request's messages under the prompt ceiling: recent turns verbatim, older ones summarized."""
+        if self.history is None:
+            return messages
+        fitted, report = self.history.fit(messages, session_id)
+        if report.summarized_turns or report.truncated:
+            mlflow.update_current_trace(tags={
+                "history.summarized_turns": str(report.summarized_turns),
+                "history.summary": report.summary,
+                "history.prompt_tokens": str(report.prompt_tokens),
+                "history.original_tokens": str(report.original_tokens),
+            })
+        return fitted
+
+    def start_prefetch(self, messages: list[dict[str, Any]]) -> Optional[Prefetch]:
+        """Searches the latest user message in the background when the request starts with one (None when off or skipped)."""
+        if self.prefetcher is None or not messages or messages[-1].get("role") != "user":
+            return None
+        tool_name = self.prefetcher.tool_name
+        content = messages[-1].get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        if tool_name not in self._tools_dict or not isinstance(content, str):
+            return None
+        return self.prefetcher.start(content, lambda query: self.execute_tool(tool_name=tool_name, args={"query": query}))
+
+    def finish_prefetch(self, prefetch: Optional[Prefetch]) -> None:
+        if prefetch is None:
+            return
+        mlflow.update_current_trace(tags={"prefetch": self.prefetcher.finish(prefetch)})
+
+    def new_compactor(self, messages: list[dict[str, Any]]) -> Optional[ContextCompactor]:
+        """A request's compactor, aware of the tool outputs already in its history (None when compaction is off)."""
+        if self.tool_budget_tokens is None:
+            return None
+        history = [
+            m.get("content") if m.get("role") == "tool" else m.get("output")
+            for m in messages if m.get("role") == "tool" or m.get("type") == "function_call_output"
+        ]
+        return ContextCompactor(self.tool_budget_tokens, history=[h for h in history if isinstance(h, str)])
+
+    def report_compaction(self, compactor: Optional[ContextCompactor]) -> None:
+        if compactor is None or not compactor.stats.calls:
+            return
+        self.compaction_totals.add(compactor.stats)
+        mlflow.update_current_trace(tags={
+            "context.tool_tokens_raw": str(compactor.stats.raw_tokens),
+            "context.tool_tokens": str(compactor.stats.tokens),
+            "context.tool_tokens_saved": str(compactor.stats.tokens_saved),
+        })
+
     @mlflow.trace(span_type=SpanType.TOOL)
     def execute_tool(self, tool_name: str, args: dict) -> Any:
         """Executes the specified tool with the given arguments."""
-        return self._tools_dict[tool_name].exec_fn(**args)
+        tool = self._tools_dict[tool_name]
+        with self.metrics.timer("tool_seconds", tool=tool_name):
+            try:
+                if self.retrieval_cache is None or not tool.cacheable:
+                    return tool.exec_fn(**args)
+                result, hit = self.retrieval_cache.get_or_compute(tool_name, args, lambda: tool.exec_fn(**args))
+            except Exception:
+                self.metrics.inc("tool_errors", tool=tool_name)
+                raise
+        self.metrics.inc("retrieval_cache", result="hit" if hit else "miss")
+        span = mlflow.get_current_active_span()
+        if span:
+            span.set_attribute("retrieval_cache_hit", hit)
+        return result
+
+    def open_llm_stream(self, endpoint: str, request: dict[str, Any]):
+        return self.llm_stream_client.chat.completions.create(model=endpoint, stream=True, **request)
+
+    def llm_request(self, messages: list[dict[str, Any]]) -> dict[str, Any]:
+        request = {"messages": to_chat_completions_input(messages), "tools": self.get_tool_specs()}
+        if LLM_STREAM_USAGE:
+            request["stream_options"] = {"include_usage": True}
+        return request
 
     def call_llm(self, messages: list[dict[str, Any]]) -> Generator[dict[str, Any], None, None]:
+        request = self.llm_request(messages)
+        meter = LLMCallMeter(self.metrics, request)
         with warnings.catch_warnings():
             warnings.filterwarnings("ignore", message="PydanticSerializationUnexpectedValue")
-            for chunk in self.model_serving_client.chat.completions.create(
-                model=self.llm_endpoint,
-                messages=to_chat_completions_input(messages),
-                tools=self.get_tool_specs(),
-                stream=True,
-            ):
-                chunk_dict = chunk.to_dict()
-                if len(chunk_dict.get("choices", [])) > 0:
-                    yield chunk_dict
-
-    def handle_tool_call(
+            try:
+                for chunk in self.llm.stream(request):
+                    chunk_dict = chunk.to_dict()
+                    meter.add(chunk_dict)
+                    if len(chunk_dict.get("choices", [])) > 0:
+                        yield chunk_dict
+            except Exception:
+                self.metrics.inc("llm_errors")
+                raise
+            finally:
+                meter.done()
+
+    def run_tool_call(
         self,
         tool_call: dict[str, Any],
+        compactor: Optional[ContextCompactor] = None,
+        prefetch: Optional[Prefetch] = None,
+    ) -> str:
+        args = json.loads(tool_call["arguments"])
+        hit, result = self.prefetcher.claim(prefetch, tool_call["name"], args) if prefetch else (False, None)
+        if not hit:
+            result = self.execute_tool(tool_name=tool_call["name"], args=args)
+        # every output counts against the request's budget; retrieval results are also compacted
+        # (the cache keeps them raw), the rest pass through as str()
+        if compactor is not None:
+            return compactor.compact(result)
+        return str(result)
+
+    def handle_tool_calls(
+        self,
+        tool_calls: list[dict[str, Any]],
         messages: list[dict[str, Any]],
-    ) -> ResponsesAgentStreamEvent:
+        compactor: Optional[ContextCompactor] = None,
+        prefetch: Optional[Prefetch] = None,
+    ) -> Generator[ResponsesAgentStreamEvent, None, None]:
         """
-        Execute tool calls, add them to the running message history, and return a ResponsesStreamEvent w/ tool output
+        Execute the tool calls of a turn in parallel, stream a ResponsesStreamEvent w/ each tool output as it
+        finishes, then add the outputs to the running message history in call order. A failed or timed-out
+        call returns its error as the output, so the model can answer with the other results.
         """
-        args = json.loads(tool_call["arguments"])
-        result = str(self.execute_tool(tool_name=tool_call["name"], args=args))
-
-        tool_call_output = self.create_function_call_output_item(tool_call["call_id"], result)
-        messages.append(tool_call_output)
-        return ResponsesAgentStreamEvent(type="response.output_item.done", item=tool_call_output)
+        outputs = [None] * len(tool_calls)
+        runs = [lambda call=call: self.run_tool_call(call, compactor, prefetch) for call in tool_calls]
+        for result in self.tool_runner.run(runs):
+            tool_call = tool_calls[result.index]
+            output = result.output if result.error is None else result.error
+            if result.timed_out:
+                self.metrics.inc("tool_timeouts", tool=tool_call["name"])
+            elif result.rejected:
+                self.metrics.inc("tool_capacity_exhausted", tool=tool_call["name"])
+            outputs[result.index] = self.create_function_call_output_item(tool_call["call_id"], output)
+            yield ResponsesAgentStreamEvent(type="response.output_item.done", item=outputs[result.index])
+        messages.extend(outputs)
+
+    @staticmethod
+    def pending_tool_calls(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """The function calls at the end of the history: everything the model asked for in its last turn."""
+        calls = []
+        for msg in reversed(messages):
+            if msg.get("type", None) != "function_call":
+                break
+            calls.append(msg)
+        return calls[::-1]
 
     def call_and_run_tools(
         self,
         messages: list[dict[str, Any]],
         max_iter: int = 10,
+        compactor: Optional[ContextCompactor] = None,
+        prefetch: Optional[Prefetch] = None,
     ) -> Generator[ResponsesAgentStreamEvent, None, None]:
-        for _ in range(max_iter):
+        for iteration in range(max_iter):
             last_msg = messages[-1]
             if last_msg.get("role", None) == "assistant":
+                self.metrics.observe("agent_iterations", iteration)
                 return
             elif last_msg.get("type", None) == "function_call":
-                yield self.handle_tool_call(last_msg, messages)
+                yield from self.handle_tool_calls(self.pending_tool_calls(messages), messages, compactor, prefetch)
             else:
                 yield from output_to_responses_items_stream(
                     chunks=self.call_llm(messages), aggregator=messages
                 )
 
+        self.metrics.observe("agent_iterations", max_iter)
         yield ResponsesAgentStreamEvent(
             type="response.output_item.done",
-            item=self.create_text_output_item("Max iterations reached. Stopping.", str(uuid4())),
+            item=self.create_text_output_item(MAX_ITERATIONS_MESSAGE, str(uuid4())),
         )
 
-    def predict(self, request: ResponsesAgentRequest) -> ResponsesAgentResponse:
+    @staticmethod
+    def tag_session(request: ResponsesAgentRequest) -> Optional[str]:
+        """Tags the trace with the request's session id (custom_inputs or conversation id) and returns it."""
         session_id = None
         if request.custom_inputs and "session_id" in request.custom_inputs:
             session_id = request.custom_inputs.get("session_id")
@@ -179,7 +596,33 @@ class ToolCallingAgent(ResponsesAgent):
                     "mlflow.trace.session": session_id,
                 }
             )
+        return session_id
+
+    def start_request(self, request: ResponsesAgentRequest) -> tuple:
+        """
+        (session_id, answer cache key, cached answer) of a request: the cached answer is (answer, similarity)
+        when it can be replayed instead of calling the LLM, else None.
+        """
+        session_id = self.tag_session(request)
+        cache_key = self.answer_cache_key(request)
+        bypass = bool(request.custom_inputs and request.custom_inputs.get("bypass_answer_cache"))
+        if cache_key and not bypass:
+            answer, similarity = self.answer_cache.lookup(cache_key[1], cache_key[2])
+            mlflow.update_current_trace(tags={"answer_cache": "hit" if answer else "miss"})
+            self.metrics.inc("answer_cache", result="hit" if answer else "miss")
+            if answer:
+                return session_id, cache_key, (answer, similarity)
+        return session_id, cache_key, None
+
+    @staticmethod
+    def request_messages(request: ResponsesAgentRequest) -> list[dict[str, Any]]:
+        messages = to_chat_completions_input([i.model_dump() for i in request.input])
+        if SYSTEM_PROMPT:
+            messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+        return messages
 
+    def predict(self, request: ResponsesAgentRequest) -> ResponsesAgentResponse:
+        self.tag_session(request)
         outputs = [
             event.item
             for event in self.predict_stream(request)
@@ -188,26 +631,246 @@ class ToolCallingAgent(ResponsesAgent):
         return ResponsesAgentResponse(output=outputs, custom_outputs=request.custom_inputs)
 
     def predict_stream(self, request: ResponsesAgentRequest) -> Generator[ResponsesAgentStreamEvent, None, None]:
-        session_id = None
-        if request.custom_inputs and "session_id" in request.custom_inputs:
-            session_id = request.custom_inputs.get("session_id")
-        elif request.context and request.context.conversation_id:
-            session_id = request.context.conversation_id
+        with self.metrics.timer("request_seconds"):
+            session_id, cache_key, cached = self.start_request(request)
+            if cached:
+                yield from self.replay_answer(*cached)
+                return
 
-        if session_id:
-            mlflow.update_current_trace(
-                metadata={
-                    "mlflow.trace.session": session_id,
-                }
+            messages = self.request_messages(request)
+            # runs during history folding and the first LLM call
+            prefetch = self.start_prefetch(messages)
+            try:
+                messages = self.fit_history(messages, session_id)
+                compactor = self.new_compactor(messages)
+                items = []
+                for event in self.call_and_run_tools(messages=messages, compactor=compactor, prefetch=prefetch):
+                    if event.type == "response.output_item.done":
+                        items.append(event.item)
+                    yield event
+            finally:
+                self.finish_prefetch(prefetch)
+            self.report_compaction(compactor)
+            if cache_key:
+                self.store_answer(cache_key, items, session_id)
+
+    def answer_cache_key(self, request: ResponsesAgentRequest) -> Optional[tuple]:
+        """
+        (question, embedding, namespace) of a single-turn request, None when the answer cache is off,
+        the request has history (a follow-up depends on it) or the question can not be embedded.
+        """
+        if self.answer_cache is None or len(request.input) != 1:
+            return None
+        item = request.input[0].model_dump()
+        content = item.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        if item.get("role") != "user" or not isinstance(content, str) or not content.strip():
+            return None
+        try:
+            vector = self.answer_cache.embed(content)
+        except Exception:
+            return None
+        namespace = answer_namespace(SYSTEM_PROMPT, self.llm_endpoint, self.answer_cache.index_version())
+        return content, vector, namespace
+
+    def replay_answer(self, answer: CachedAnswer, similarity: float) -> Generator[ResponsesAgentStreamEvent, None, None]:
+        """Streams a cached answer as the LLM would have: a text delta, then the done item, per message."""
+        mlflow.update_current_trace(tags={
+            "answer_cache.similarity": f"{similarity:.4f}",
+            "answer_cache.question": answer.question[:250],
+            "answer_cache.created_at": str(answer.provenance.get("created_at")),
+        })
+        for text in answer.texts:
+            item_id = str(uuid4())
+            yield ResponsesAgentStreamEvent(**self.create_text_delta(delta=text, item_id=item_id))
+            yield ResponsesAgentStreamEvent(
+                type="response.output_item.done", item=self.create_text_output_item(text, item_id)
             )
 
-        messages = to_chat_completions_input([i.model_dump() for i in request.input])
-        if SYSTEM_PROMPT:
-            messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
-        yield from self.call_and_run_tools(messages=messages)
+    def store_answer(self, cache_key: tuple, items: list[dict], session_id: Optional[str]) -> None:
+        texts = [
+            part.get("text", "")
+            for item in items if item.get("type") == "message"
+            for part in item.get("content", []) if part.get("type") == "output_text"
+        ]
+        if not texts or texts[-1] == MAX_ITERATIONS_MESSAGE:
+            return
+        question, vector, namespace = cache_key
+        tools = [{"name": i.get("name"), "arguments": i.get("arguments")} for i in items if i.get("type") == "function_call"]
+        self.answer_cache.store(vector, namespace, question, texts, {
+            "model": self.llm_endpoint,
+            "index_version": self.answer_cache.index_version(),
+            "session_id": session_id,
+            "tool_calls": tools,
+        })
+
+
+class AsyncToolCallingAgent(ToolCallingAgent):
+    """
+    ToolCallingAgent on asyncio: the LLM stream is read with an async OpenAI client and the tool calls of
+    a turn are awaited together, so a conversation waiting on the model holds no thread. Emits the same
+    event sequence as the sync agent. predict/predict_stream stay synchronous for ResponsesAgent: they
+    drive apredict_stream on one event loop shared by all requests, with the calling thread blocked until
+    the stream ends, so only a host that awaits apredict_stream itself serves more sessions per thread.
+    """
+
+    def __init__(self, *args, io_threads: int = ASYNC_IO_THREADS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_client = Lazy(self.create_async_openai_client, "async_openai_client", STARTUP)
+        self.bridge = SyncBridge(io_workers=io_threads)
+        self.llm.open_astream = self.open_llm_astream
+
+    @property
+    def async_client(self):
+        return self._async_client.get()
+
+    def create_async_openai_client(self):
+        OPENAI_TRACING.get()
+        return databricks_async_openai_client(self.workspace_client).with_options(max_retries=0)
+
+    def warmup_steps(self) -> dict[str, Callable[[], Any]]:
+        return {**super().warmup_steps(), "async_openai_client": lambda: self.async_client}
+
+    def open_llm_astream(self, endpoint: str, request: dict[str, Any]):
+        return self.async_client.chat.completions.create(model=endpoint, stream=True, **request)
+
+    async def acall_llm(self, messages: list[dict[str, Any]]) -> AsyncGenerator[dict[str, Any], None]:
+        request = self.llm_request(messages)
+        meter = LLMCallMeter(self.metrics, request)
+        try:
+            # the stream is closed by the client when the request is cancelled (client gone)
+            async for chunk in self.llm.astream(request):
+                with warnings.catch_warnings():
+                    warnings.filterwarnings("ignore", message="PydanticSerializationUnexpectedValue")
+                    chunk_dict = chunk.to_dict()
+                meter.add(chunk_dict)
+                if len(chunk_dict.get("choices", [])) > 0:
+                    yield chunk_dict
+        except Exception:
+            self.metrics.inc("llm_errors")
+            raise
+        finally:
+            meter.done()
+
+    async def astream_llm_turn(self, messages: list[dict[str, Any]]) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+        """Async output_to_responses_items_stream: text deltas as they arrive, then the done items, added to messages."""
+        text, msg_id, tool_calls = "", None, {}
+        async for chunk in self.acall_llm(messages):
+            msg_id = chunk.get("id") or msg_id
+            delta = chunk["choices"][0].get("delta") or {}
+            if isinstance(delta.get("content"), str) and delta["content"]:
+                text += delta["content"]
+                yield ResponsesAgentStreamEvent(**self.create_text_delta(delta=delta["content"], item_id=msg_id))
+            for tc in delta.get("tool_calls") or []:
+                call = tool_calls.setdefault(tc.get("index", 0), {"id": None, "name": "", "arguments": ""})
+                call["id"] = call["id"] or tc.get("id")
+                call["name"] += (tc.get("function") or {}).get("name") or ""
+                call["arguments"] += (tc.get("function") or {}).get("arguments") or ""
+        items = [self.create_text_output_item(text, msg_id)] if text else []
+        items += [
+            self.create_function_call_item(str(uuid4()), call["id"], call["name"], call["arguments"])
+            for _, call in sorted(tool_calls.items())
+        ]
+        for item in items:
+            messages.append(item)
+            yield ResponsesAgentStreamEvent(type="response.output_item.done", item=item)
+
+    async def ahandle_tool_calls(
+        self,
+        tool_calls: list[dict[str, Any]],
+        messages: list[dict[str, Any]],
+        compactor: Optional[ContextCompactor] = None,
+        prefetch: Optional[Prefetch] = None,
+    ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+        """handle_tool_calls on the event loop: each blocking tool call runs on its own thread (see ParallelToolRunner)."""
+        slots = asyncio.Semaphore(self.tool_runner.max_workers)
+        timeout_s = self.tool_runner.timeout_s
+
+        async def run(index: int, tool_call: dict[str, Any]) -> tuple:
+            async with slots:
+                try:
+                    call = run_in_thread(lambda: self.run_tool_call(tool_call, compactor, prefetch))
+                    output = await asyncio.wait_for(asyncio.wrap_future(call), timeout_s)
+                except asyncio.TimeoutError:
+                    self.metrics.inc("tool_timeouts", tool=tool_call["name"])
+                    output = f"Error: tool call timed out after {timeout_s:g} s"
+                except ToolCapacityExhausted as e:
+                    self.metrics.inc("tool_capacity_exhausted", tool=tool_call["name"])
+                    output = f"Error: {e}"
+                except Exception as e:
+                    output = f"Error: {type(e).__name__}: {e}"
+            return index, output
+
+        outputs = [None] * len(tool_calls)
+        tasks = [asyncio.ensure_future(run(i, call)) for i, call in enumerate(tool_calls)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, output = await next_done
+                outputs[index] = self.create_function_call_output_item(tool_calls[index]["call_id"], output)
+                yield ResponsesAgentStreamEvent(type="response.output_item.done", item=outputs[index])
+        finally:
+            for task in tasks:
+                task.cancel()
+        messages.extend(outputs)
+
+    async def acall_and_run_tools(
+        self,
+        messages: list[dict[str, Any]],
+        max_iter: int = 10,
+        compactor: Optional[ContextCompactor] = None,
+        prefetch: Optional[Prefetch] = None,
+    ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+        for iteration in range(max_iter):
+            last_msg = messages[-1]
+            if last_msg.get("role", None) == "assistant":
+                self.metrics.observe("agent_iterations", iteration)
+                return
+            elif last_msg.get("type", None) == "function_call":
+                async for event in self.ahandle_tool_calls(self.pending_tool_calls(messages), messages, compactor, prefetch):
+                    yield event
+            else:
+                async for event in self.astream_llm_turn(messages):
+                    yield event
+
+        self.metrics.observe("agent_iterations", max_iter)
+        yield ResponsesAgentStreamEvent(
+            type="response.output_item.done",
+            item=self.create_text_output_item(MAX_ITERATIONS_MESSAGE, str(uuid4())),
+        )
+
+    async def apredict_stream(self, request: ResponsesAgentRequest) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+        with self.metrics.timer("request_seconds"):
+            # the answer cache embeds the question over HTTP: off the loop
+            session_id, cache_key, cached = await asyncio.to_thread(self.start_request, request)
+            if cached:
+                for event in self.replay_answer(*cached):
+                    yield event
+                return
+
+            messages = self.request_messages(request)
+            prefetch = self.start_prefetch(messages)
+            try:
+                # folding old turns may call the LLM for the summary: off the loop
+                messages = await asyncio.to_thread(self.fit_history, messages, session_id)
+                compactor = self.new_compactor(messages)
+                items = []
+                async for event in self.acall_and_run_tools(messages=messages, compactor=compactor, prefetch=prefetch):
+                    if event.type == "response.output_item.done":
+                        items.append(event.item)
+                    yield event
+            finally:
+                self.finish_prefetch(prefetch)
+            self.report_compaction(compactor)
+            if cache_key:
+                await asyncio.to_thread(self.store_answer, cache_key, items, session_id)
+
+    def predict_stream(self, request: ResponsesAgentRequest) -> Generator[ResponsesAgentStreamEvent, None, None]:
+        yield from self.bridge.iterate(self.apredict_stream(request))
 
 
 # Log the model using MLflow
-mlflow.openai.autolog()
-AGENT = ToolCallingAgent(llm_endpoint=LLM_ENDPOINT_NAME, tools=TOOL_INFOS)
+AGENT = (AsyncToolCallingAgent if USE_ASYNC_AGENT else ToolCallingAgent)(
+    llm_endpoint=LLM_ENDPOINT_NAME, tools=TOOL_INFOS.get, retrieval_cache=RETRIEVAL_CACHE, answer_cache=ANSWER_CACHE
+)
 mlflow.models.set_model(AGENT)
@@ -31,33 +31,60 @@
 # COMMAND ----------
 
 # MAGIC %%writefile agent.py
+# MAGIC import asyncio
 # MAGIC import json
-# MAGIC from typing import Any, Callable, Generator, Optional
+# MAGIC import threading
+# MAGIC from typing import Any, AsyncGenerator, Callable, Generator, Optional, Union
 # MAGIC from uuid import uuid4
 # MAGIC import warnings
 # MAGIC
-# MAGIC import backoff
-# MAGIC import mlflow
-# MAGIC import openai
-# MAGIC from databricks.sdk import WorkspaceClient
-# MAGIC from databricks_openai import UCFunctionToolkit, VectorSearchRetrieverTool
-# MAGIC from mlflow.entities import SpanType
-# MAGIC from mlflow.pyfunc import ResponsesAgent
-# MAGIC from mlflow.types.responses import (
-# MAGIC     ResponsesAgentRequest,
-# MAGIC     ResponsesAgentResponse,
-# MAGIC     ResponsesAgentStreamEvent,
-# MAGIC     output_to_responses_items_stream,
-# MAGIC     to_chat_completions_input,
-# MAGIC )
-# MAGIC from openai import OpenAI
-# MAGIC from pydantic import BaseModel
-# MAGIC from unitycatalog.ai.core.base import get_uc_function_client
+# MAGIC # repo modules: the repo root is on sys.path in a Git folder, and code/ once logged with code_paths
+# MAGIC from src.lib.startup import Lazy, StartupProfiler, format_report, run_concurrently
+# MAGIC
+# MAGIC # cold start: imports, client construction and warmup are timed per component (AGENT.startup_report())
+# MAGIC STARTUP = StartupProfiler()
+# MAGIC
+# MAGIC with STARTUP.step("import:mlflow"):
+# MAGIC     import mlflow
+# MAGIC     from mlflow.entities import SpanType
+# MAGIC     from mlflow.pyfunc import ResponsesAgent
+# MAGIC     from mlflow.types.responses import (
+# MAGIC         ResponsesAgentRequest,
+# MAGIC         ResponsesAgentResponse,
+# MAGIC         ResponsesAgentStreamEvent,
+# MAGIC         output_to_responses_items_stream,
+# MAGIC         to_chat_completions_input,
+# MAGIC     )
+# MAGIC with STARTUP.step("import:openai"):
+# MAGIC     import backoff
+# MAGIC     import openai
+# MAGIC     from openai import OpenAI
+# MAGIC     from pydantic import BaseModel
+# MAGIC with STARTUP.step("import:databricks"):
+# MAGIC     from databricks.sdk import WorkspaceClient
+# MAGIC     from databricks.vector_search.client import VectorSearchClient
+# MAGIC     from databricks_openai import UCFunctionToolkit, VectorSearchRetrieverTool
+# MAGIC     from unitycatalog.ai.core.base import get_uc_function_client
+# MAGIC with STARTUP.step("import:repo"):
+# MAGIC     from src.lib.aio import SyncBridge, databricks_async_openai_client
+# MAGIC     from src.lib.answer_cache import CachedAnswer, SemanticAnswerCache, answer_namespace
+# MAGIC     from src.lib.bm25 import BM25Index, HybridRetriever, hybrid_tool_spec, vector_search_fn
+# MAGIC     from src.lib.context_compaction import CompactionTotals, ContextCompactor
+# MAGIC     from src.lib.embeddings import ServingEndpointEmbedder
+# MAGIC     from src.lib.history import HistoryManager, render_turns
+# MAGIC     from src.lib.index_sync import indexed_version
+# MAGIC     from src.lib.llm_client import ResilientLLMClient
+# MAGIC     from src.lib.metrics import AGENT_BUCKETS, LLMCallMeter, Metrics, format_snapshot
+# MAGIC     from src.lib.prefetch import Prefetch, RetrievalPrefetcher
+# MAGIC     from src.lib.retrieval_cache import RetrievalCache, VersionPoller
+# MAGIC     from src.lib.tool_exec import ParallelToolRunner, ToolCapacityExhausted, run_in_thread
 # MAGIC
 # MAGIC ############################################
 # MAGIC # Define your LLM endpoint and system prompt
 # MAGIC ############################################
 # MAGIC LLM_ENDPOINT_NAME = "databricks-gpt-5-2"
+# MAGIC # tried in order when the primary endpoint's retries are exhausted or its circuit breaker is open
+# MAGIC LLM_FALLBACK_ENDPOINTS = []
 # MAGIC
 # MAGIC SYSTEM_PROMPT = """Você é uma analista de compras e responde perguntas sobre contratos. 
 # MAGIC Não investe respostas se não encontrar nos documentos. 
@@ -79,14 +106,16 @@
 # MAGIC     - "name" (str): The name of the tool.
 # MAGIC     - "spec" (dict): JSON description of the tool (matches OpenAI Responses format)
 # MAGIC     - "exec_fn" (Callable): Function that implements the tool logic
+# MAGIC     - "cacheable" (bool): read-only retrieval tool whose results can be served from the retrieval cache
 # MAGIC     """
 # MAGIC
 # MAGIC     name: str
 # MAGIC     spec: dict
 # MAGIC     exec_fn: Callable
+# MAGIC     cacheable: bool = False
 # MAGIC
 # MAGIC
-# MAGIC def create_tool_info(tool_spec, exec_fn_param: Optional[Callable] = None):
+# MAGIC def create_tool_info(tool_spec, exec_fn_param: Optional[Callable] = None, cacheable: bool = False):
 # MAGIC     tool_spec["function"].pop("strict", None)
 # MAGIC     tool_name = tool_spec["function"]["name"]
 # MAGIC     udf_name = tool_name.replace("__", ".")
@@ -94,117 +123,505 @@
 # MAGIC     # Define a wrapper that accepts kwargs for the UC tool call,
 # MAGIC     # then passes them to the UC tool execution client
 # MAGIC     def exec_fn(**kwargs):
-# MAGIC         function_result = uc_function_client.execute_function(udf_name, kwargs)
+# MAGIC         function_result = UC_FUNCTION_CLIENT.get().execute_function(udf_name, kwargs)
 # MAGIC         if function_result.error is not None:
 # MAGIC             return function_result.error
 # MAGIC         else:
 # MAGIC             return function_result.value
-# MAGIC     return ToolInfo(name=tool_name, spec=tool_spec, exec_fn=exec_fn_param or exec_fn)
+# MAGIC     return ToolInfo(name=tool_name, spec=tool_spec, exec_fn=exec_fn_param or exec_fn, cacheable=cacheable)
 # MAGIC
 # MAGIC
-# MAGIC TOOL_INFOS = []
+# MAGIC # Clients and tools are built on first use (or by AGENT.warmup()), not when agent.py is imported:
+# MAGIC # logging and validating the model do not wait on the workspace.
 # MAGIC
 # MAGIC # You can use UDFs in Unity Catalog as agent tools
 # MAGIC # TODO: Add additional tools
 # MAGIC UC_TOOL_NAMES = []
 # MAGIC
-# MAGIC uc_toolkit = UCFunctionToolkit(function_names=UC_TOOL_NAMES)
-# MAGIC uc_function_client = get_uc_function_client()
-# MAGIC for tool_spec in uc_toolkit.tools:
-# MAGIC     TOOL_INFOS.append(create_tool_info(tool_spec))
+# MAGIC UC_FUNCTION_CLIENT = Lazy(get_uc_function_client, "uc_function_client", STARTUP)
 # MAGIC
 # MAGIC
-# MAGIC # Use Databricks vector search indexes as tools
-# MAGIC # See [docs](https://docs.databricks.com/generative-ai/agent-framework/unstructured-retrieval-tools.html) for details
+# MAGIC def uc_tools() -> list[ToolInfo]:
+# MAGIC     if not UC_TOOL_NAMES:
+# MAGIC         return []
+# MAGIC     uc_toolkit = UCFunctionToolkit(function_names=UC_TOOL_NAMES)
+# MAGIC     return [create_tool_info(tool_spec) for tool_spec in uc_toolkit.tools]
+# MAGIC
 # MAGIC
 # MAGIC # Use Databricks vector search indexes as tools
 # MAGIC # See the [Databricks Documentation](https://docs.databricks.com/generative-ai/agent-framework/unstructured-retrieval-tools.html) for details
-# MAGIC VECTOR_SEARCH_TOOLS = []
-# MAGIC VECTOR_SEARCH_TOOLS.append(
+# MAGIC VECTOR_SEARCH_INDEX = "fabio_goncalves.contract_agent.contracts_chunks_vs"
+# MAGIC
+# MAGIC
+# MAGIC def vector_search_tools() -> list[VectorSearchRetrieverTool]:
+# MAGIC     return [
 # MAGIC         VectorSearchRetrieverTool(
-# MAGIC             index_name="fabio_goncalves.contract_agent.contracts_chunks_vs",
+# MAGIC             index_name=VECTOR_SEARCH_INDEX,
 # MAGIC             # TODO: specify index description for better agent tool selection
 # MAGIC             # tool_description=""
 # MAGIC         )
-# MAGIC     )
-# MAGIC for vs_tool in VECTOR_SEARCH_TOOLS:
-# MAGIC     TOOL_INFOS.append(create_tool_info(vs_tool.tool, vs_tool.execute))
+# MAGIC     ]
+# MAGIC
+# MAGIC
+# MAGIC VECTOR_SEARCH_TOOLS = Lazy(vector_search_tools, "vector_search_tools", STARTUP)
+# MAGIC # one index handle for the hybrid retriever and the version poller
+# MAGIC VECTOR_INDEX = Lazy(
+# MAGIC     lambda: VectorSearchClient(disable_notice=True).get_index(index_name=VECTOR_SEARCH_INDEX), "vector_index", STARTUP
+# MAGIC )
+# MAGIC
+# MAGIC
+# MAGIC # Hybrid search: BM25 (built by src/notebooks/02, exact terms like "D+30" or "cláusula 7") fused
+# MAGIC # with the vector index above. Logged as the "bm25_index" artifact; the Volume path is used when
+# MAGIC # the agent runs from the notebook.
+# MAGIC BM25_INDEX_PATH = "/Volumes/fabio_goncalves/contract_agent/contracts_ptbr/_bm25/contracts_chunks_dedup_bm25.npz"
+# MAGIC HYBRID_COLUMNS = ["chunk_uid", "doc_name", "page", "content"]
+# MAGIC
+# MAGIC _hybrid = {"path": BM25_INDEX_PATH, "retriever": None}
+# MAGIC _hybrid_lock = threading.Lock()
+# MAGIC
+# MAGIC
+# MAGIC def get_hybrid_retriever() -> HybridRetriever:
+# MAGIC     # built on first use: importing agent.py (logging, validation) does not read the index
+# MAGIC     with _hybrid_lock:
+# MAGIC         if _hybrid["retriever"] is None:
+# MAGIC             index = VECTOR_INDEX.get()
+# MAGIC             with STARTUP.step("init:bm25_index"):
+# MAGIC                 bm25 = BM25Index.load(_hybrid["path"])
+# MAGIC             _hybrid["retriever"] = HybridRetriever(bm25, vector_search_fn(index, HYBRID_COLUMNS), columns=HYBRID_COLUMNS)
+# MAGIC         return _hybrid["retriever"]
+# MAGIC
+# MAGIC
+# MAGIC def hybrid_search(query: str) -> list[dict]:
+# MAGIC     rows = get_hybrid_retriever().retrieve(query, k=5)
+# MAGIC     return [{"doc_name": r["doc_name"], "page": r["page"], "content": r["content"]} for r in rows]
 # MAGIC
 # MAGIC
+# MAGIC def load_tools() -> list[ToolInfo]:
+# MAGIC     """The agent's tools. The UC toolkit and the Vector Search tool are built at the same time."""
+# MAGIC     built, errors = run_concurrently({"uc_tools": uc_tools, "vector_search_tools": VECTOR_SEARCH_TOOLS.get}, STARTUP, kind="tools")
+# MAGIC     if errors:
+# MAGIC         raise next(iter(errors.values()))
+# MAGIC     tools = built["uc_tools"]
+# MAGIC     tools += [create_tool_info(vs_tool.tool, vs_tool.execute, cacheable=True) for vs_tool in built["vector_search_tools"]]
+# MAGIC     tools.append(create_tool_info(hybrid_tool_spec(), hybrid_search, cacheable=True))
+# MAGIC     return tools
+# MAGIC
+# MAGIC
+# MAGIC TOOL_INFOS = Lazy(load_tools, "tools", STARTUP)
+# MAGIC
+# MAGIC
+# MAGIC # Retrieval cache: repeat questions skip the Vector Search round trip. Entries are dropped when the
+# MAGIC # index has processed a new version of its source table (checked at most every 30 s).
+# MAGIC def vector_index_version() -> Optional[int]:
+# MAGIC     return indexed_version(VECTOR_INDEX.get().describe())
+# MAGIC
+# MAGIC
+# MAGIC INDEX_VERSION = VersionPoller(vector_index_version, check_s=30)
+# MAGIC RETRIEVAL_CACHE = RetrievalCache(
+# MAGIC     max_entries=1024, max_bytes=32 << 20, ttl_s=600, version_fn=INDEX_VERSION.current, version_check_s=0
+# MAGIC )
+# MAGIC
+# MAGIC # Semantic answer cache (opt-in): a single-turn question close enough (cosine >= threshold) to one
+# MAGIC # already answered under the same system prompt, model and index version is answered from the cache,
+# MAGIC # without calling the LLM. Requests with custom_inputs {"bypass_answer_cache": true} skip the lookup
+# MAGIC # and refresh the cached answer.
+# MAGIC ANSWER_CACHE_ENABLED = False
+# MAGIC ANSWER_CACHE_EMBEDDING_ENDPOINT = "databricks-bge-large-en"
+# MAGIC ANSWER_CACHE = SemanticAnswerCache(
+# MAGIC     ServingEndpointEmbedder(ANSWER_CACHE_EMBEDDING_ENDPOINT), threshold=0.95, max_entries=512,
+# MAGIC     ttl_s=3600, version_fn=INDEX_VERSION.current, version_check_s=0,
+# MAGIC ) if ANSWER_CACHE_ENABLED else None
+# MAGIC MAX_ITERATIONS_MESSAGE = "Max iterations reached. Stopping."
+# MAGIC
+# MAGIC # function calls of one LLM turn run at the same time (a turn costs its slowest call, not the sum), at most
+# MAGIC # MAX_PARALLEL_TOOL_CALLS at once per request, each on its own thread; TOOL_TIMEOUT_S counts from the call's start
+# MAGIC MAX_PARALLEL_TOOL_CALLS = 4
+# MAGIC TOOL_TIMEOUT_S = 30
+# MAGIC
+# MAGIC # retrieval outputs enter the prompt as compact citations, without chunks the conversation already has,
+# MAGIC # within this many (estimated) tokens per request; None sends str() of the raw results
+# MAGIC TOOL_OUTPUT_BUDGET_TOKENS = 4000
+# MAGIC
+# MAGIC # LLM streams: jittered exponential retries before the first token, a time-to-first-token deadline, a
+# MAGIC # circuit breaker per endpoint and, with LLM_HEDGE, a second request when no token came within the p95
+# MAGIC LLM_MAX_RETRIES = 3
+# MAGIC LLM_TTFT_TIMEOUT_S = 30
+# MAGIC LLM_HEDGE = False
+# MAGIC # ask the endpoint for token usage at the end of each stream (metrics); estimated when it sends none
+# MAGIC LLM_STREAM_USAGE = True
+# MAGIC
+# MAGIC # speculative retrieval (opt-in): PREFETCH_TOOL searches the user's question while the first LLM call is in
+# MAGIC # flight; when the model then calls that tool with a query whose terms are (PREFETCH_MIN_SIMILARITY of them)
+# MAGIC # in the question, it gets the prefetched result. Prefetching pauses while more than PREFETCH_MAX_WASTE of the
+# MAGIC # recent prefetches go unused (probing one request in 10)
+# MAGIC PREFETCH_RETRIEVAL = False
+# MAGIC PREFETCH_TOOL = hybrid_tool_spec()["function"]["name"]
+# MAGIC PREFETCH_MIN_SIMILARITY = 0.8
+# MAGIC PREFETCH_MAX_WASTE = 0.5
+# MAGIC
+# MAGIC # long sessions: the last HISTORY_KEEP_TURNS turns are sent verbatim, older ones as a rolling summary kept per
+# MAGIC # session_id and extended incrementally; history + tool outputs stay under MAX_PROMPT_TOKENS (estimated)
+# MAGIC HISTORY_KEEP_TURNS = 6
+# MAGIC MAX_PROMPT_TOKENS = 16000
+# MAGIC HISTORY_SUMMARY_PROMPT = """Resuma a conversa entre o analista e a assistente de contratos para que ela continue sem o histórico completo. Em tópicos curtos e em pt-br, mantenha as perguntas feitas, as respostas dadas (valores, prazos, percentuais, cláusulas) e as fontes citadas (documento e página). Não acrescente informações que não estejam na conversa."""
+# MAGIC
+# MAGIC # AsyncToolCallingAgent: conversations waiting on the LLM stream hold no thread when a native async host awaits
+# MAGIC # apredict_stream. Behind ResponsesAgent's synchronous predict/predict_stream (model serving) every request still
+# MAGIC # blocks its serving thread until the stream ends, so throughput matches the sync agent (python -m src.lib.agent_bench)
+# MAGIC USE_ASYNC_AGENT = False
+# MAGIC ASYNC_IO_THREADS = 32
+# MAGIC
+# MAGIC # model serving: build the tools, clients, index handle and BM25 index in load_context (concurrently), so
+# MAGIC # the first request does not pay for them; the startup report is printed to the serving logs
+# MAGIC WARMUP_ON_LOAD = True
+# MAGIC
+# MAGIC # MLflow traces of the OpenAI SDK calls, turned on with the first client
+# MAGIC OPENAI_TRACING = Lazy(mlflow.openai.autolog, "mlflow_openai_autolog", STARTUP)
+# MAGIC
 # MAGIC
 # MAGIC class ToolCallingAgent(ResponsesAgent):
 # MAGIC     """
 # MAGIC     Class representing a tool-calling Agent
 # MAGIC     """
 # MAGIC
-# MAGIC     def __init__(self, llm_endpoint: str, tools: list[ToolInfo]):
-# MAGIC         """Initializes the ToolCallingAgent with tools."""
+# MAGIC     def __init__(
+# MAGIC         self,
+# MAGIC         llm_endpoint: str,
+# MAGIC         tools: Union[list[ToolInfo], Callable[[], list[ToolInfo]]],
+# MAGIC         retrieval_cache: Optional[RetrievalCache] = None,
+# MAGIC         answer_cache: Optional[SemanticAnswerCache] = None,
+# MAGIC         max_parallel_tools: int = MAX_PARALLEL_TOOL_CALLS,
+# MAGIC         tool_timeout_s: float = TOOL_TIMEOUT_S,
+# MAGIC         tool_budget_tokens: Optional[int] = TOOL_OUTPUT_BUDGET_TOKENS,
+# MAGIC         history_keep_turns: int = HISTORY_KEEP_TURNS,
+# MAGIC         max_prompt_tokens: Optional[int] = MAX_PROMPT_TOKENS,
+# MAGIC         fallback_endpoints: tuple[str, ...] = tuple(LLM_FALLBACK_ENDPOINTS),
+# MAGIC         llm_max_retries: int = LLM_MAX_RETRIES,
+# MAGIC         llm_ttft_timeout_s: float = LLM_TTFT_TIMEOUT_S,
+# MAGIC         llm_hedge: bool = LLM_HEDGE,
+# MAGIC         metrics: Optional[Metrics] = None,
+# MAGIC         prefetch_tool: Optional[str] = PREFETCH_TOOL if PREFETCH_RETRIEVAL else None,
+# MAGIC     ):
+# MAGIC         """Initializes the ToolCallingAgent with tools (a list, or a function building it on first use)."""
 # MAGIC         self.llm_endpoint = llm_endpoint
-# MAGIC         self.workspace_client = WorkspaceClient()
-# MAGIC         self.model_serving_client: OpenAI = (
-# MAGIC             self.workspace_client.serving_endpoints.get_open_ai_client()
+# MAGIC         # per-stage latency, token and cache histograms/counters, apart from MLflow traces: see metrics_snapshot()
+# MAGIC         self.metrics = metrics or Metrics(buckets=AGENT_BUCKETS)
+# MAGIC         self.tool_budget_tokens = tool_budget_tokens
+# MAGIC         self.compaction_totals = CompactionTotals()
+# MAGIC         # the tool outputs of a request get their own budget: the history has what is left of the ceiling
+# MAGIC         self.history = HistoryManager(
+# MAGIC             self.summarize_history, keep_turns=history_keep_turns,
+# MAGIC             max_tokens=max_prompt_tokens - (tool_budget_tokens or 0),
+# MAGIC         ) if max_prompt_tokens else None
+# MAGIC         self.retrieval_cache = retrieval_cache
+# MAGIC         self.answer_cache = answer_cache
+# MAGIC         self.prefetcher = RetrievalPrefetcher(
+# MAGIC             prefetch_tool, min_similarity=PREFETCH_MIN_SIMILARITY, max_in_flight=max_parallel_tools,
+# MAGIC             max_waste=PREFETCH_MAX_WASTE, wait_s=tool_timeout_s, metrics=self.metrics,
+# MAGIC         ) if prefetch_tool else None
+# MAGIC         self.tool_runner = ParallelToolRunner(max_workers=max_parallel_tools, timeout_s=tool_timeout_s)
+# MAGIC         # clients are created on first use: see warmup()
+# MAGIC         self._workspace_client = Lazy(WorkspaceClient, "workspace_client", STARTUP)
+# MAGIC         self._model_serving_client = Lazy(self.create_openai_client, "openai_client", STARTUP)
+# MAGIC         # retries are left to self.llm: the SDK's own would retry after tokens were streamed
+# MAGIC         self._llm_stream_client = Lazy(lambda: self.model_serving_client.with_options(max_retries=0), "llm_stream_client")
+# MAGIC         self.llm = ResilientLLMClient(
+# MAGIC             self.open_llm_stream,
+# MAGIC             [llm_endpoint, *fallback_endpoints],
+# MAGIC             max_retries=llm_max_retries,
+# MAGIC             ttft_timeout_s=llm_ttft_timeout_s,
+# MAGIC             hedge=llm_hedge,
+# MAGIC             wait_gen=lambda: backoff.expo(factor=0.5, max_value=8),
+# MAGIC             jitter=backoff.full_jitter,
 # MAGIC         )
-# MAGIC         self._tools_dict = {tool.name: tool for tool in tools}
+# MAGIC         self._tools = Lazy(lambda: {tool.name: tool for tool in (tools() if callable(tools) else tools)}, "agent_tools")
+# MAGIC
+# MAGIC     @property
+# MAGIC     def workspace_client(self) -> WorkspaceClient:
+# MAGIC         return self._workspace_client.get()
+# MAGIC
+# MAGIC     @property
+# MAGIC     def model_serving_client(self) -> OpenAI:
+# MAGIC         return self._model_serving_client.get()
+# MAGIC
+# MAGIC     @property
+# MAGIC     def llm_stream_client(self) -> OpenAI:
+# MAGIC         return self._llm_stream_client.get()
+# MAGIC
+# MAGIC     @property
+# MAGIC     def _tools_dict(self) -> dict[str, ToolInfo]:
+# MAGIC         return self._tools.get()
+# MAGIC
+# MAGIC     def create_openai_client(self) -> OpenAI:
+# MAGIC         OPENAI_TRACING.get()
+# MAGIC         return self.workspace_client.serving_endpoints.get_open_ai_client()
+# MAGIC
+# MAGIC     def load_context(self, context):
+# MAGIC         """Uses the BM25 index logged with the model when served, then warms up (WARMUP_ON_LOAD)."""
+# MAGIC         path = (context.artifacts or {}).get("bm25_index")
+# MAGIC         if path:
+# MAGIC             with _hybrid_lock:
+# MAGIC                 _hybrid["path"], _hybrid["retriever"] = path, None
+# MAGIC         if WARMUP_ON_LOAD:
+# MAGIC             print(format_report(self.warmup()))
+# MAGIC
+# MAGIC     def warmup_steps(self) -> dict[str, Callable[[], Any]]:
+# MAGIC         """What the first request would otherwise build, as independent steps."""
+# MAGIC         return {
+# MAGIC             "tools": self.get_tool_specs,
+# MAGIC             # authenticates against the workspace and fails fast on a wrong endpoint name
+# MAGIC             "llm_endpoint": lambda: self.workspace_client.serving_endpoints.get(self.llm_endpoint),
+# MAGIC             "llm_stream_client": lambda: self.llm_stream_client,
+# MAGIC             "index_version": INDEX_VERSION.current,
+# MAGIC             "hybrid_retriever": get_hybrid_retriever,
+# MAGIC         }
+# MAGIC
+# MAGIC     def warmup(self) -> dict:
+# MAGIC         """
+# MAGIC         Builds the tools, clients, vector index handle and version, and the BM25 index concurrently.
+# MAGIC         A failed step is reported, not raised: the request that needs it builds it again.
+# MAGIC         Returns the startup report.
+# MAGIC         """
+# MAGIC         _, errors = run_concurrently(self.warmup_steps(), STARTUP, kind="warmup")
+# MAGIC         return self.startup_report(errors)
+# MAGIC
+# MAGIC     def startup_report(self, errors: Optional[dict[str, Exception]] = None) -> dict:
+# MAGIC         """Import, init and warmup timings per component since agent.py started loading."""
+# MAGIC         report = STARTUP.report()
+# MAGIC         if errors:
+# MAGIC             report["errors"] = {name: f"{type(e).__name__}: {e}" for name, e in errors.items()}
+# MAGIC         return report
 # MAGIC
 # MAGIC     def get_tool_specs(self) -> list[dict]:
 # MAGIC         """Returns tool specifications in the format OpenAI expects."""
 # MAGIC         return [tool_info.spec for tool_info in self._tools_dict.values()]
 # MAGIC
+# MAGIC     def retrieval_cache_stats(self) -> dict:
+# MAGIC         """Hit/miss counters of the retrieval cache (empty when caching is off)."""
+# MAGIC         return self.retrieval_cache.stats if self.retrieval_cache else {}
+# MAGIC
+# MAGIC     def answer_cache_stats(self) -> dict:
+# MAGIC         """Lookup/hit/store counters of the semantic answer cache (empty when it is off)."""
+# MAGIC         return self.answer_cache.stats if self.answer_cache else {}
+# MAGIC
+# MAGIC     def context_compaction_stats(self) -> dict:
+# MAGIC         """Tool output tokens received vs sent to the LLM, summed over requests."""
+# MAGIC         return self.compaction_totals.stats
+# MAGIC
+# MAGIC     def llm_client_stats(self) -> dict:
+# MAGIC         """Retries, TTFT timeouts, hedges, fallbacks and circuit state per endpoint of the LLM client."""
+# MAGIC         return self.llm.stats
+# MAGIC
+# MAGIC     def prefetch_stats(self) -> dict:
+# MAGIC         """Speculative retrieval: started/hit/miss/unused/skipped/throttled, hit rate, recent waste (empty when off)."""
+# MAGIC         return self.prefetcher.stats if self.prefetcher else {}
+# MAGIC
+# MAGIC     def metrics_snapshot(self) -> dict:
+# MAGIC         """
+# MAGIC         Per-stage histograms (count, mean, p50/p95/p99, max): request_seconds, llm_ttft_seconds, llm_call_seconds,
+# MAGIC         tool_seconds per tool, agent_iterations, llm_prompt_tokens, llm_completion_tokens; counters; cache hit rates.
+# MAGIC         """
+# MAGIC         snapshot = self.metrics.snapshot()
+# MAGIC         snapshot["hit_rates"] = {name: self.metrics.hit_rate(name) for name in ("retrieval_cache", "answer_cache")}
+# MAGIC         if self.prefetcher:
+# MAGIC             snapshot["hit_rates"]["prefetch"] = self.prefetcher.stats["hit_rate"]
+# MAGIC         return snapshot
+# MAGIC
+# MAGIC     def metrics_prometheus(self) -> str:
+# MAGIC         """The same metrics in the Prometheus text exposition format."""
+# MAGIC         return self.metrics.prometheus(prefix="contract_agent_")
+# MAGIC
+# MAGIC     def profile(self):
+# MAGIC         """`with AGENT.profile() as p:` collects the metrics of the requests made in the block in p (a Metrics)."""
+# MAGIC         return self.metrics.profile()
+# MAGIC
+# MAGIC     def history_stats(self) -> dict:
+# MAGIC         """Summary cache and truncation counters of the history manager (empty when it is off)."""
+# MAGIC         return self.history.stats if self.history else {}
+# MAGIC
+# MAGIC     def summarize_history(self, previous: str, turns: list[list[dict[str, Any]]]) -> str:
+# MAGIC         """Extends the rolling summary of a session with the turns that left the verbatim window."""
+# MAGIC         content = (f"Resumo até aqui:\n{previous}\n\n" if previous else "") + "Conversa a resumir:\n" + render_turns(turns)
+# MAGIC         response = self.model_serving_client.chat.completions.create(
+# MAGIC             model=self.llm_endpoint,
+# MAGIC             messages=[{"role": "system", "content": HISTORY_SUMMARY_PROMPT}, {"role": "user", "content": content}],
+# MAGIC         )
+# MAGIC         return response.choices[0].message.content or ""
+# MAGIC
+# MAGIC     def fit_history(self, messages: list[dict[str, Any]], session_id: Optional[str]) -> list[dict[str, Any]]:
+# MAGIC         """The request's messages under the prompt ceiling: recent turns verbatim, older ones summarized."""
+# MAGIC         if self.history is None:
+# MAGIC             return messages
+# MAGIC         fitted, report = self.history.fit(messages, session_id)
+# MAGIC         if report.summarized_turns or report.truncated:
+# MAGIC             mlflow.update_current_trace(tags={
+# MAGIC                 "history.summarized_turns": str(report.summarized_turns),
+# MAGIC                 "history.summary": report.summary,
+# MAGIC                 "history.prompt_tokens": str(report.prompt_tokens),
+# MAGIC                 "history.original_tokens": str(report.original_tokens),
+# MAGIC             })
+# MAGIC         return fitted
+# MAGIC
+# MAGIC     def start_prefetch(self, messages: list[dict[str, Any]]) -> Optional[Prefetch]:
+# MAGIC         """Searches the latest user message in the background when the request starts with one (None when off or skipped)."""
+# MAGIC         if self.prefetcher is None or not messages or messages[-1].get("role") != "user":
+# MAGIC             return None
+# MAGIC         tool_name = self.prefetcher.tool_name
+# MAGIC         content = messages[-1].get("content")
+# MAGIC         if isinstance(content, list):
+# MAGIC             content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+# MAGIC         if tool_name not in self._tools_dict or not isinstance(content, str):
+# MAGIC             return None
+# MAGIC         return self.prefetcher.start(content, lambda query: self.execute_tool(tool_name=tool_name, args={"query": query}))
+# MAGIC
+# MAGIC     def finish_prefetch(self, prefetch: Optional[Prefetch]) -> None:
+# MAGIC         if prefetch is None:
+# MAGIC             return
+# MAGIC         mlflow.update_current_trace(tags={"prefetch": self.prefetcher.finish(prefetch)})
+# MAGIC
+# MAGIC     def new_compactor(self, messages: list[dict[str, Any]]) -> Optional[ContextCompactor]:
+# MAGIC         """A request's compactor, aware of the tool outputs already in its history (None when compaction is off)."""
+# MAGIC         if self.tool_budget_tokens is None:
+# MAGIC             return None
+# MAGIC         history = [
+# MAGIC             m.get("content") if m.get("role") == "tool" else m.get("output")
+# MAGIC             for m in messages if m.get("role") == "tool" or m.get("type") == "function_call_output"
+# MAGIC         ]
+# MAGIC         return ContextCompactor(self.tool_budget_tokens, history=[h for h in history if isinstance(h, str)])
+# MAGIC
+# MAGIC     def report_compaction(self, compactor: Optional[ContextCompactor]) -> None:
+# MAGIC         if compactor is None or not compactor.stats.calls:
+# MAGIC             return
+# MAGIC         self.compaction_totals.add(compactor.stats)
+# MAGIC         mlflow.update_current_trace(tags={
+# MAGIC             "context.tool_tokens_raw": str(compactor.stats.raw_tokens),
+# MAGIC             "context.tool_tokens": str(compactor.stats.tokens),
+# MAGIC             "context.tool_tokens_saved": str(compactor.stats.tokens_saved),
+# MAGIC         })
+# MAGIC
 # MAGIC     @mlflow.trace(span_type=SpanType.TOOL)
 # MAGIC     def execute_tool(self, tool_name: str, args: dict) -> Any:
 # MAGIC         """Executes the specified tool with the given arguments."""
-# MAGIC         return self._tools_dict[tool_name].exec_fn(**args)
+# MAGIC         tool = self._tools_dict[tool_name]
+# MAGIC         with self.metrics.timer("tool_seconds", tool=tool_name):
+# MAGIC             try:
+# MAGIC                 if self.retrieval_cache is None or not tool.cacheable:
+# MAGIC                     return tool.exec_fn(**args)
+# MAGIC                 result, hit = self.retrieval_cache.get_or_compute(tool_name, args, lambda: tool.exec_fn(**args))
+# MAGIC             except Exception:
+# MAGIC                 self.metrics.inc("tool_errors", tool=tool_name)
+# MAGIC                 raise
+# MAGIC         self.metrics.inc("retrieval_cache", result="hit" if hit else "miss")
+# MAGIC         span = mlflow.get_current_active_span()
+# MAGIC         if span:
+# MAGIC             span.set_attribute("retrieval_cache_hit", hit)
+# MAGIC         return result
+# MAGIC
+# MAGIC     def open_llm_stream(self, endpoint: str, request: dict[str, Any]):
+# MAGIC         return self.llm_stream_client.chat.completions.create(model=endpoint, stream=True, **request)
+# MAGIC
+# MAGIC     def llm_request(self, messages: list[dict[str, Any]]) -> dict[str, Any]:
+# MAGIC         request = {"messages": to_chat_completions_input(messages), "tools": self.get_tool_specs()}
+# MAGIC         if LLM_STREAM_USAGE:
+# MAGIC             request["stream_options"] = {"include_usage": True}
+# MAGIC         return request
 # MAGIC
 # MAGIC     def call_llm(self, messages: list[dict[str, Any]]) -> Generator[dict[str, Any], None, None]:
+# MAGIC         request = self.llm_request(messages)
+# MAGIC         meter = LLMCallMeter(self.metrics, request)
 # MAGIC         with warnings.catch_warnings():
 # MAGIC             warnings.filterwarnings("ignore", message="PydanticSerializationUnexpectedValue")
-# MAGIC             for chunk in self.model_serving_client.chat.completions.create(
-# MAGIC                 model=self.llm_endpoint,
-# MAGIC                 messages=to_chat_completions_input(messages),
-# MAGIC                 tools=self.get_tool_specs(),
-# MAGIC                 stream=True,
-# MAGIC             ):
-# MAGIC                 chunk_dict = chunk.to_dict()
-# MAGIC                 if len(chunk_dict.get("choices", [])) > 0:
-# MAGIC                     yield chunk_dict
+# MAGIC             try:
+# MAGIC                 for chunk in self.llm.stream(request):
+# MAGIC                     chunk_dict = chunk.to_dict()
+# MAGIC                     meter.add(chunk_dict)
+# MAGIC                     if len(chunk_dict.get("choices", [])) > 0:
+# MAGIC                         yield chunk_dict
+# MAGIC             except Exception:
+# MAGIC                 self.metrics.inc("llm_errors")
+# MAGIC                 raise
+# MAGIC             finally:
+# MAGIC                 meter.done()
 # MAGIC
-# MAGIC     def handle_tool_call(
+# MAGIC     def run_tool_call(
 # MAGIC         self,
 # MAGIC         tool_call: dict[str, Any],
+# MAGIC         compactor: Optional[ContextCompactor] = None,
+# MAGIC         prefetch: Optional[Prefetch] = None,
+# MAGIC     ) -> str:
+# MAGIC         args = json.loads(tool_call["arguments"])
+# MAGIC         hit, result = self.prefetcher.claim(prefetch, tool_call["name"], args) if prefetch else (False, None)
+# MAGIC         if not hit:
+# MAGIC             result = self.execute_tool(tool_name=tool_call["name"], args=args)
+# MAGIC         # every output counts against the request's budget; retrieval results are also compacted
+# MAGIC         # (the cache keeps them raw), the rest pass through as str()
+# MAGIC         if compactor is not None:
+# MAGIC             return compactor.compact(result)
+# MAGIC         return str(result)
+# MAGIC
+# MAGIC     def handle_tool_calls(
+# MAGIC         self,
+# MAGIC         tool_calls: list[dict[str, Any]],
 # MAGIC         messages: list[dict[str, Any]],
-# MAGIC     ) -> ResponsesAgentStreamEvent:
+# MAGIC         compactor: Optional[ContextCompactor] = None,
+# MAGIC         prefetch: Optional[Prefetch] = None,
+# MAGIC     ) -> Generator[ResponsesAgentStreamEvent, None, None]:
 # MAGIC         """
-# MAGIC         Execute tool calls, add them to the running message history, and return a ResponsesStreamEvent w/ tool output
+# MAGIC         Execute the tool calls of a turn in parallel, stream a ResponsesStreamEvent w/ each tool output as it
+# MAGIC         finishes, then add the outputs to the running message history in call order. A failed or timed-out
+# MAGIC         call returns its error as the output, so the model can answer with the other results.
 # MAGIC         """
-# MAGIC         args = json.loads(tool_call["arguments"])
-# MAGIC         result = str(self.execute_tool(tool_name=tool_call["name"], args=args))
+# MAGIC         outputs = [None] * len(tool_calls)
+# MAGIC         runs = [lambda call=call: self.run_tool_call(call, compactor, prefetch) for call in tool_calls]
+# MAGIC         for result in self.tool_runner.run(runs):
+# MAGIC             tool_call = tool_calls[result.index]
+# MAGIC             output = result.output if result.error is None else result.error
+# MAGIC             if result.timed_out:
+# MAGIC                 self.metrics.inc("tool_timeouts", tool=tool_call["name"])
+# MAGIC             elif result.rejected:
+# MAGIC                 self.metrics.inc("tool_capacity_exhausted", tool=tool_call["name"])
+# MAGIC             outputs[result.index] = self.create_function_call_output_item(tool_call["call_id"], output)
+# MAGIC             yield ResponsesAgentStreamEvent(type="response.output_item.done", item=outputs[result.index])
+# MAGIC         messages.extend(outputs)
 # MAGIC
-# MAGIC         tool_call_output = self.create_function_call_output_item(tool_call["call_id"], result)
-# MAGIC         messages.append(tool_call_output)
-# MAGIC         return ResponsesAgentStreamEvent(type="response.output_item.done", item=tool_call_output)
+# MAGIC     @staticmethod
+# MAGIC     def pending_tool_calls(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+# MAGIC         """The function calls at the end of the history: everything the model asked for in its last turn."""
+# MAGIC         calls = []
+# MAGIC         for msg in reversed(messages):
+# MAGIC             if msg.get("type", None) != "function_call":
+# MAGIC                 break
+# MAGIC             calls.append(msg)
+# MAGIC         return calls[::-1]
 # MAGIC
 # MAGIC     def call_and_run_tools(
 # MAGIC         self,
 # MAGIC         messages: list[dict[str, Any]],
 # MAGIC         max_iter: int = 10,
+# MAGIC         compactor: Optional[ContextCompactor] = None,
+# MAGIC         prefetch: Optional[Prefetch] = None,
 # MAGIC     ) -> Generator[ResponsesAgentStreamEvent, None, None]:
-# MAGIC         for _ in range(max_iter):
+# MAGIC         for iteration in range(max_iter):
 # MAGIC             last_msg = messages[-1]
 # MAGIC             if last_msg.get("role", None) == "assistant":
+# MAGIC                 self.metrics.observe("agent_iterations", iteration)
 # MAGIC                 return
 # MAGIC             elif last_msg.get("type", None) == "function_call":
-# MAGIC                 yield self.handle_tool_call(last_msg, messages)
+# MAGIC                 yield from self.handle_tool_calls(self.pending_tool_calls(messages), messages, compactor, prefetch)
 # MAGIC             else:
 # MAGIC                 yield from output_to_responses_items_stream(
 # MAGIC                     chunks=self.call_llm(messages), aggregator=messages
 # MAGIC                 )
 # MAGIC
+# MAGIC         self.metrics.observe("agent_iterations", max_iter)
 # MAGIC         yield ResponsesAgentStreamEvent(
 # MAGIC             type="response.output_item.done",
-# MAGIC             item=self.create_text_output_item("Max iterations reached. Stopping.", str(uuid4())),
+# MAGIC             item=self.create_text_output_item(MAX_ITERATIONS_MESSAGE, str(uuid4())),
 # MAGIC         )
 # MAGIC
-# MAGIC     def predict(self, request: ResponsesAgentRequest) -> ResponsesAgentResponse:
+# MAGIC     @staticmethod
+# MAGIC     def tag_session(request: ResponsesAgentRequest) -> Optional[str]:
+# MAGIC         """Tags the trace with the request's session id (custom_inputs or conversation id) and returns it."""
 # MAGIC         session_id = None
 # MAGIC         if request.custom_inputs and "session_id" in request.custom_inputs:
 # MAGIC             session_id = request.custom_inputs.get("session_id")
@@ -217,7 +634,33 @@
 # MAGIC                     "mlflow.trace.session": session_id,
 # MAGIC                 }
 # MAGIC             )
+# MAGIC         return session_id
+# MAGIC
+# MAGIC     def start_request(self, request: ResponsesAgentRequest) -> tuple:
+# MAGIC         """
+# MAGIC         (session_id, answer cache key, cached answer) of a request: the cached answer is (answer, similarity)
+# MAGIC         when it can be replayed instead of calling the LLM, else None.
+# MAGIC         """
+# MAGIC         session_id = self.tag_session(request)
+# MAGIC         cache_key = self.answer_cache_key(request)
+# MAGIC         bypass = bool(request.custom_inputs and request.custom_inputs.get("bypass_answer_cache"))
+# MAGIC         if cache_key and not bypass:
+# MAGIC             answer, similarity = self.answer_cache.lookup(cache_key[1], cache_key[2])
+# MAGIC             mlflow.update_current_trace(tags={"answer_cache": "hit" if answer else "miss"})
+# MAGIC             self.metrics.inc("answer_cache", result="hit" if answer else "miss")
+# MAGIC             if answer:
+# MAGIC                 return session_id, cache_key, (answer, similarity)
+# MAGIC         return session_id, cache_key, None
 # MAGIC
+# MAGIC     @staticmethod
+# MAGIC     def request_messages(request: ResponsesAgentRequest) -> list[dict[str, Any]]:
+# MAGIC         messages = to_chat_completions_input([i.model_dump() for i in request.input])
+# MAGIC         if SYSTEM_PROMPT:
+# MAGIC             messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+# MAGIC         return messages
+# MAGIC
+# MAGIC     def predict(self, request: ResponsesAgentRequest) -> ResponsesAgentResponse:
+# MAGIC         self.tag_session(request)
 # MAGIC         outputs = [
 # MAGIC             event.item
 # MAGIC             for event in self.predict_stream(request)
@@ -226,28 +669,248 @@
 # MAGIC         return ResponsesAgentResponse(output=outputs, custom_outputs=request.custom_inputs)
 # MAGIC
 # MAGIC     def predict_stream(self, request: ResponsesAgentRequest) -> Generator[ResponsesAgentStreamEvent, None, None]:
-# MAGIC         session_id = None
-# MAGIC         if request.custom_inputs and "session_id" in request.custom_inputs:
-# MAGIC             session_id = request.custom_inputs.get("session_id")
-# MAGIC         elif request.context and request.context.conversation_id:
-# MAGIC             session_id = request.context.conversation_id
+# MAGIC         with self.metrics.timer("request_seconds"):
+# MAGIC             session_id, cache_key, cached = self.start_request(request)
+# MAGIC             if cached:
+# MAGIC                 yield from self.replay_answer(*cached)
+# MAGIC                 return
 # MAGIC
-# MAGIC         if session_id:
-# MAGIC             mlflow.update_current_trace(
-# MAGIC                 metadata={
-# MAGIC                     "mlflow.trace.session": session_id,
-# MAGIC                 }
+# MAGIC             messages = self.request_messages(request)
+# MAGIC             # runs during history folding and the first LLM call
+# MAGIC             prefetch = self.start_prefetch(messages)
+# MAGIC             try:
+# MAGIC                 messages = self.fit_history(messages, session_id)
+# MAGIC                 compactor = self.new_compactor(messages)
+# MAGIC                 items = []
+# MAGIC                 for event in self.call_and_run_tools(messages=messages, compactor=compactor, prefetch=prefetch):
+# MAGIC                     if event.type == "response.output_item.done":
+# MAGIC                         items.append(event.item)
+# MAGIC                     yield event
+# MAGIC             finally:
+# MAGIC                 self.finish_prefetch(prefetch)
+# MAGIC             self.report_compaction(compactor)
+# MAGIC             if cache_key:
+# MAGIC                 self.store_answer(cache_key, items, session_id)
+# MAGIC
+# MAGIC     def answer_cache_key(self, request: ResponsesAgentRequest) -> Optional[tuple]:
+# MAGIC         """
+# MAGIC         (question, embedding, namespace) of a single-turn request, None when the answer cache is off,
+# MAGIC         the request has history (a follow-up depends on it) or the question can not be embedded.
+# MAGIC         """
+# MAGIC         if self.answer_cache is None or len(request.input) != 1:
+# MAGIC             return None
+# MAGIC         item = request.input[0].model_dump()
+# MAGIC         content = item.get("content")
+# MAGIC         if isinstance(content, list):
+# MAGIC             content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+# MAGIC         if item.get("role") != "user" or not isinstance(content, str) or not content.strip():
+# MAGIC             return None
+# MAGIC         try:
+# MAGIC             vector = self.answer_cache.embed(content)
+# MAGIC         except Exception:
+# MAGIC             return None
+# MAGIC         namespace = answer_namespace(SYSTEM_PROMPT, self.llm_endpoint, self.answer_cache.index_version())
+# MAGIC         return content, vector, namespace
+# MAGIC
+# MAGIC     def replay_answer(self, answer: CachedAnswer, similarity: float) -> Generator[ResponsesAgentStreamEvent, None, None]:
+# MAGIC         """Streams a cached answer as the LLM would have: a text delta, then the done item, per message."""
+# MAGIC         mlflow.update_current_trace(tags={
+# MAGIC             "answer_cache.similarity": f"{similarity:.4f}",
+# MAGIC             "answer_cache.question": answer.question[:250],
+# MAGIC             "answer_cache.created_at": str(answer.provenance.get("created_at")),
+# MAGIC         })
+# MAGIC         for text in answer.texts:
+# MAGIC             item_id = str(uuid4())
+# MAGIC             yield ResponsesAgentStreamEvent(**self.create_text_delta(delta=text, item_id=item_id))
+# MAGIC             yield ResponsesAgentStreamEvent(
+# MAGIC                 type="response.output_item.done", item=self.create_text_output_item(text, item_id)
 # MAGIC             )
 # MAGIC
-# MAGIC         messages = to_chat_completions_input([i.model_dump() for i in request.input])
-# MAGIC         if SYSTEM_PROMPT:
-# MAGIC             messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
-# MAGIC         yield from self.call_and_run_tools(messages=messages)
+# MAGIC     def store_answer(self, cache_key: tuple, items: list[dict], session_id: Optional[str]) -> None:
+# MAGIC         texts = [
+# MAGIC             part.get("text", "")
+# MAGIC             for item in items if item.get("type") == "message"
+# MAGIC             for part in item.get("content", []) if part.get("type") == "output_text"
+# MAGIC         ]
+# MAGIC         if not texts or texts[-1] == MAX_ITERATIONS_MESSAGE:
+# MAGIC             return
+# MAGIC         question, vector, namespace = cache_key
+# MAGIC         tools = [{"name": i.get("name"), "arguments": i.get("arguments")} for i in items if i.get("type") == "function_call"]
+# MAGIC         self.answer_cache.store(vector, namespace, question, texts, {
+# MAGIC             "model": self.llm_endpoint,
+# MAGIC             "index_version": self.answer_cache.index_version(),
+# MAGIC             "session_id": session_id,
+# MAGIC             "tool_calls": tools,
+# MAGIC         })
+# MAGIC
+# MAGIC
+# MAGIC class AsyncToolCallingAgent(ToolCallingAgent):
+# MAGIC     """
+# MAGIC     ToolCallingAgent on asyncio: the LLM stream is read with an async OpenAI client and the tool calls of
+# MAGIC     a turn are awaited together, so a conversation waiting on the model holds no thread. Emits the same
+# MAGIC     event sequence as the sync agent. predict/predict_stream stay synchronous for ResponsesAgent: they
+# MAGIC     drive apredict_stream on one event loop shared by all requests, with the calling thread blocked until
+# MAGIC     the stream ends, so only a host that awaits apredict_stream itself serves more sessions per thread.
+# MAGIC     """
+# MAGIC
+# MAGIC     def __init__(self, *args, io_threads: int = ASYNC_IO_THREADS, **kwargs):
+# MAGIC         super().__init__(*args, **kwargs)
+# MAGIC         self._async_client = Lazy(self.create_async_openai_client, "async_openai_client", STARTUP)
+# MAGIC         self.bridge = SyncBridge(io_workers=io_threads)
+# MAGIC         self.llm.open_astream = self.open_llm_astream
+# MAGIC
+# MAGIC     @property
+# MAGIC     def async_client(self):
+# MAGIC         return self._async_client.get()
+# MAGIC
+# MAGIC     def create_async_openai_client(self):
+# MAGIC         OPENAI_TRACING.get()
+# MAGIC         return databricks_async_openai_client(self.workspace_client).with_options(max_retries=0)
+# MAGIC
+# MAGIC     def warmup_steps(self) -> dict[str, Callable[[], Any]]:
+# MAGIC         return {**super().warmup_steps(), "async_openai_client": lambda: self.async_client}
+# MAGIC
+# MAGIC     def open_llm_astream(self, endpoint: str, request: dict[str, Any]):
+# MAGIC         return self.async_client.chat.completions.create(model=endpoint, stream=True, **request)
+# MAGIC
+# MAGIC     async def acall_llm(self, messages: list[dict[str, Any]]) -> AsyncGenerator[dict[str, Any], None]:
+# MAGIC         request = self.llm_request(messages)
+# MAGIC         meter = LLMCallMeter(self.metrics, request)
+# MAGIC         try:
+# MAGIC             # the stream is closed by the client when the request is cancelled (client gone)
+# MAGIC             async for chunk in self.llm.astream(request):
+# MAGIC                 with warnings.catch_warnings():
+# MAGIC                     warnings.filterwarnings("ignore", message="PydanticSerializationUnexpectedValue")
+# MAGIC                     chunk_dict = chunk.to_dict()
+# MAGIC                 meter.add(chunk_dict)
+# MAGIC                 if len(chunk_dict.get("choices", [])) > 0:
+# MAGIC                     yield chunk_dict
+# MAGIC         except Exception:
+# MAGIC             self.metrics.inc("llm_errors")
+# MAGIC             raise
+# MAGIC         finally:
+# MAGIC             meter.done()
+# MAGIC
+# MAGIC     async def astream_llm_turn(self, messages: list[dict[str, Any]]) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+# MAGIC         """Async output_to_responses_items_stream: text deltas as they arrive, then the done items, added to messages."""
+# MAGIC         text, msg_id, tool_calls = "", None, {}
+# MAGIC         async for chunk in self.acall_llm(messages):
+# MAGIC             msg_id = chunk.get("id") or msg_id
+# MAGIC             delta = chunk["choices"][0].get("delta") or {}
+# MAGIC             if isinstance(delta.get("content"), str) and delta["content"]:
+# MAGIC                 text += delta["content"]
+# MAGIC                 yield ResponsesAgentStreamEvent(**self.create_text_delta(delta=delta["content"], item_id=msg_id))
+# MAGIC             for tc in delta.get("tool_calls") or []:
+# MAGIC                 call = tool_calls.setdefault(tc.get("index", 0), {"id": None, "name": "", "arguments": ""})
+# MAGIC                 call["id"] = call["id"] or tc.get("id")
+# MAGIC                 call["name"] += (tc.get("function") or {}).get("name") or ""
+# MAGIC                 call["arguments"] += (tc.get("function") or {}).get("arguments") or ""
+# MAGIC         items = [self.create_text_output_item(text, msg_id)] if text else []
+# MAGIC         items += [
+# MAGIC             self.create_function_call_item(str(uuid4()), call["id"], call["name"], call["arguments"])
+# MAGIC             for _, call in sorted(tool_calls.items())
+# MAGIC         ]
+# MAGIC         for item in items:
+# MAGIC             messages.append(item)
+# MAGIC             yield ResponsesAgentStreamEvent(type="response.output_item.done", item=item)
+# MAGIC
+# MAGIC     async def ahandle_tool_calls(
+# MAGIC         self,
+# MAGIC         tool_calls: list[dict[str, Any]],
+# MAGIC         messages: list[dict[str, Any]],
+# MAGIC         compactor: Optional[ContextCompactor] = None,
+# MAGIC         prefetch: Optional[Prefetch] = None,
+# MAGIC     ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+# MAGIC         """handle_tool_calls on the event loop: each blocking tool call runs on its own thread (see ParallelToolRunner)."""
+# MAGIC         slots = asyncio.Semaphore(self.tool_runner.max_workers)
+# MAGIC         timeout_s = self.tool_runner.timeout_s
+# MAGIC
+# MAGIC         async def run(index: int, tool_call: dict[str, Any]) -> tuple:
+# MAGIC             async with slots:
+# MAGIC                 try:
+# MAGIC                     call = run_in_thread(lambda: self.run_tool_call(tool_call, compactor, prefetch))
+# MAGIC                     output = await asyncio.wait_for(asyncio.wrap_future(call), timeout_s)
+# MAGIC                 except asyncio.TimeoutError:
+# MAGIC                     self.metrics.inc("tool_timeouts", tool=tool_call["name"])
+# MAGIC                     output = f"Error: tool call timed out after {timeout_s:g} s"
+# MAGIC                 except ToolCapacityExhausted as e:
+# MAGIC                     self.metrics.inc("tool_capacity_exhausted", tool=tool_call["name"])
+# MAGIC                     output = f"Error: {e}"
+# MAGIC                 except Exception as e:
+# MAGIC                     output = f"Error: {type(e).__name__}: {e}"
+# MAGIC             return index, output
+# MAGIC
+# MAGIC         outputs = [None] * len(tool_calls)
+# MAGIC         tasks = [asyncio.ensure_future(run(i, call)) for i, call in enumerate(tool_calls)]
+# MAGIC         try:
+# MAGIC             for next_done in asyncio.as_completed(tasks):
+# MAGIC                 index, output = await next_done
+# MAGIC                 outputs[index] = self.create_function_call_output_item(tool_calls[index]["call_id"], output)
+# MAGIC                 yield ResponsesAgentStreamEvent(type="response.output_item.done", item=outputs[index])
+# MAGIC         finally:
+# MAGIC             for task in tasks:
+# MAGIC                 task.cancel()
+# MAGIC         messages.extend(outputs)
+# MAGIC
+# MAGIC     async def acall_and_run_tools(
+# MAGIC         self,
+# MAGIC         messages: list[dict[str, Any]],
+# MAGIC         max_iter: int = 10,
+# MAGIC         compactor: Optional[ContextCompactor] = None,
+# MAGIC         prefetch: Optional[Prefetch] = None,
+# MAGIC     ) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+# MAGIC         for iteration in range(max_iter):
+# MAGIC             last_msg = messages[-1]
+# MAGIC             if last_msg.get("role", None) == "assistant":
+# MAGIC                 self.metrics.observe("agent_iterations", iteration)
+# MAGIC                 return
+# MAGIC             elif last_msg.get("type", None) == "function_call":
+# MAGIC                 async for event in self.ahandle_tool_calls(self.pending_tool_calls(messages), messages, compactor, prefetch):
+# MAGIC                     yield event
+# MAGIC             else:
+# MAGIC                 async for event in self.astream_llm_turn(messages):
+# MAGIC                     yield event
+# MAGIC
+# MAGIC         self.metrics.observe("agent_iterations", max_iter)
+# MAGIC         yield ResponsesAgentStreamEvent(
+# MAGIC             type="response.output_item.done",
+# MAGIC             item=self.create_text_output_item(MAX_ITERATIONS_MESSAGE, str(uuid4())),
+# MAGIC         )
+# MAGIC
+# MAGIC     async def apredict_stream(self, request: ResponsesAgentRequest) -> AsyncGenerator[ResponsesAgentStreamEvent, None]:
+# MAGIC         with self.metrics.timer("request_seconds"):
+# MAGIC             # the answer cache embeds the question over HTTP: off the loop
+# MAGIC             session_id, cache_key, cached = await asyncio.to_thread(self.start_request, request)
+# MAGIC             if cached:
+# MAGIC                 for event in self.replay_answer(*cached):
+# MAGIC                     yield event
+# MAGIC                 return
+# MAGIC
+# MAGIC             messages = self.request_messages(request)
+# MAGIC             prefetch = self.start_prefetch(messages)
+# MAGIC             try:
+# MAGIC                 # folding old turns may call the LLM for the summary: off the loop
+# MAGIC                 messages = await asyncio.to_thread(self.fit_history, messages, session_id)
+# MAGIC                 compactor = self.new_compactor(messages)
+# MAGIC                 items = []
+# MAGIC                 async for event in self.acall_and_run_tools(messages=messages, compactor=compactor, prefetch=prefetch):
+# MAGIC                     if event.type == "response.output_item.done":
+# MAGIC                         items.append(event.item)
+# MAGIC                     yield event
+# MAGIC             finally:
+# MAGIC                 self.finish_prefetch(prefetch)
+# MAGIC             self.report_compaction(compactor)
+# MAGIC             if cache_key:
+# MAGIC                 await asyncio.to_thread(self.store_answer, cache_key, items, session_id)
+# MAGIC
+# MAGIC     def predict_stream(self, request: ResponsesAgentRequest) -> Generator[ResponsesAgentStreamEvent, None, None]:
+# MAGIC         yield from self.bridge.iterate(self.apredict_stream(request))
 # MAGIC
 # MAGIC
 # MAGIC # Log the model using MLflow
-# MAGIC mlflow.openai.autolog()
-# MAGIC AGENT = ToolCallingAgent(llm_endpoint=LLM_ENDPOINT_NAME, tools=TOOL_INFOS)
+# MAGIC AGENT = (AsyncToolCallingAgent if USE_ASYNC_AGENT else ToolCallingAgent)(
+# MAGIC     llm_endpoint=LLM_ENDPOINT_NAME, tools=TOOL_INFOS.get, retrieval_cache=RETRIEVAL_CACHE, answer_cache=ANSWER_CACHE
+# MAGIC )
 # MAGIC mlflow.models.set_model(AGENT)
 
 # COMMAND ----------
@@ -265,7 +928,10 @@ dbutils.library.restartPython()
 
 # COMMAND ----------
 
-from agent import AGENT
+from agent import AGENT, format_report, format_snapshot
+
+# what serving does in load_context: the first request below no longer pays for it
+print(format_report(AGENT.warmup()))
 
 AGENT.predict(
     {"input": [{"role": "user", "content": "what is 4*3 in python"}], "custom_inputs": {"session_id": "test-session-123"}},
@@ -273,10 +939,29 @@ AGENT.predict(
 
 # COMMAND ----------
 
-for chunk in AGENT.predict_stream(
-    {"input": [{"role": "user", "content": "What is 4*3 in Python?"}], "custom_inputs": {"session_id": "test-session-123"}}
-):
-    print(chunk.model_dump(exclude_none=True))
+# profile(): the metrics of this request only (TTFT, LLM call, per-tool latency, iterations, tokens)
+with AGENT.profile() as profile:
+    for chunk in AGENT.predict_stream(
+        {"input": [{"role": "user", "content": "What is 4*3 in Python?"}], "custom_inputs": {"session_id": "test-session-123"}}
+    ):
+        print(chunk.model_dump(exclude_none=True))
+print(format_snapshot(profile.snapshot()))
+
+# retrieval tool calls answered from the cache (repeat questions) vs sent to the index
+print(AGENT.retrieval_cache_stats())
+# with ANSWER_CACHE_ENABLED, asking the same question again is answered without calling the LLM
+print(AGENT.answer_cache_stats())
+# retrieval output tokens received vs sent to the LLM after compaction
+print(AGENT.context_compaction_stats())
+# long sessions: turns folded into the per-session summary (cached, incremental) and ceiling truncations
+print(AGENT.history_stats())
+# LLM client: retries, TTFT timeouts, hedges, fallbacks and circuit breaker state per endpoint
+print(AGENT.llm_client_stats())
+# with PREFETCH_RETRIEVAL: prefetched searches served to the model vs wasted (unused, other query), throttling
+print(AGENT.prefetch_stats())
+# every request since the agent was created: p50/p95/p99 per stage and cache hit rates
+# (AGENT.metrics_snapshot() as JSON, AGENT.metrics_prometheus() for a Prometheus scrape)
+print(format_snapshot(AGENT.metrics_snapshot()))
 
 # COMMAND ----------
 
@@ -291,12 +976,19 @@ for chunk in AGENT.predict_stream(
 
 # Determine Databricks resources to specify for automatic auth passthrough at deployment time
 import mlflow
-from agent import UC_TOOL_NAMES, VECTOR_SEARCH_TOOLS, LLM_ENDPOINT_NAME
+import os
+from agent import (
+    ANSWER_CACHE, ANSWER_CACHE_EMBEDDING_ENDPOINT, BM25_INDEX_PATH, UC_TOOL_NAMES, VECTOR_SEARCH_TOOLS, LLM_ENDPOINT_NAME,
+    LLM_FALLBACK_ENDPOINTS,
+)
 from mlflow.models.resources import DatabricksFunction, DatabricksServingEndpoint
 from pkg_resources import get_distribution
 
-resources = [DatabricksServingEndpoint(endpoint_name=LLM_ENDPOINT_NAME)]
-for tool in VECTOR_SEARCH_TOOLS:
+resources = [DatabricksServingEndpoint(endpoint_name=e) for e in [LLM_ENDPOINT_NAME, *LLM_FALLBACK_ENDPOINTS]]
+if ANSWER_CACHE:
+    # the semantic answer cache embeds each question
+    resources.append(DatabricksServingEndpoint(endpoint_name=ANSWER_CACHE_EMBEDDING_ENDPOINT))
+for tool in VECTOR_SEARCH_TOOLS.get():
     resources.extend(tool.resources)
 for tool_name in UC_TOOL_NAMES:
     # TODO: If the UC function includes dependencies like external connection or vector search, please include them manually.
@@ -315,6 +1007,10 @@ input_example = {
     }
 }
 
+# agent.py imports src.lib (hybrid search): the repo's src/ is packaged with the model, and the BM25
+# index built by src/notebooks/02 is logged as an artifact
+SRC_DIR = os.path.abspath(os.path.join(os.getcwd(), "..", "..", "src"))
+
 with mlflow.start_run():
     logged_agent_info = mlflow.pyfunc.log_model(
         name="agent",
@@ -326,6 +1022,8 @@ with mlflow.start_run():
             f"databricks-connect=={get_distribution('databricks-connect').version}",
         ],
         resources=resources,
+        code_paths=[SRC_DIR],
+        artifacts={"bm25_index": BM25_INDEX_PATH},
     )
 
 # COMMAND ----------
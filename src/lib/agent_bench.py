@@ -0,0 +1,412 @@
+import argparse
+import asyncio
+import http.client
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from src.lib.aio import SyncBridge
+from src.lib.chunk_sweep import DEFAULT_QUESTIONS
+from src.lib.llm_stub import StubLLMServer
+from src.lib.loadtest import _dist, load_queries
+
+# the agent's retrieval tool, as the LLM sees it
+TOOLS = [{"type": "function", "function": {
+    "name": "contract_search", "description": "Busca trechos dos contratos.",
+    "parameters": {"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]},
+}}]
+MAX_TURNS = 4
+
+
+@dataclass
+class Session:
+    latency_s: float  # from arrival (incl. waiting for a serving thread) to the last token
+    ttft_s: Optional[float] = None  # arrival to the first answer token
+    turns: int = 0
+    error: Optional[str] = None
+
+
+class _Turn:
+    """Accumulates the chunks of one streamed chat completion: answer text and tool calls by index."""
+
+    def __init__(self):
+        self.content = ""
+        self.tool_calls: Dict[int, dict] = {}
+
+    def add(self, chunk: dict) -> bool:
+        """True when the chunk carried answer text."""
+        choices = chunk.get("choices") or []
+        delta = (choices[0].get("delta") or {}) if choices else {}
+        for tc in delta.get("tool_calls") or []:
+            call = self.tool_calls.setdefault(tc.get("index", 0), {"id": tc.get("id"), "name": "", "arguments": ""})
+            fn = tc.get("function") or {}
+            call["name"] += fn.get("name") or ""
+            call["arguments"] += fn.get("arguments") or ""
+        if delta.get("content"):
+            self.content += delta["content"]
+            return True
+        return False
+
+    def messages(self) -> List[dict]:
+        calls = [self.tool_calls[i] for i in sorted(self.tool_calls)]
+        return [{"role": "assistant", "content": self.content or None, "tool_calls": [
+            {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"]}}
+            for c in calls]}]
+
+
+def _request(base_url: str, messages: List[dict]) -> tuple:
+    url = urlsplit(base_url)
+    body = json.dumps({"model": "stub", "messages": messages, "tools": TOOLS, "stream": True}).encode("utf-8")
+    return url.hostname, url.port or 80, url.path.rstrip("/") + "/chat/completions", body
+
+
+def _events(buffer: bytes) -> tuple:
+    # complete SSE events in the buffer (as chunk dicts) and the unparsed rest; None marks [DONE]
+    *events, rest = buffer.split(b"\n\n")
+    chunks = []
+    for event in events:
+        for line in event.splitlines():
+            if line.startswith(b"data: "):
+                data = line[6:].strip()
+                chunks.append(None if data == b"[DONE]" else json.loads(data))
+    return chunks, rest
+
+
+class StatusError(RuntimeError):
+    """Non-200 answer of the endpoint; `status_code` like the openai SDK's errors."""
+
+    def __init__(self, status_code: int, body: bytes):
+        super().__init__(f"HTTP {status_code}: {body[:200]!r}")
+        self.status_code = status_code
+
+
+class RawClient:
+    """Streaming chat completions over the stdlib (http.client per thread, asyncio streams), keep-alive."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self._local = threading.local()
+        self._idle: List[tuple] = []  # async connections, bound to the benchmark's loop
+
+    def stream(self, messages: List[dict]) -> Iterator[dict]:
+        host, port, path, body = _request(self.base_url, messages)
+        if getattr(self._local, "conn", None) is None:
+            self._local.conn = http.client.HTTPConnection(host, port, timeout=60)
+        conn = self._local.conn
+        try:
+            conn.request("POST", path, body, {"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            if resp.status != 200:
+                raise StatusError(resp.status, resp.read())
+            buffer = b""
+            while data := resp.read1(65536):
+                chunks, buffer = _events(buffer + data)
+                for chunk in chunks:
+                    if chunk is not None:
+                        yield chunk
+        except Exception:
+            conn.close()
+            self._local.conn = None
+            raise
+
+    async def astream(self, messages: List[dict]) -> AsyncIterator[dict]:
+        host, port, path, body = _request(self.base_url, messages)
+        reader, writer = self._idle.pop() if self._idle else await asyncio.open_connection(host, port)
+        reusable = False
+        try:
+            writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if status != 200:
+                raise StatusError(status, await reader.readexactly(int(headers["content-length"])))
+            buffer = b""
+            while size := int((await reader.readline()).strip(), 16):
+                chunks, buffer = _events(buffer + (await reader.readexactly(size + 2))[:-2])
+                for chunk in chunks:
+                    if chunk is not None:
+                        yield chunk
+            await reader.readline()
+            reusable = True
+        finally:
+            if reusable:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+
+
+class OpenAIClient:
+    """The same streams through the openai SDK (what the agents use): OpenAI and AsyncOpenAI."""
+
+    def __init__(self, base_url: str):
+        from openai import AsyncOpenAI, OpenAI
+
+        self.client = OpenAI(base_url=base_url, api_key="stub", max_retries=0)
+        self.async_client = AsyncOpenAI(base_url=base_url, api_key="stub", max_retries=0)
+
+    def stream(self, messages: List[dict]) -> Iterator[dict]:
+        for chunk in self.client.chat.completions.create(model="stub", messages=messages, tools=TOOLS, stream=True):
+            yield chunk.to_dict()
+
+    async def astream(self, messages: List[dict]) -> AsyncIterator[dict]:
+        stream = await self.async_client.chat.completions.create(
+            model="stub", messages=messages, tools=TOOLS, stream=True)
+        async for chunk in stream:
+            yield chunk.to_dict()
+
+
+def _start(question: str) -> List[dict]:
+    return [{"role": "system", "content": "Responda sobre contratos."}, {"role": "user", "content": question}]
+
+
+def _tool_messages(turn: _Turn) -> List[dict]:
+    return [{"role": "tool", "tool_call_id": c["id"], "content": "[{'doc_name': 'DEMO.pdf', 'page': 1}]"}
+            for c in turn.tool_calls.values()]
+
+
+def sync_session(client, question: str, tool_s: float, arrived: float) -> Session:
+    """The ToolCallingAgent loop on one thread: stream a turn, run its tools, until the model answers."""
+    messages, ttft = _start(question), None
+    try:
+        for turns in range(1, MAX_TURNS + 1):
+            turn = _Turn()
+            for chunk in client.stream(messages):
+                if turn.add(chunk) and ttft is None:
+                    ttft = time.perf_counter() - arrived
+            if not turn.tool_calls:
+                break
+            time.sleep(tool_s)  # the retrieval call
+            messages += turn.messages() + _tool_messages(turn)
+        return Session(time.perf_counter() - arrived, ttft, turns)
+    except Exception as e:
+        return Session(time.perf_counter() - arrived, ttft, error=type(e).__name__)
+
+
+async def async_turns(client, question: str, tool_s: float) -> AsyncIterator[Tuple[bool, int]]:
+    """
+    The AsyncToolCallingAgent loop (apredict_stream): same turns, the tool call in a worker thread like
+    aexecute_tool. Yields (answer text?, turn) per streamed chunk.
+    """
+    messages = _start(question)
+    for turns in range(1, MAX_TURNS + 1):
+        turn = _Turn()
+        async for chunk in client.astream(messages):
+            yield turn.add(chunk), turns
+        if not turn.tool_calls:
+            break
+        await asyncio.to_thread(time.sleep, tool_s)
+        messages += turn.messages() + _tool_messages(turn)
+
+
+async def async_session(client, question: str, tool_s: float, arrived: float) -> Session:
+    """A session awaited directly on the loop, as a native async host would call apredict_stream."""
+    ttft, turns = None, 0
+    try:
+        async for text, turns in async_turns(client, question, tool_s):
+            if text and ttft is None:
+                ttft = time.perf_counter() - arrived
+        return Session(time.perf_counter() - arrived, ttft, turns)
+    except Exception as e:
+        return Session(time.perf_counter() - arrived, ttft, error=type(e).__name__)
+
+
+def bridged_session(bridge: SyncBridge, client, question: str, tool_s: float, arrived: float) -> Session:
+    """
+    A session as AsyncToolCallingAgent.predict_stream serves it: the serving thread iterates
+    apredict_stream through SyncBridge, blocked on its queue until the last chunk.
+    """
+    ttft, turns = None, 0
+    try:
+        for text, turns in bridge.iterate(async_turns(client, question, tool_s)):
+            if text and ttft is None:
+                ttft = time.perf_counter() - arrived
+        return Session(time.perf_counter() - arrived, ttft, turns)
+    except Exception as e:
+        return Session(time.perf_counter() - arrived, ttft, error=type(e).__name__)
+
+
+class _ThreadSampler:
+    """Peak number of live threads while a run is in progress."""
+
+    def __init__(self, interval_s: float = 0.02):
+        self.interval_s = interval_s
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="bench-sampler", daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self) -> "_ThreadSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_sync(client, questions: Sequence[str], sessions: int, concurrency: int, workers: int,
+             tool_s: float, session: Callable[..., Session] = sync_session) -> List[Session]:
+    """
+    `concurrency` users, each starting a new session when the previous one ends, served by a pool of
+    `workers` threads (the serving replica): sessions beyond `workers` wait for a thread. `session`
+    runs one session on a serving thread (sync_session, or bridged_session for the async agent).
+    """
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-serve")
+    results: List[Session] = []
+    counter = iter(range(sessions))
+    lock = threading.Lock()
+
+    def user() -> None:
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            arrived = time.perf_counter()
+            results.append(pool.submit(session, client, questions[i % len(questions)], tool_s, arrived).result())
+
+    users = [threading.Thread(target=user, name=f"bench-user-{u}") for u in range(concurrency)]
+    for u in users:
+        u.start()
+    for u in users:
+        u.join()
+    pool.shutdown()
+    return results
+
+
+def run_async(client, questions: Sequence[str], sessions: int, concurrency: int, tool_s: float,
+              tool_threads: int = 32) -> List[Session]:
+    """
+    The same users on one event loop: every session in flight at once, no serving thread each. The
+    blocking tool calls share `tool_threads` threads (the loop's default executor, as in SyncBridge).
+    This is what a host that awaits apredict_stream itself would get; behind ResponsesAgent's
+    synchronous predict_stream each session still holds a serving thread (see bridged_session).
+    """
+
+    async def main() -> List[Session]:
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=tool_threads, thread_name_prefix="agent-io"))
+        results: List[Session] = []
+        counter = iter(range(sessions))
+
+        async def user() -> None:
+            while (i := next(counter, None)) is not None:
+                results.append(await async_session(client, questions[i % len(questions)], tool_s, time.perf_counter()))
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        return results
+
+    return asyncio.run(main())
+
+
+def summarize(mode: str, results: List[Session], wall_s: float, peak_threads: int) -> dict:
+    ok = [s for s in results if s.error is None]
+    return {
+        "mode": mode,
+        "sessions": len(results),
+        "errors": len(results) - len(ok),
+        "wall_s": round(wall_s, 3),
+        "sessions_per_s": round(len(results) / wall_s, 2) if wall_s else None,
+        "latency_ms": _dist([s.latency_s * 1000 for s in ok], 1),
+        "ttft_ms": _dist([s.ttft_s * 1000 for s in ok if s.ttft_s is not None], 1),
+        "peak_threads": peak_threads,
+    }
+
+
+def run_bench(base_url: str, client_kind: str = "raw", questions: Sequence[str] = ("Qual o aviso prévio?",),
+              sessions: int = 200, concurrency: int = 100, workers: Sequence[int] = (8, 32), tool_s: float = 0.1,
+              tool_threads: int = 32) -> dict:
+    """
+    Per serving-thread count in `workers`: the sync agent ("sync xN") and the async agent behind
+    SyncBridge, as a ResponsesAgent replica serves it ("bridge xN"). Then the async agent on a bare event
+    loop ("async"), the ceiling a native async host could reach.
+    """
+    def new_client():
+        # async connections belong to one event loop: every run gets its own client
+        return OpenAIClient(base_url) if client_kind == "openai" else RawClient(base_url)
+
+    runs = []
+    for w in workers:
+        bridge = SyncBridge(name="bench-loop", io_workers=tool_threads)
+        for mode, session in ((f"sync x{w}", sync_session), (f"bridge x{w}", partial(bridged_session, bridge))):
+            with _ThreadSampler() as threads:
+                t0 = time.perf_counter()
+                results = run_sync(new_client(), questions, sessions, concurrency, w, tool_s, session)
+            # the user threads stand in for the clients; they are not part of the replica
+            runs.append({**summarize(mode, results, time.perf_counter() - t0, threads.peak - concurrency),
+                         "workers": w})
+    with _ThreadSampler() as threads:
+        t0 = time.perf_counter()
+        results = run_async(new_client(), questions, sessions, concurrency, tool_s, tool_threads)
+    runs.append(summarize("async", results, time.perf_counter() - t0, threads.peak))
+    return {"client": client_kind, "sessions": sessions, "concurrency": concurrency, "tool_s": tool_s,
+            "tool_threads": tool_threads, "runs": runs}
+
+
+def print_table(report: dict, file=sys.stderr) -> None:
+    print(f"{'mode':>10} {'sess/s':>8} {'p50':>8} {'p95':>8} {'ttft50':>8} {'ttft95':>8} {'threads':>8} {'err':>5}",
+          file=file)
+    for r in report["runs"]:
+        lat, ttft = r["latency_ms"], r["ttft_ms"]
+        print(f"{r['mode']:>10} {r['sessions_per_s']:>8} {lat.get('p50', '-'):>8} {lat.get('p95', '-'):>8} "
+              f"{ttft.get('p50', '-'):>8} {ttft.get('p95', '-'):>8} {r['peak_threads']:>8} {r['errors']:>5}", file=file)
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Sync vs asyncio agent sessions against a stub LLM endpoint "
+                                                 "(bridge: the asyncio agent behind the synchronous predict_stream).")
+    parser.add_argument("--client", choices=["raw", "openai"], default="raw")
+    parser.add_argument("--base-url", help="an OpenAI-compatible endpoint (default: start the stub)")
+    parser.add_argument("--sessions", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200, help="users with a session in flight")
+    parser.add_argument("--workers", type=_ints, default=[8, 32], help="serving threads of the sync replica")
+    parser.add_argument("--tool-ms", type=float, default=100.0, help="simulated retrieval latency")
+    parser.add_argument("--tool-threads", type=int, default=32, help="threads for tool calls of the async replica")
+    parser.add_argument("--ttft-ms", type=float, default=300.0)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--token-ms", type=float, default=10.0)
+    parser.add_argument("--output", help="JSON report path (default: stdout)")
+    args = parser.parse_args(argv)
+
+    stub = None
+    if args.base_url is None:
+        stub = StubLLMServer(ttft_s=args.ttft_ms / 1000, tokens=args.tokens, token_interval_s=args.token_ms / 1000)
+        args.base_url = stub.start()
+    try:
+        report = run_bench(args.base_url, args.client, load_queries(DEFAULT_QUESTIONS), args.sessions,
+                           args.concurrency, args.workers, args.tool_ms / 1000, args.tool_threads)
+        if stub:
+            report["stub"] = dict(stub.stats)
+    finally:
+        if stub:
+            stub.stop()
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    print_table(report)
+    return 0
+
+
+if __name__ == "__main__":
+    # python -m src.lib.agent_bench [--client raw] [--concurrency 200] [--workers 8,32]
+    sys.exit(main())
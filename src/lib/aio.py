@@ -0,0 +1,107 @@
+import asyncio
+import contextvars
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+_DONE = object()
+
+
+class SyncBridge:
+    """
+    One background event loop shared by synchronous callers: `run` awaits a
+    coroutine and `iterate` turns an async generator into a plain generator,
+    both in a copy of the caller's context (MLflow trace spans keep their
+    parent). Lets an asyncio agent sit behind the synchronous
+    `ResponsesAgent.predict`/`predict_stream` interface: every request's
+    I/O is multiplexed on the one loop. Blocking calls the coroutines hand
+    to `asyncio.to_thread` share `io_workers` threads.
+    """
+
+    def __init__(self, name: str = "agent-loop", io_workers: int = 32):
+        self._name = name
+        self.io_workers = io_workers
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(ThreadPoolExecutor(self.io_workers, thread_name_prefix=f"{self._name}-io"))
+                threading.Thread(target=loop.run_forever, name=self._name, daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _spawn(self, coro: Awaitable[Any], box: dict) -> None:
+        # runs on the loop thread inside the caller's copied context, which the task inherits
+        box["task"] = self.loop.create_task(coro)
+        box["ready"].set()
+
+    def run(self, coro: Awaitable[T]) -> T:
+        return next(self.iterate(_single(coro)))
+
+    def iterate(self, agen: AsyncIterator[T]) -> Iterator[T]:
+        items: "queue.Queue" = queue.Queue()
+
+        async def pump() -> None:
+            try:
+                async for item in agen:
+                    items.put((item, None))
+            except BaseException as e:  # noqa: B036 - handed to the consumer thread, cancellation included
+                items.put((_DONE, e))
+            else:
+                items.put((_DONE, None))
+
+        box = {"ready": threading.Event()}
+        ctx = contextvars.copy_context()
+        self.loop.call_soon_threadsafe(ctx.run, self._spawn, pump(), box)
+        finished = False
+        try:
+            while True:
+                item, error = items.get()
+                if item is _DONE:
+                    finished = True
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            if not finished:
+                # the consumer stopped early (client disconnected): stop the producer too
+                box["ready"].wait()
+                self.loop.call_soon_threadsafe(box["task"].cancel)
+
+
+async def _single(coro: Awaitable[T]) -> AsyncIterator[T]:
+    yield await coro
+
+
+def databricks_async_openai_client(workspace_client, max_connections: int = 1000, timeout_s: float = 120.0):
+    """
+    AsyncOpenAI client for the workspace's serving endpoints. Every request
+    is signed with the workspace credentials (`config.authenticate()`, so
+    OAuth tokens refresh like in the SDK's sync client); the connection pool
+    is sized for many concurrent streams.
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    config = workspace_client.config
+
+    class _DatabricksAuth(httpx.Auth):
+        def auth_flow(self, request):
+            request.headers.update(config.authenticate())
+            yield request
+
+    http_client = httpx.AsyncClient(
+        auth=_DatabricksAuth(),
+        timeout=timeout_s,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections // 4),
+    )
+    # the real token is set per request by _DatabricksAuth
+    return AsyncOpenAI(base_url=f"{config.host.rstrip('/')}/serving-endpoints", api_key="databricks",
+                       http_client=http_client)
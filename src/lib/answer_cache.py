@@ -0,0 +1,187 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.lib.embeddings import Embedder
+from src.lib.retrieval_cache import VersionPoller
+
+
+def answer_namespace(system_prompt: str, model: str, index_version: Any) -> str:
+    # answers are only reused under the same prompt, model and index contents
+    raw = "\x1f".join([system_prompt or "", model or "", str(index_version)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    texts: List[str]  # assistant message texts, in output order
+    namespace: str
+    expires_at: float
+    # where the answer came from: model, index version, session, tool calls, creation time, hits
+    provenance: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(t.encode("utf-8")) for t in self.texts) + len(self.question.encode("utf-8"))
+
+
+class SemanticAnswerCache:
+    """
+    Final answers of previous single-turn requests, looked up by cosine
+    similarity of the question embedding (>= `threshold`) within the same
+    namespace (system prompt + model + index version). Bounded by
+    `max_entries` and `max_bytes` with LRU eviction and a `ttl_s`; a new
+    index version from `version_fn` drops the answers of older versions.
+    Vectors live in one preallocated matrix, so a lookup is a single
+    matrix-vector product. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        threshold: float = 0.92,
+        max_entries: int = 512,
+        max_bytes: int = 16 << 20,
+        ttl_s: float = 3600.0,
+        version_fn: Optional[Callable[[], Any]] = None,
+        version_check_s: float = 30.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._poller = VersionPoller(version_fn, version_check_s) if version_fn else None
+        self._vectors: Optional[np.ndarray] = None  # (max_entries, dim), rows indexed by slot
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()  # slot -> answer, LRU order
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                          "expirations": 0, "invalidations": 0}
+
+    def index_version(self) -> Any:
+        if self._poller is None:
+            return None
+        version = self._poller.current()
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    # answers of the previous index contents can not be served again
+                    self._counters["invalidations"] += 1
+                    for slot in [s for s, a in self._entries.items() if a.provenance.get("index_version") != version]:
+                        self._drop(slot)
+                self._version = version
+        return version
+
+    def embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embedder.embed([question])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, vector: np.ndarray, namespace: str) -> Tuple[Optional[CachedAnswer], float]:
+        """Best answer in `namespace` at or above the threshold, or (None, best similarity seen)."""
+        now = self.clock()
+        with self._lock:
+            self._counters["lookups"] += 1
+            best_slot, best = None, 0.0
+            if self._entries:
+                slots = np.fromiter(self._entries.keys(), dtype=np.int64, count=len(self._entries))
+                sims = self._vectors[slots] @ vector
+                for i in np.argsort(-sims):
+                    slot = int(slots[i])
+                    entry = self._entries[slot]
+                    if entry.expires_at <= now:
+                        continue
+                    if entry.namespace == namespace:
+                        best_slot, best = slot, float(sims[i])
+                        break
+                for slot in [s for s, a in self._entries.items() if a.expires_at <= now]:
+                    self._drop(slot)
+                    self._counters["expirations"] += 1
+            if best_slot is None or best < self.threshold or best_slot not in self._entries:
+                self._counters["misses"] += 1
+                return None, best
+            entry = self._entries[best_slot]
+            self._entries.move_to_end(best_slot)
+            entry.provenance["hits"] = entry.provenance.get("hits", 0) + 1
+            entry.provenance["last_hit_at"] = now
+            self._counters["hits"] += 1
+            return entry, best
+
+    def store(self, vector: np.ndarray, namespace: str, question: str, texts: List[str],
+              provenance: Optional[Dict[str, Any]] = None) -> None:
+        if not texts or not any(t.strip() for t in texts):
+            return
+        now = self.clock()
+        answer = CachedAnswer(question, list(texts), namespace, now + self.ttl_s,
+                              {**(provenance or {}), "created_at": now, "hits": 0})
+        if answer.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            # the same question asked again (e.g. with the bypass flag) replaces its previous answer
+            if self._entries:
+                slots = np.fromiter(self._entries.keys(), dtype=np.int64, count=len(self._entries))
+                same = slots[self._vectors[slots] @ vector >= 0.9999]
+                for slot in (int(s) for s in same):
+                    if self._entries[slot].namespace == namespace:
+                        self._drop(slot)
+            while not self._free or self._bytes + answer.nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+            slot = self._free.pop()
+            self._vectors[slot] = vector
+            self._entries[slot] = answer
+            self._bytes += answer.nbytes
+            self._counters["stores"] += 1
+
+    def _drop(self, slot: int) -> None:
+        answer = self._entries.pop(slot)
+        self._bytes -= answer.nbytes
+        self._free.append(slot)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / self._counters["lookups"], 4) if self._counters["lookups"] else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "index_version": self._version,
+            }
+
+
+if __name__ == "__main__":
+    # python -m src.lib.answer_cache: paraphrased repeats of the demo questions against the offline embedder
+    from src.lib.chunk_sweep import DEFAULT_QUESTIONS, load_questions
+    from src.lib.embeddings import HashingEmbedder
+
+    cache = SemanticAnswerCache(HashingEmbedder(), threshold=0.85, version_fn=lambda: 3)
+    ns = answer_namespace("prompt", "databricks-gpt-5-2", cache.index_version())
+    questions = [q["question"] for q in load_questions(DEFAULT_QUESTIONS)["questions"]]
+    for q in questions:
+        cache.store(cache.embed(q), ns, q, [f"resposta para: {q}"], {"model": "databricks-gpt-5-2"})
+    probes = [
+        "qual o aviso previo para cancelar",          # same question, no accents/punctuation
+        "Qual é o aviso prévio para cancelar o contrato?",
+        "Onde fala da multa por rescisão antecipada?",
+        "Qual o prazo de devolução dos equipamentos?",  # not asked before
+    ]
+    for p in probes:
+        t0 = time.perf_counter()
+        hit, sim = cache.lookup(cache.embed(p), ns)
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"{sim:.3f} {'HIT ' if hit else 'miss'} {ms:.2f} ms  {p!r}" + (f" -> {hit.question!r}" if hit else ""))
+    print("stats:", cache.stats)
@@ -0,0 +1,321 @@
+import io
+import json
+import os
+import re
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from src.lib.local_index import filter_mask, search_result
+from src.lib.text import STOPWORDS, fold
+
+# folded text -> exact tokens ("d+30", "2,5%", "r$") first, then plain words
+_TOKEN_RE = re.compile(
+    r"[a-z]{1,3}\+\d+"          # settlement terms: D+1, D+30
+    r"|\d+(?:[.,]\d+)*%?"       # amounts, percentages, clause numbers: 1.000,00 / 2,5% / 5.2
+    r"|r\$"                     # currency marker
+    r"|[a-z0-9]+"
+)
+# "cláusula 7", "item 3.1": the number is also indexed glued to the keyword
+_NUMBERED = {"clausula", "item", "art", "artigo", "anexo", "secao", "paragrafo", "capitulo", "tabela"}
+# light Portuguese suffix folding (plural and -ção/-ções), so "multas"/"multa" and "rescisões"/"rescisão" match
+_SUFFIXES = (("coes", "cao"), ("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("res", "r"), ("s", ""))
+
+
+def _stem(word: str) -> str:
+    if len(word) <= 3 or not word.isalpha():
+        return word
+    for suffix, repl in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: len(word) - len(suffix)] + repl
+    return word
+
+
+def lexical_tokens(text: str) -> List[str]:
+    """
+    BM25 terms: accent-folded, stopwords dropped, plurals folded; "D+30",
+    "2,5%", "R$" and numbers are kept verbatim and "Cláusula 7" also yields
+    "clausula_7".
+    """
+    out = []
+    prev = ""
+    for tok in _TOKEN_RE.findall(fold(text)):
+        if tok in STOPWORDS:
+            prev = ""
+            continue
+        if tok[0].isdigit() and prev in _NUMBERED:
+            out.append(f"{prev}_{tok.rstrip('.')}")
+        out.append(_stem(tok))
+        prev = tok
+    return out
+
+
+class BM25Index:
+    """
+    In-process BM25 (Okapi, k1/b) over chunk texts. Postings are stored CSR
+    style: one uint32 array of row ids and one uint16 array of term
+    frequencies for all terms, sliced by `offsets[term]`, so the whole index
+    is a few contiguous arrays instead of Python dicts and a query is a
+    handful of vectorized gathers plus one bincount.
+    """
+
+    def __init__(self, vocab: Dict[str, int], offsets: np.ndarray, post_rows: np.ndarray, post_tf: np.ndarray,
+                 doc_len: np.ndarray, columns: Dict[str, Sequence], k1: float = 1.2, b: float = 0.75):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.post_rows = post_rows
+        self.post_tf = post_tf
+        self.doc_len = doc_len
+        self.columns = {name: np.asarray(values, dtype=object) for name, values in columns.items()}
+        self.k1 = k1
+        self.b = b
+        n = len(doc_len)
+        df = np.diff(offsets)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(doc_len.mean()) if n else 1.0
+        # per-row length normalization, precomputed once
+        self.norm = (k1 * (1 - b + b * doc_len / max(avgdl, 1e-9))).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + self.post_rows.nbytes + self.post_tf.nbytes + self.doc_len.nbytes
+
+    @classmethod
+    def build(cls, rows: Iterable[dict], text_column: str = "content",
+              columns: Sequence[str] = ("chunk_uid", "doc_name", "page", "content"), **kwargs) -> "BM25Index":
+        vocab: Dict[str, int] = {}
+        pairs_term, pairs_row, pairs_tf = [], [], []
+        doc_len = []
+        kept = {c: [] for c in columns}
+        for row_id, row in enumerate(rows):
+            counts: Dict[int, int] = {}
+            tokens = lexical_tokens(row[text_column])
+            for tok in tokens:
+                tid = vocab.setdefault(tok, len(vocab))
+                counts[tid] = counts.get(tid, 0) + 1
+            doc_len.append(len(tokens))
+            for tid, tf in counts.items():
+                pairs_term.append(tid)
+                pairs_row.append(row_id)
+                pairs_tf.append(min(tf, 65535))
+            for c in columns:
+                kept[c].append(row.get(c))
+
+        terms = np.asarray(pairs_term, dtype=np.int64)
+        order = np.argsort(terms, kind="stable")  # rows stay sorted inside each term
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=offsets[1:])
+        return cls(
+            vocab, offsets,
+            np.asarray(pairs_row, dtype=np.uint32)[order],
+            np.asarray(pairs_tf, dtype=np.uint16)[order],
+            np.asarray(doc_len, dtype=np.float32), kept, **kwargs,
+        )
+
+    def _terms(self, query: str) -> List[int]:
+        return list(dict.fromkeys(self.vocab[t] for t in lexical_tokens(query) if t in self.vocab))
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row."""
+        terms = self._terms(query)
+        total = np.zeros(len(self), dtype=np.float32)
+        for tid in terms:
+            lo, hi = self.offsets[tid], self.offsets[tid + 1]
+            rows = self.post_rows[lo:hi]
+            tf = self.post_tf[lo:hi].astype(np.float32)
+            total += np.bincount(rows, weights=self.idf[tid] * tf * (self.k1 + 1) / (tf + self.norm[rows]),
+                                 minlength=len(self)).astype(np.float32)
+        return total
+
+    def coverage(self, query: str, row: int) -> float:
+        # share of the query's idf mass present in `row`: 1.0 when every informative term matches
+        terms = self._terms(query)
+        if not terms:
+            return 0.0
+        hit = 0.0
+        for tid in terms:
+            lo, hi = self.offsets[tid], self.offsets[tid + 1]
+            pos = np.searchsorted(self.post_rows[lo:hi], row)
+            if pos < hi - lo and self.post_rows[lo + pos] == row:
+                hit += self.idf[tid]
+        return float(hit / self.idf[terms].sum())
+
+    def search(self, query: str, k: int = 10, filters: Optional[Dict[str, Any]] = None):
+        scores = self.scores(query)
+        mask = filter_mask(self.columns, filters, len(self))
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return top, scores[top]
+
+    def similarity_search(self, query_text: str, columns: Optional[List[str]] = None, num_results: int = 10,
+                          filters: Optional[Dict[str, Any]] = None, **kwargs) -> dict:
+        # same result shape as a Vector Search index (score last)
+        positions, scores = self.search(query_text, num_results, filters)
+        return search_result(self.columns, list(columns or self.columns), positions, scores)
+
+    def save(self, path: str) -> None:
+        # built in memory and written in one go (Volumes do not support the seeks zipfile makes)
+        buf = io.BytesIO()
+        np.savez_compressed(
+            buf, offsets=self.offsets, post_rows=self.post_rows, post_tf=self.post_tf, doc_len=self.doc_len,
+            meta=json.dumps({
+                "k1": self.k1, "b": self.b,
+                "vocab": sorted(self.vocab, key=self.vocab.get),
+                "columns": {k: v.tolist() for k, v in self.columns.items()},
+            }, ensure_ascii=False),
+        )
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(buf.getvalue())
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        data = np.load(path, allow_pickle=False)
+        meta = json.loads(str(data["meta"]))
+        return cls(
+            {t: i for i, t in enumerate(meta["vocab"])}, data["offsets"], data["post_rows"], data["post_tf"],
+            data["doc_len"], meta["columns"], k1=meta["k1"], b=meta["b"],
+        )
+
+
+def rows_from_result(result: dict) -> List[dict]:
+    # similarity_search result -> list of row dicts (column name -> value, plus "score")
+    names = [c["name"] for c in result["manifest"]["columns"]]
+    return [dict(zip(names, row)) for row in result["result"]["data_array"]]
+
+
+def vector_search_fn(index, columns: Sequence[str]) -> Callable[[str, int], List[dict]]:
+    # adapts a Vector Search / LocalVectorIndex / TieredIndex to the HybridRetriever interface
+    def search(query: str, k: int) -> List[dict]:
+        return rows_from_result(index.similarity_search(query_text=query, columns=list(columns), num_results=k))
+    return search
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[dict]], key: str = "chunk_uid", rrf_k: int = 60) -> List[dict]:
+    # sum of 1 / (rrf_k + rank) over the rankings a row appears in; the first copy of a row is kept
+    fused: Dict[Any, float] = {}
+    first: Dict[Any, dict] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[row[key]] = fused.get(row[key], 0.0) + 1.0 / (rrf_k + rank)
+            first.setdefault(row[key], row)
+    order = sorted(fused, key=fused.get, reverse=True)
+    return [{**first[uid], "score": round(fused[uid], 6)} for uid in order]
+
+
+class HybridRetriever:
+    """
+    BM25 + vector retrieval fused with reciprocal rank fusion.
+
+    Fast path: when the best BM25 row covers at least `fast_path_coverage`
+    of the query's idf mass (every informative term, "D+30" or "clausula_7"
+    included, is in one chunk), the lexical ranking is returned as is and
+    the vector search (and its embedding call) is skipped.
+    """
+
+    def __init__(self, bm25: BM25Index, vector_fn: Optional[Callable[[str, int], List[dict]]] = None,
+                 columns: Sequence[str] = ("chunk_uid", "doc_name", "page", "content"),
+                 candidates: int = 20, rrf_k: int = 60, fast_path_coverage: float = 0.8):
+        self.bm25 = bm25
+        self.vector_fn = vector_fn
+        self.columns = list(columns)
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.fast_path_coverage = fast_path_coverage
+        self.stats = {"queries": 0, "fast_path": 0, "vector_calls": 0, "vector_errors": 0}
+
+    def retrieve(self, query: str, k: int = 5) -> List[dict]:
+        self.stats["queries"] += 1
+        positions, scores = self.bm25.search(query, max(k, self.candidates))
+        lexical = rows_from_result(search_result(self.bm25.columns, self.columns, positions, scores))
+        if self.vector_fn is None:
+            return lexical[:k]
+        if lexical and self.bm25.coverage(query, int(positions[0])) >= self.fast_path_coverage:
+            self.stats["fast_path"] += 1
+            return lexical[:k]
+        try:
+            self.stats["vector_calls"] += 1
+            vector = self.vector_fn(query, max(k, self.candidates))
+        except Exception:
+            # the lexical ranking still answers when the vector endpoint is down
+            self.stats["vector_errors"] += 1
+            return lexical[:k]
+        return reciprocal_rank_fusion([lexical, vector], rrf_k=self.rrf_k)[:k]
+
+
+def hybrid_tool_spec(name: str = "contract_hybrid_search") -> dict:
+    # OpenAI function-tool spec for the agent (see ToolCallingAgent.get_tool_specs)
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": (
+                "Busca trechos de contratos combinando busca lexical (BM25: termos exatos como 'D+30', "
+                "'MDR', 'Cláusula 7', percentuais) e busca vetorial. Retorna doc_name, page e content."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "Pergunta ou termos a buscar nos contratos."},
+                },
+                "required": ["query"],
+            },
+        },
+    }
+
+
+if __name__ == "__main__":
+    # Build on the bundled PDFs and compare lexical / vector / hybrid recall: python -m src.lib.bm25
+    import sys
+    import time
+
+    import yaml
+
+    from src.lib.chunk_sweep import DEFAULT_QUESTIONS, retrieval_metrics
+    from src.lib.embeddings import HashingEmbedder
+    from src.lib.extract import chunk_pages, extract_page_texts, list_pdfs, to_chunk_rows
+    from src.lib.local_index import LocalVectorIndex
+
+    with open(DEFAULT_QUESTIONS, "r", encoding="utf-8") as f:
+        spec = yaml.safe_load(f)
+    pdf_dir = sys.argv[1] if len(sys.argv) > 1 else spec["pdf_dir"]
+    rows = []
+    for name in sorted(list_pdfs(pdf_dir)):
+        rows += to_chunk_rows(name, pdf_dir, name, chunk_pages(extract_page_texts(os.path.join(pdf_dir, name))), "pt-BR")
+
+    cols = ["chunk_uid", "doc_name", "page", "page_end", "content"]
+    t0 = time.perf_counter()
+    bm25 = BM25Index.build(rows, columns=cols)
+    print(f"BM25: {len(bm25)} chunks, {len(bm25.vocab)} terms, {bm25.nbytes / 1e3:.1f} KB postings, "
+          f"built in {(time.perf_counter() - t0) * 1000:.1f} ms")
+    vectors = LocalVectorIndex.from_rows(rows, HashingEmbedder())
+    hybrid = HybridRetriever(bm25, vector_search_fn(vectors, cols), columns=cols)
+    lexical_only = HybridRetriever(bm25, None, columns=cols)
+    vector_only = vector_search_fn(vectors, cols)
+
+    uid_pos = {r["chunk_uid"]: i for i, r in enumerate(rows)}
+    questions = spec["questions"] + [{"question": "Qual o prazo D+1 do débito?",
+                                      "targets": [{"doc_name": "DEMO_Contrato_Adquirencia_PagServ.pdf", "page": 1}]}]
+    ks = (1, 3, 5)
+    for label, fn in [("bm25", lambda q: lexical_only.retrieve(q, 5)), ("vector", lambda q: vector_only(q, 5)),
+                      ("hybrid", lambda q: hybrid.retrieve(q, 5))]:
+        # one-hot "scores" over the chunks, in retrieved order, reuse the sweep's recall@k
+        scores = np.zeros((len(questions), len(rows)), dtype=np.float32)
+        t0 = time.perf_counter()
+        for qi, q in enumerate(questions):
+            for rank, r in enumerate(fn(q["question"])):
+                scores[qi, uid_pos[r["chunk_uid"]]] = 10 - rank
+        ms = (time.perf_counter() - t0) * 1000 / len(questions)
+        m = retrieval_metrics(rows, np.eye(len(rows), dtype=np.float32), questions, scores, ks)
+        print(f"{label:<7} recall@{ks} = {[m['recall_at_k'][str(k)] for k in ks]}  {ms:.2f} ms/query")
+    print("hybrid stats:", hybrid.stats)
@@ -0,0 +1,212 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import unicodedata
+from dataclasses import asdict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import yaml
+
+from src.lib.chunking import ChunkerConfig
+from src.lib.embeddings import HashingEmbedder
+from src.lib.extract import chunk_pages, extract_page_texts, list_pdfs
+from src.lib.page_cache import EXTRACTOR
+
+DEFAULT_QUESTIONS = "conf/benchmark_questions.yml"
+
+
+def load_questions(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+def sweep_configs(
+    strategies: Sequence[str] = ("legacy", "sentence"),
+    max_chars: Sequence[int] = (500, 700, 900, 1200, 1600),
+    overlaps: Sequence[int] = (0, 120, 240),
+    max_tokens: Sequence[int] = (),
+    overlap_tokens: int = 30,
+) -> List[ChunkerConfig]:
+    configs = [
+        ChunkerConfig(strategy=s, max_chars=m, overlap=o)
+        for s, m, o in itertools.product(strategies, max_chars, overlaps)
+        if o < m
+    ]
+    if "sentence" in strategies:
+        configs += [ChunkerConfig(max_tokens=t, overlap_tokens=overlap_tokens) for t in max_tokens]
+    return configs
+
+
+def _key(name: str) -> str:
+    # file names from os.listdir may be NFD on some filesystems
+    return unicodedata.normalize("NFC", name)
+
+
+def retrieval_metrics(
+    chunks: List[dict],
+    chunk_vectors: np.ndarray,
+    questions: List[dict],
+    question_vectors: np.ndarray,
+    ks: Sequence[int],
+) -> dict:
+    """
+    recall@k: share of a question's target (doc_name, page) pairs covered by
+    the top-k chunks, a chunk covering pages page..page_end; hit@k: share of
+    questions with at least one target in the top k. Both averaged over questions.
+    """
+    scores = question_vectors @ chunk_vectors.T if len(chunks) else np.zeros((len(questions), 0))
+    top = np.argsort(-scores, axis=1, kind="stable")[:, :max(ks)]
+    recall = {k: 0.0 for k in ks}
+    hit = {k: 0.0 for k in ks}
+    per_question = []
+    for q, ranked in zip(questions, top):
+        targets = {(_key(t["doc_name"]), int(t["page"])) for t in q["targets"]}
+        first_hit = None
+        found_at: Dict[tuple, int] = {}
+        for rank, idx in enumerate(ranked, start=1):
+            c = chunks[idx]
+            for page in range(c["page"], c["page_end"] + 1):
+                target = (c["doc_name"], page)
+                if target in targets and target not in found_at:
+                    found_at[target] = rank
+                    first_hit = first_hit or rank
+        for k in ks:
+            covered = sum(1 for r in found_at.values() if r <= k)
+            recall[k] += covered / len(targets)
+            hit[k] += 1.0 if first_hit and first_hit <= k else 0.0
+        per_question.append({"question": q["question"], "first_hit_rank": first_hit})
+    n = max(len(questions), 1)
+    return {
+        "recall_at_k": {str(k): round(v / n, 4) for k, v in recall.items()},
+        "hit_at_k": {str(k): round(v / n, 4) for k, v in hit.items()},
+        "questions": per_question,
+    }
+
+
+def run_sweep(
+    pdf_dir: str,
+    questions: List[dict],
+    configs: List[ChunkerConfig],
+    embedder: Optional[HashingEmbedder] = None,
+    ks: Sequence[int] = (1, 3, 5),
+    repeats: int = 3,
+) -> dict:
+    """
+    Extracts the PDFs in `pdf_dir` once (the page text does not depend on the
+    chunker), then for each chunker config measures chunking throughput (best
+    of `repeats`), chunk count, total characters (the embedding cost proxy)
+    and recall@k of the labelled questions with `embedder`.
+    """
+    embedder = embedder or HashingEmbedder()
+    docs: Dict[str, List[str]] = {}
+    failures = {}
+    t0 = time.perf_counter()
+    for name in sorted(list_pdfs(pdf_dir)):
+        try:
+            docs[_key(name)] = extract_page_texts(os.path.join(pdf_dir, name))
+        except Exception as e:
+            failures[name] = repr(e)
+    extract_s = time.perf_counter() - t0
+    pdf_mb = sum(os.path.getsize(os.path.join(pdf_dir, f)) for f in list_pdfs(pdf_dir)) / 1e6
+    text_mb = sum(len(p.encode("utf-8")) for pages in docs.values() for p in pages) / 1e6
+
+    question_vectors = embedder.embed([q["question"] for q in questions])
+    results = []
+    for cfg in configs:
+        best = float("inf")
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            chunked = {name: chunk_pages(pages, cfg) for name, pages in docs.items()}
+            best = min(best, time.perf_counter() - t0)
+        chunks = [
+            {"doc_name": name, "page": page, "page_end": page_end, "content": content}
+            for name, tuples in chunked.items()
+            for page, _, content, page_end, _, _ in tuples
+        ]
+        total_chars = sum(len(c["content"]) for c in chunks)
+
+        t0 = time.perf_counter()
+        chunk_vectors = embedder.embed([c["content"] for c in chunks])
+        embed_s = time.perf_counter() - t0
+
+        results.append({
+            "signature": cfg.signature,
+            "config": asdict(cfg),
+            "chunks": len(chunks),
+            "total_chars": total_chars,
+            "avg_chunk_chars": round(total_chars / len(chunks), 1) if chunks else 0,
+            # > 1 means the overlap makes us embed text more than once
+            "char_amplification": round(total_chars / max(text_mb * 1e6, 1), 3),
+            "chunk_s": round(best, 5),
+            "chunk_mb_per_s": round(text_mb / best, 2) if best else None,
+            "embed_s": round(embed_s, 4),
+            **retrieval_metrics(chunks, chunk_vectors, questions, question_vectors, ks),
+        })
+
+    return {
+        "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "extractor": EXTRACTOR,
+        "embedder": embedder.name,
+        "pdf_dir": pdf_dir,
+        "documents": len(docs),
+        "failed_documents": failures,
+        "pages": sum(len(p) for p in docs.values()),
+        "pdf_mb": round(pdf_mb, 3),
+        "text_mb": round(text_mb, 4),
+        "extract_s": round(extract_s, 3),
+        "extract_pdf_mb_per_s": round(pdf_mb / extract_s, 2) if extract_s else None,
+        "questions": len(questions),
+        "ks": list(ks),
+        "results": results,
+    }
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Chunking-parameter sweep (offline).")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--pdf-dir", help="defaults to pdf_dir in the questions file")
+    parser.add_argument("--strategies", default="legacy,sentence")
+    parser.add_argument("--max-chars", type=_ints, default=[500, 700, 900, 1200, 1600])
+    parser.add_argument("--overlaps", type=_ints, default=[0, 120, 240])
+    parser.add_argument("--max-tokens", type=_ints, default=[128, 256])
+    parser.add_argument("--k", type=_ints, default=[1, 3, 5])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="JSON report path (default: stdout)")
+    args = parser.parse_args(argv)
+
+    spec = load_questions(args.questions)
+    pdf_dir = args.pdf_dir or spec["pdf_dir"]
+    configs = sweep_configs(args.strategies.split(","), args.max_chars, args.overlaps, args.max_tokens)
+    report = run_sweep(pdf_dir, spec["questions"], configs, ks=args.k, repeats=args.repeats)
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+    k = str(max(args.k))
+    print(f"{report['documents']} docs, {report['text_mb']:.3f} MB text, "
+          f"extraction {report['extract_pdf_mb_per_s']} MB/s of PDF", file=sys.stderr)
+    print(f"{'config':<22} {'chunks':>6} {'chars':>8} {'MB/s':>7} {'R@' + k:>6} {'hit@1':>6}", file=sys.stderr)
+    for r in report["results"]:
+        print(f"{r['signature']:<22} {r['chunks']:>6} {r['total_chars']:>8} {r['chunk_mb_per_s']:>7} "
+              f"{r['recall_at_k'][k]:>6} {r['hit_at_k'][str(min(args.k))]:>6}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    # python -m src.lib.chunk_sweep [--output report.json]
+    sys.exit(main())
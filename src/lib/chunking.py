@@ -0,0 +1,284 @@
+import re
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+
+def chunk_text(text: str, max_chars: int = 900, overlap: int = 120):
+    text = re.sub(r"\s+", " ", (text or "")).strip()
+    if not text:
+        return []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + max_chars)
+        chunks.append(text[start:end])
+        if end == len(text):
+            break
+        start = max(0, end - overlap)
+    return chunks
+
+
+###############################################################################
+## Sentence/clause-aware chunker
+###############################################################################
+
+# approximates sub-word tokens (bge / gpt tokenizers split long words in pieces)
+TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+# clause heading: "Cláusula 5.2", "Art. 7", "§ 2", "Parágrafo único", "2.1 Solicitação", "3. Cancelamento"
+_HEADING = (
+    r"(?:(?i:cl[áa]usula|art(?:igo)?\.?|§|par[áa]grafo|se[çc][ãa]o|cap[íi]tulo|anexo|section|article)\s*(?:[\dIVXLC]+|[úu]nico)"
+    r"|\d{1,2}(?:\.\d{1,2})+\.?\s+[A-ZÀ-Ý]"
+    r"|\d{1,2}\.\s+[A-ZÀ-Ý])"
+)
+# headings are only looked for at line starts and after sentence ends: a regex
+# starting with a literal "\n" / punctuation is much cheaper than one tried at every position.
+# Lines are normalized (no leading blanks) and most do not start with a heading's first character
+_LINE_HEADING_RE = re.compile(r"\n(?=[\d§ACPSacps])(?=" + _HEADING + ")")
+_ABBREVIATIONS = {
+    "sr", "sra", "dr", "dra", "art", "arts", "inc", "n", "nº", "p", "pp", "ex", "fls",
+    "cia", "ltda", "av", "vs", "obs", "pág", "cf", "mr", "ms", "co", "corp",
+}
+
+# end of a sentence, up to the next unit's first character, which group 1 captures when a heading
+# starts there. A "." after an abbreviation ("Art.", "Sr.") is rejected in the regex, one lookbehind
+# per abbreviation length
+_SENTENCE_RE = re.compile(
+    r"[.!?](?i:"
+    + "".join(rf"(?<!\b(?:{'|'.join(re.escape(a) for a in _ABBREVIATIONS if len(a) == size)})\.)" for size in range(1, 5))
+    + r")[\"”’')\]]*\s+(?=(" + _HEADING + r")|\S)"
+)
+# end of a clause inside a sentence. Only looked for in windows with no sentence end: contracts are
+# full of "Contratante:" / "Valor:" lines and a document-wide pass would cost more than the rest
+_CLAUSE_RE = re.compile(r"[;:][\"”’')\]]*\s+(?=\S)")
+
+HEADING, SENTENCE = 2, 1
+_HEADING_RUN = 80
+
+# a page without these (nor leading/trailing blanks) is already normalized, as most text layers are
+_UNNORMALIZED = ("  ", " \n", "\n ", "\n\n") + tuple(
+    ch for ch in map(chr, range(0x3001)) if ch.isspace() and ch not in " \n"
+)
+
+
+@dataclass
+class ChunkerConfig:
+    strategy: str = "sentence"  # "sentence" or "legacy" (chunk_text, one page at a time)
+    max_chars: int = 900
+    overlap: int = 120
+    max_tokens: Optional[int] = None  # when set, max_tokens/overlap_tokens replace the char budget
+    overlap_tokens: int = 30
+
+    @property
+    def signature(self) -> str:
+        if self.strategy == "legacy":
+            return f"legacy:{self.max_chars}:{self.overlap}"
+        # sentence2: budgets and offsets are on the whitespace-normalized text (were on the raw text);
+        # token budgets are counted exactly since sentence:t2 (were sized from the chars/token ratio)
+        if self.max_tokens:
+            return f"sentence2:t:{self.max_tokens}:{self.overlap_tokens}"
+        return f"sentence2:{self.max_chars}:{self.overlap}"
+
+
+@dataclass
+class Chunk:
+    content: str
+    char_start: int  # [char_start, char_end) in document_text(pages)
+    char_end: int
+    page_start: int  # 1-based
+    page_end: int
+
+
+def estimate_tokens(text: str) -> int:
+    return len(TOKEN_RE.findall(text or ""))
+
+
+def _boundaries(text: str):
+    # candidate chunk ends, as (position, level) sorted by position; position is where the next unit starts
+    found = {}
+    headings = [m.end() for m in _LINE_HEADING_RE.finditer(text)]
+    for m in _SENTENCE_RE.finditer(text):
+        pos = m.end()
+        if m.lastindex:
+            headings.append(pos)
+        # "... o Sr. Silva" was already rejected; ". e depois" ends no sentence either
+        elif text[m.start()] != "." or not text[pos].islower():
+            found[pos] = SENTENCE
+    # "4. Prazos 4.1 Liquidação": only the first heading of a run is a strong break,
+    # so a section title is not left alone at the end of a chunk
+    last_heading = -_HEADING_RUN
+    for pos in sorted(set(headings)):
+        found[pos] = HEADING if pos - last_heading >= _HEADING_RUN else SENTENCE
+        last_heading = pos
+    positions = sorted(found)
+    return positions, list(map(found.__getitem__, positions))
+
+
+def _token_limit(text: str, start: int, max_tokens: int) -> int:
+    # where the (max_tokens + 1)-th token from start begins (the text end when there are fewer):
+    # one lazy scan that stops there, no token strings built
+    nxt = next(islice(TOKEN_RE.finditer(text, start), max_tokens, None), None)
+    return nxt.start() if nxt else len(text)
+
+
+def _clause_boundary(text: str, lo: int, hi: int) -> int:
+    # start of the last unit in [lo, hi] that follows a ";" / ":", or -1
+    best = -1
+    for m in _CLAUSE_RE.finditer(text, max(0, lo - 8), hi + 1):
+        if m.end() >= lo:
+            best = m.end()
+    return best
+
+
+def _word_boundary(text: str, lo: int, hi: int) -> int:
+    # position after the last separator in (lo, hi), or hi (hard cut) when there is none
+    i = max(text.rfind(" ", lo + 1, hi), text.rfind("\n", lo + 1, hi))
+    return i + 1 if i > lo else hi
+
+
+def _next_word(text: str, lo: int, hi: int) -> int:
+    # position after the first separator in [lo, hi), or hi when there is none
+    found = [i for i in (text.find(" ", lo, hi), text.find("\n", lo, hi)) if i >= 0]
+    return min(found) + 1 if found else hi
+
+
+def normalize_page(page: str) -> str:
+    # whitespace runs collapsed to one " " inside a line and blank lines dropped; line breaks are
+    # kept as "\n" for the line-start heading pass (str.split/join is C code, ~3x faster than re.sub)
+    page = page or ""
+    if page.strip(" \n") == page and not any(s in page for s in _UNNORMALIZED):
+        return page  # already normalized: a few substring scans, no copy
+    return "\n".join(filter(None, [" ".join(line.split()) for line in page.split("\n")]))
+
+
+def document_text(pages: Sequence[str]) -> Tuple[str, List[int]]:
+    """
+    The text chunk offsets refer to: the normalized pages joined by a line
+    break (every separator is then one space or line break), plus where
+    each page starts in it.
+    """
+    page_starts = []
+    parts = []
+    offset = 0
+    for page in pages:
+        page_starts.append(offset)
+        page = normalize_page(page)
+        if page:
+            parts.append(page)
+            offset += len(page) + 1
+    return "\n".join(parts), page_starts
+
+
+def chunk_document(pages: Sequence[str], config: Optional[ChunkerConfig] = None) -> List[Chunk]:
+    """
+    Splits a document (list of page texts) in chunks that end on clause
+    headings or sentence ends whenever one falls in the second half of the
+    window, then on ";"/":", then on whitespace. Chunks may cross pages and
+    keep their offsets in document_text(pages) plus the page span they cover.
+
+    Whitespace is normalized once per document, headings and sentence ends
+    are found with one regex pass each (";"/":" only inside windows that have
+    neither) and the greedy loop only moves forward (plus the overlap), so the
+    cost is linear in the text size.
+    """
+    config = config or ChunkerConfig()
+    text, page_starts = document_text(pages)
+    n = len(text)
+
+    positions, levels = _boundaries(text)
+
+    chunks: List[Chunk] = []
+    chars_per_token = 4.0
+    start = 0
+    while start < n:
+        if text[start] in " \n":
+            start += 1  # after a hard cut
+            continue
+
+        if config.max_tokens:
+            limit = _token_limit(text, start, config.max_tokens)
+            if limit < n:
+                chars_per_token = (limit - start) / config.max_tokens
+        else:
+            limit = min(n, start + config.max_chars)
+
+        if limit >= n:
+            end = n
+        else:
+            half = max(start + (limit - start) // 2, start + 1)
+            # the strongest boundary in [half, limit], the last one among equals
+            lo, hi = bisect_left(positions, half), bisect_right(positions, limit)
+            if lo < hi:
+                window = levels[lo:hi]
+                end = positions[hi - 1 - window[::-1].index(max(window))]
+            else:
+                end = _clause_boundary(text, half, limit)
+                if end < 0:
+                    end = _word_boundary(text, half, limit)
+
+        last = end - 1 if text[end - 1] in " \n" else end
+        chunks.append(Chunk(
+            content=text[start:last].replace("\n", " "),
+            char_start=start,
+            char_end=last,
+            page_start=bisect_right(page_starts, start),
+            page_end=bisect_right(page_starts, last - 1),
+        ))
+        if end >= n:
+            break
+
+        # next chunk starts `overlap` before the end, snapped forward to a sentence or word start
+        if config.max_tokens:
+            # overlap_tokens converted to chars with the current chars/token ratio
+            target = end - int(config.overlap_tokens * chars_per_token)
+        else:
+            target = end - config.overlap
+        next_start = end
+        if target < end:
+            k = bisect_right(positions, target - 1)
+            if k < len(positions) and positions[k] < end:
+                next_start = positions[k]
+            else:
+                next_start = _next_word(text, target, end)
+        start = next_start if next_start > start else end
+    return chunks
+
+
+if __name__ == "__main__":
+    # Micro-benchmark against chunk_text: python -m src.lib.chunking [pdf_dir ...]
+    # (defaults to both sample corpora, ~0.9 MB of text: the pt-br folder alone is too small to time)
+    import os
+    import sys
+    import time
+
+    from src.lib.extract import extract_page_texts, list_pdfs
+
+    pdf_dirs = sys.argv[1:] or ["assets/pdfs/pt-br", "assets/pdfs/en"]
+    repeats = 15
+    docs = []
+    for pdf_dir in pdf_dirs:
+        for f in list_pdfs(pdf_dir):
+            try:
+                docs.append(extract_page_texts(os.path.join(pdf_dir, f)))
+            except Exception as e:  # encrypted / truncated downloads
+                print(f"skipped {f}: {type(e).__name__}")
+    mb = sum(len(p.encode("utf-8")) for pages in docs for p in pages) / 1e6
+
+    runs = {
+        "chunk_text (per page)": lambda pages: [c for p in pages for c in chunk_text(p)],
+        "chunk_document (chars)": lambda pages: chunk_document(pages),
+        "chunk_document (tokens)": lambda pages: chunk_document(pages, ChunkerConfig(max_tokens=256)),
+    }
+    # round-robin, so a noisy neighbour slows all the chunkers of a repeat alike
+    best = dict.fromkeys(runs, float("inf"))
+    counts = {}
+    for _ in range(repeats):
+        for name, fn in runs.items():
+            t0 = time.perf_counter()
+            counts[name] = sum(len(fn(pages)) for pages in docs)
+            best[name] = min(best[name], time.perf_counter() - t0)
+    print(f"{len(docs)} docs, {mb:.2f} MB of text, best of {repeats}")
+    for name, secs in best.items():
+        print(f"{name:<26} {counts[name]:>6} chunks  {secs * 1000:8.1f} ms  {secs / mb * 1000:8.1f} ms/MB")
@@ -1,6 +1,7 @@
 import os
 import yaml
 from dataclasses import dataclass
+from typing import Optional
 
 @dataclass
 class DemoConfig:
@@ -12,6 +13,14 @@ class DemoConfig:
     vector_search_index: str
     chat_model_endpoint: str
     embedding_model_endpoint: str
+    # table the vector index is built from (defaults to source_table)
+    index_source_table: Optional[str] = None
+    # pdf directory staged by notebook 01, relative to the repo root
+    pdf_source_dir: str = "assets/pdfs/pt-br"
+    # "managed": Vector Search embeds `content`; "precomputed": notebook 02 fills `embedding`
+    embedding_mode: str = "managed"
+    # embedder of the precomputed mode: "endpoint" (embedding_model_endpoint) or "hashing" (offline)
+    embedder: str = "endpoint"
 
 def load_config(path: str) -> DemoConfig:
     with open(path, "r", encoding="utf-8") as f:
@@ -27,9 +36,16 @@ def load_config(path: str) -> DemoConfig:
     cfg = {k: render(v) for k, v in raw.items()}
     return DemoConfig(**cfg)
 
+def index_source_table(cfg: DemoConfig) -> str:
+    return cfg.index_source_table or cfg.source_table
+
 def volume_dbfs_path(cfg: DemoConfig) -> str:
     return f"dbfs:/Volumes/{cfg.catalog}/{cfg.schema}/{cfg.volume}"
 
 def volume_local_path(cfg: DemoConfig) -> str:
     # /dbfs is mounted local view of dbfs:
     return f"/Volumes/{cfg.catalog}/{cfg.schema}/{cfg.volume}"
+
+def bm25_index_path(cfg: DemoConfig) -> str:
+    # BM25 index of index_source_table, built by notebook 02 and loaded by the agent (hybrid search tool)
+    return f"{volume_local_path(cfg)}/_bm25/{index_source_table(cfg).split('.')[-1]}_bm25.npz"
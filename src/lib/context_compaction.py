@@ -0,0 +1,253 @@
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+from src.lib.chunking import estimate_tokens
+
+
+@dataclass
+class Passage:
+    doc: str
+    pages: List[Any]  # page numbers covered, in order (several after a merge)
+    text: str
+
+    def citation(self) -> str:
+        pages = [p for p in self.pages if p is not None]
+        if not pages:
+            return f"[{self.doc}]"
+        first, last = pages[0], pages[-1]
+        return f"[{self.doc} p.{first}]" if first == last else f"[{self.doc} p.{first}-{last}]"
+
+    def render(self) -> str:
+        return f"{self.citation()} {self.text}"
+
+
+def passages_from_output(output: Any) -> Optional[List[Passage]]:
+    """
+    Retrieved chunks of a tool output: hybrid_search rows ({doc_name, page, content}), Vector Search
+    tool documents ({page_content, metadata}) or Document objects. None for any other output.
+    """
+    if not isinstance(output, (list, tuple)) or not output:
+        return None
+    passages = []
+    for item in output:
+        if hasattr(item, "page_content"):
+            text, meta = item.page_content, getattr(item, "metadata", None) or {}
+        elif isinstance(item, dict) and "page_content" in item:
+            text, meta = item["page_content"], item.get("metadata") or {}
+        elif isinstance(item, dict) and "content" in item:
+            text, meta = item["content"], item
+        else:
+            return None
+        if not isinstance(text, str):
+            return None
+        doc = meta.get("doc_name") or meta.get("doc_uri") or meta.get("source") or "?"
+        page = meta.get("page", meta.get("page_start"))
+        passages.append(Passage(str(doc), [page], " ".join(text.split())))
+    return passages
+
+
+def overlap_length(a: str, b: str, min_overlap: int = 24, max_overlap: int = 400) -> int:
+    """Length of the longest suffix of `a` (at most `max_overlap`) that starts `b`; 0 below `min_overlap`."""
+    if len(a) < min_overlap or len(b) < min_overlap:
+        return 0
+    head = b[:min_overlap]
+    pos = a.find(head, max(0, len(a) - max_overlap))
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(head, pos + 1)
+    return 0
+
+
+def merge_overlaps(passages: List[Passage], min_overlap: int = 24, max_overlap: int = 400) -> tuple:
+    """
+    Joins passages of the same document whose ends overlap (adjacent chunks share their `overlap`
+    characters), keeping the position of the better ranked one. Returns (passages, merges).
+    """
+    passages = list(passages)
+    merges = 0
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(passages)):
+            for j in range(i + 1, len(passages)):
+                a, b = passages[i], passages[j]
+                if a.doc != b.doc:
+                    continue
+                if k := overlap_length(a.text, b.text, min_overlap, max_overlap):
+                    passages[i] = Passage(a.doc, a.pages + b.pages, a.text + b.text[k:])
+                elif k := overlap_length(b.text, a.text, min_overlap, max_overlap):
+                    passages[i] = Passage(a.doc, b.pages + a.pages, b.text + a.text[k:])
+                else:
+                    continue
+                del passages[j]
+                merges += 1
+                merged = True
+                break
+            if merged:
+                break
+    return passages, merges
+
+
+def _cut(text: str, max_tokens: int) -> str:
+    # longest word-boundary prefix of text within max_tokens (estimated), marked as cut
+    end = min(len(text), int(len(text) * max_tokens / max(estimate_tokens(text), 1)))
+    while end > 0 and estimate_tokens(text[:end]) > max_tokens:
+        end = end * 9 // 10
+    space = text.rfind(" ", 0, end)
+    return text[:space if space > 0 else end].rstrip() + " …"
+
+
+@dataclass
+class CompactionStats:
+    calls: int = 0
+    passages: int = 0  # retrieved chunks received
+    duplicates: int = 0  # already in the conversation, dropped
+    merged: int = 0  # joined to an overlapping chunk
+    over_budget: int = 0  # dropped (or cut) to stay within the budget
+    raw_tokens: int = 0  # str() of the outputs, what the agent used to send
+    tokens: int = 0  # what was sent instead
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.raw_tokens - self.tokens
+
+    def as_dict(self) -> Dict[str, int]:
+        return {**self.__dict__, "tokens_saved": self.tokens_saved}
+
+
+class ContextCompactor:
+    """
+    Tool outputs of one request, rewritten before they enter the prompt:
+    retrieved chunks become compact citations ("[doc p.N] text"), chunks the
+    conversation already has (earlier rounds or `history`) are dropped or
+    trimmed to the new part, overlapping chunks are merged, and all tool
+    output of the request stays within `budget_tokens` (lower-ranked chunks
+    go first; the last one that fits partly is cut at a word). Outputs that
+    are not retrieval results pass through as str() but count against the
+    budget. Thread-safe: the calls of one turn run in parallel.
+    """
+
+    def __init__(self, budget_tokens: int = 4000, history: Sequence[str] = (), min_overlap: int = 24,
+                 max_overlap: int = 400, min_cut_tokens: int = 40):
+        self.budget_tokens = budget_tokens
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self.min_cut_tokens = min_cut_tokens
+        self.stats = CompactionStats()
+        # doc -> texts already sent; None holds earlier outputs of the conversation, whatever their format
+        self._seen: Dict[Optional[str], List[str]] = {None: [h for h in history if h]}
+        self._lock = threading.Lock()
+
+    @property
+    def remaining_tokens(self) -> int:
+        return max(self.budget_tokens - self.stats.tokens, 0)
+
+    def _unseen(self, passage: Passage) -> Optional[Passage]:
+        # the part of the passage the conversation does not have yet (None: all of it was sent)
+        seen = self._seen.get(passage.doc, []) + self._seen[None]
+        text = passage.text
+        if any(text in s for s in seen):
+            return None
+        for s in self._seen.get(passage.doc, []):
+            if k := overlap_length(s, text, self.min_overlap, self.max_overlap):
+                text = text[k:].lstrip()
+            if k := overlap_length(text, s, self.min_overlap, self.max_overlap):
+                text = text[:-k].rstrip()
+        return Passage(passage.doc, passage.pages, text) if text else None
+
+    def compact(self, output: Any) -> str:
+        raw = str(output)
+        passages = passages_from_output(output)
+        with self._lock:
+            self.stats.calls += 1
+            self.stats.raw_tokens += estimate_tokens(raw)
+            if passages is None:
+                self.stats.tokens += estimate_tokens(raw)
+                return raw
+
+            self.stats.passages += len(passages)
+            fresh = []
+            for p in passages:
+                unseen = self._unseen(p)
+                if unseen is None:
+                    self.stats.duplicates += 1
+                else:
+                    fresh.append(unseen)
+            fresh, merges = merge_overlaps(fresh, self.min_overlap, self.max_overlap)
+            self.stats.merged += merges
+
+            blocks = []
+            for i, p in enumerate(fresh):
+                block = p.render()
+                cost = estimate_tokens(block) + 1
+                if cost > self.remaining_tokens:
+                    if self.remaining_tokens >= self.min_cut_tokens:
+                        budget = self.remaining_tokens - estimate_tokens(p.citation()) - 1
+                        p = Passage(p.doc, p.pages, _cut(p.text, budget))
+                        block = p.render()
+                        blocks.append(block)
+                        self.stats.tokens += estimate_tokens(block) + 1
+                        self._seen.setdefault(p.doc, []).append(p.text.rstrip(" …"))
+                    self.stats.over_budget += len(fresh) - i
+                    break
+                blocks.append(block)
+                self.stats.tokens += cost
+                self._seen.setdefault(p.doc, []).append(p.text)
+
+            dropped = len(passages) - len(blocks) - merges
+            if not blocks:
+                note = (f"No new passages: the {len(passages)} results were already provided above."
+                        if fresh == [] else
+                        f"Context budget exhausted: {dropped} passages omitted; answer with the passages above.")
+            elif dropped:
+                note = f"({dropped} passages omitted: already provided above or over the context budget)"
+            else:
+                note = ""
+            text = "\n".join(blocks + ([note] if note else []))
+            self.stats.tokens += estimate_tokens(note)
+            return text
+
+
+class CompactionTotals:
+    """Compaction counters summed over requests (thread-safe), for the agent's stats."""
+
+    def __init__(self):
+        self._totals = CompactionStats()
+        self._requests = 0
+        self._lock = threading.Lock()
+
+    def add(self, stats: CompactionStats) -> None:
+        with self._lock:
+            self._requests += 1
+            for name, value in stats.__dict__.items():
+                setattr(self._totals, name, getattr(self._totals, name) + value)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = self._totals.as_dict()
+            saved = totals["tokens_saved"] / totals["raw_tokens"] if totals["raw_tokens"] else 0.0
+            return {"requests": self._requests, **totals, "saved_ratio": round(saved, 4)}
+
+
+if __name__ == "__main__":
+    # python -m src.lib.context_compaction [pdf_dir]: three retrieval rounds of one request, raw str() vs compacted
+    import sys
+
+    from src.lib.loadtest import local_index_fn
+
+    pdf_dir = sys.argv[1] if len(sys.argv) > 1 else "assets/pdfs/pt-br"
+    search = local_index_fn(pdf_dir, "hybrid", num_results=5)
+    rounds = ["aviso prévio para rescisão do contrato", "multa por rescisão antecipada", "prazo de rescisão e multa"]
+    compactor = ContextCompactor(budget_tokens=1500)
+    raw_total = 0
+    for query in rounds:
+        rows = search(query)
+        raw_total += estimate_tokens(str(rows))
+        text = compactor.compact(rows)
+        print(f"--- {query!r}: raw {estimate_tokens(str(rows))} tokens -> {estimate_tokens(text)} tokens")
+        print(text[:600] + (" [...]" if len(text) > 600 else ""))
+    # the prompt resends every earlier tool output on each round
+    print("stats:", compactor.stats.as_dict())
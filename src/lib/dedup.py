@@ -0,0 +1,126 @@
+import hashlib
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from src.lib.text import normalize
+
+_PRIME = (1 << 32) + 15  # smallest prime above 2^32 (shingle hashes are crc32)
+
+
+def shingle_hashes(normalized: str, k: int = 5) -> np.ndarray:
+    words = normalized.split()
+    if len(words) <= k:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+class MinHasher:
+    """MinHash signatures with `num_perm` universal hash functions (a*x + b) mod p."""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: np.ndarray) -> np.ndarray:
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+
+    def find(self, x: int) -> int:
+        root = self.parent.setdefault(x, x)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while x != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x: int, y: int) -> None:
+        rx, ry = self.find(x), self.find(y)
+        if rx != ry:
+            self.parent[max(rx, ry)] = min(rx, ry)
+
+
+@dataclass
+class DedupCluster:
+    canonical_uid: str
+    members: List[dict] = field(default_factory=list)  # chunk_uid/doc_name/page/chunk_id of every copy
+
+    @property
+    def sources(self) -> str:
+        return " | ".join(f"{m['doc_name']} p.{m['page']}" for m in self.members)
+
+
+def dedup_chunks(
+    rows: Iterable[dict],
+    threshold: float = 0.85,
+    num_perm: int = 128,
+    bands: int = 16,
+    shingle_size: int = 5,
+    prefer: Optional[Set[str]] = None,
+) -> List[DedupCluster]:
+    """
+    Groups exact and near-duplicate chunks (estimated Jaccard similarity of
+    word 5-gram shingles >= `threshold`) and returns one cluster per distinct
+    chunk, each with its canonical chunk_uid.
+
+    Exact copies (same normalized text) are grouped by digest first; the rest
+    go through MinHash + LSH banding (`bands` x num_perm/bands rows), and every
+    bucket member is verified against the bucket's first member only, so big
+    boilerplate buckets stay linear. Rows need chunk_uid, doc_name, page,
+    chunk_id and content; the content is not kept, so `rows` can be streamed.
+
+    The canonical chunk of a cluster is one in `prefer` (e.g. the current
+    canonical chunks) when possible, else the first by (doc_name, page,
+    chunk_id), so re-runs do not flip canonical chunks needlessly.
+    """
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+    rows_per_band = num_perm // bands
+    prefer = prefer or set()
+    hasher = MinHasher(num_perm)
+
+    meta: List[dict] = []
+    uf = _UnionFind()
+    by_digest: Dict[bytes, int] = {}
+    signatures: Dict[int, np.ndarray] = {}
+    for i, row in enumerate(rows):
+        meta.append({k: row[k] for k in ("chunk_uid", "doc_name", "page", "chunk_id")})
+        uf.find(i)
+        text = normalize(row["content"])
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        first = by_digest.setdefault(digest, i)
+        if first != i:
+            uf.union(first, i)
+        else:
+            signatures[i] = hasher.signature(shingle_hashes(text, shingle_size))
+
+    for band in range(bands):
+        lo, hi = band * rows_per_band, (band + 1) * rows_per_band
+        buckets: Dict[bytes, int] = {}
+        for i, sig in signatures.items():
+            head = buckets.setdefault(sig[lo:hi].tobytes(), i)
+            if head != i and uf.find(head) != uf.find(i):
+                if np.count_nonzero(signatures[head] == sig) / num_perm >= threshold:
+                    uf.union(head, i)
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(meta)):
+        groups.setdefault(uf.find(i), []).append(i)
+
+    clusters = []
+    for members in groups.values():
+        ordered = sorted((meta[i] for i in members), key=lambda m: (m["doc_name"], m["page"], m["chunk_id"]))
+        preferred = [m for m in ordered if m["chunk_uid"] in prefer]
+        canonical = (preferred or ordered)[0]
+        clusters.append(DedupCluster(canonical_uid=canonical["chunk_uid"], members=ordered))
+    return clusters
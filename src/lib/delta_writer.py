@@ -0,0 +1,83 @@
+from typing import Iterable, Iterator
+
+import pyarrow as pa
+
+from src.lib.extract import CHUNKS_DDL
+
+# same columns/types as CHUNKS_DDL (the contracts_chunks table)
+CHUNKS_ARROW_SCHEMA = pa.schema([
+    ("chunk_uid", pa.string()),
+    ("doc_id", pa.string()),
+    ("source_path", pa.string()),
+    ("doc_name", pa.string()),
+    ("page", pa.int64()),
+    ("chunk_id", pa.int64()),
+    ("content", pa.string()),
+    ("lang", pa.string()),
+    ("page_end", pa.int64()),
+    ("char_start", pa.int64()),
+    ("char_end", pa.int64()),
+    ("chunker", pa.string()),
+])
+
+
+def iter_record_batches(
+    rows: Iterable[dict],
+    batch_size: int = 2048,
+    schema: pa.Schema = CHUNKS_ARROW_SCHEMA,
+) -> Iterator[pa.RecordBatch]:
+    """Groups a stream of row dicts into Arrow record batches of at most `batch_size` rows."""
+    names = schema.names
+    columns = {name: [] for name in names}
+    n = 0
+    for row in rows:
+        for name in names:
+            columns[name].append(row[name])
+        n += 1
+        if n == batch_size:
+            yield pa.RecordBatch.from_pydict(columns, schema=schema)
+            columns = {name: [] for name in names}
+            n = 0
+    if n:
+        yield pa.RecordBatch.from_pydict(columns, schema=schema)
+
+
+def write_chunks_df(spark, table: str, df, create_table: bool, append: bool = False) -> None:
+    """
+    With `create_table` the table is (re)created with Change Data Feed enabled,
+    or appended to when `append` is set. Otherwise the rows are merged
+    insert-only on `chunk_uid`, which keeps re-runs idempotent.
+    """
+    if create_table and not append:
+        (df.write
+          .mode("overwrite")
+          .option("overwriteSchema", "true")
+          .option("delta.enableChangeDataFeed", "true")
+          .saveAsTable(table))
+    elif create_table:
+        df.write.mode("append").saveAsTable(table)
+    else:
+        df.createOrReplaceTempView("new_chunks")
+        spark.sql(f"""
+        MERGE INTO {table} t
+        USING new_chunks s
+        ON t.chunk_uid = s.chunk_uid
+        WHEN NOT MATCHED THEN INSERT *
+        """)
+
+
+def write_chunk_batches(spark, table: str, batches: Iterable[pa.RecordBatch], create_table: bool) -> int:
+    """
+    Writes each record batch to the Delta table as it arrives (see
+    `write_chunks_df`), so only one batch is held on the driver at a time.
+    Returns the number of rows written.
+    """
+    written = 0
+    for batch in batches:
+        df = spark.createDataFrame(batch.to_pandas(), schema=CHUNKS_DDL)
+        write_chunks_df(spark, table, df, create_table, append=written > 0)
+        written += batch.num_rows
+
+    if create_table and written == 0:
+        write_chunks_df(spark, table, spark.createDataFrame([], schema=CHUNKS_DDL), create_table)
+    return written
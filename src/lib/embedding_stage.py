@@ -0,0 +1,115 @@
+import time
+from typing import Dict, Iterator, List, Tuple
+
+import pandas as pd
+
+from src.lib.embeddings import Embedder, embed_batched
+from src.lib.manifest import sql_string
+
+# columns added to contracts_chunks by the embedding stage
+EMBEDDING_COLUMNS = {"embedding": "ARRAY<FLOAT>", "content_sha": "STRING", "embedding_model": "STRING"}
+# content-addressed vectors: survive chunk deletes, so re-chunked/changed docs reuse unchanged text
+EMBEDDING_CACHE_DDL = "content_sha STRING, embedding_model STRING, embedding ARRAY<FLOAT>"
+
+
+def ensure_embedding_columns(spark, table: str) -> None:
+    existing = set(spark.read.table(table).columns)
+    missing = [f"{name} {dtype}" for name, dtype in EMBEDDING_COLUMNS.items() if name not in existing]
+    if missing:
+        spark.sql(f"ALTER TABLE {table} ADD COLUMNS ({', '.join(missing)})")
+
+
+def _micro_batches(rows: Iterator, size: int) -> Iterator[List[Tuple[str, str]]]:
+    batch = []
+    for r in rows:
+        batch.append((r["content_sha"], r["content"]))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_chunks_table(
+    spark,
+    chunks_table: str,
+    cache_table: str,
+    embedder: Embedder,
+    rows_per_write: int = 4096,
+    batch_size: int = 64,
+    max_concurrency: int = 4,
+    max_retries: int = 4,
+) -> Dict[str, float]:
+    """
+    Fills the `embedding` column of `chunks_table` for chunks without a
+    vector for the current embedder (new chunks, edited content or a model
+    switch). Vectors are looked up by (sha256 of content, embedder name) in
+    `cache_table` first; only the missing distinct texts are sent to the
+    embedder, `rows_per_write` at a time through `embed_batched`, and
+    appended to the cache. The chunks are then updated with one MERGE.
+    """
+    ensure_embedding_columns(spark, chunks_table)
+    spark.sql(f"CREATE TABLE IF NOT EXISTS {cache_table} ({EMBEDDING_CACHE_DDL})")
+    model = sql_string(embedder.name)
+
+    spark.sql(f"""
+    CREATE OR REPLACE TEMP VIEW pending_embeddings AS
+    SELECT chunk_uid, content, sha2(content, 256) AS content_sha
+    FROM {chunks_table}
+    WHERE embedding IS NULL
+       OR embedding_model IS DISTINCT FROM {model}
+       OR content_sha IS DISTINCT FROM sha2(content, 256)
+    """)
+    cached = f"EXISTS (SELECT 1 FROM {cache_table} c WHERE c.content_sha = p.content_sha AND c.embedding_model = {model})"
+    counts = spark.sql(
+        f"SELECT count(*) AS pending, count_if({cached}) AS reused FROM pending_embeddings p"
+    ).collect()[0]
+    pending = counts["pending"]
+    misses = spark.sql(f"""
+    SELECT content_sha, first(content) AS content
+    FROM pending_embeddings p
+    WHERE NOT {cached}
+    GROUP BY content_sha
+    """)
+
+    stats = {
+        "pending_chunks": pending, "reused_chunks": counts["reused"],
+        "embedded_texts": 0, "batches": 0, "retries": 0, "embed_s": 0.0,
+    }
+    t0 = time.perf_counter()
+    for batch in _micro_batches(misses.toLocalIterator(), rows_per_write):
+        run = {}
+        vectors = embed_batched(
+            [content for _, content in batch], embedder, batch_size=batch_size,
+            max_concurrency=max_concurrency, max_retries=max_retries, stats=run,
+        )
+        # appended per micro-batch: a failure later on keeps the vectors already paid for
+        new = pd.DataFrame({
+            "content_sha": [sha for sha, _ in batch],
+            "embedding_model": embedder.name,
+            "embedding": [v.tolist() for v in vectors],
+        })
+        spark.createDataFrame(new, schema=EMBEDDING_CACHE_DDL).write.mode("append").saveAsTable(cache_table)
+        stats["embedded_texts"] += len(batch)
+        stats["batches"] += run["batches"]
+        stats["retries"] += run["retries"]
+        stats["embed_s"] += run["seconds"]
+
+    if pending:
+        spark.sql(f"""
+        MERGE INTO {chunks_table} t
+        USING (
+          SELECT p.chunk_uid, p.content_sha, c.embedding_model, c.embedding
+          FROM pending_embeddings p
+          JOIN (
+            SELECT content_sha, embedding_model, first(embedding) AS embedding
+            FROM {cache_table} WHERE embedding_model = {model}
+            GROUP BY content_sha, embedding_model
+          ) c ON c.content_sha = p.content_sha
+        ) s
+        ON t.chunk_uid = s.chunk_uid
+        WHEN MATCHED THEN UPDATE SET
+          t.embedding = s.embedding, t.content_sha = s.content_sha, t.embedding_model = s.embedding_model
+        """)
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    return stats
@@ -0,0 +1,153 @@
+import hashlib
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Protocol, Sequence
+
+import numpy as np
+
+from src.lib.text import tokenize
+
+
+class Embedder(Protocol):
+    # `name` identifies the model: stored with each vector, so switching models re-embeds everything
+    name: str
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray: ...
+
+
+class HashingEmbedder:
+    """
+    Deterministic offline stand-in for the embedding endpoint: words and
+    character n-grams of each word (so "rescisão" and "rescindir" share
+    features) are hashed with crc32 into `dim` signed buckets and the vector
+    is L2-normalized, so a dot product is the cosine similarity.
+    Needs no model download and gives the same vectors on every machine.
+    """
+
+    def __init__(self, dim: int = 512, ngram: int = 4, char_weight: float = 0.5):
+        self.dim = dim
+        self.ngram = ngram
+        self.char_weight = char_weight
+
+    @property
+    def name(self) -> str:
+        return f"hashing-{self.dim}-c{self.ngram}"
+
+    def _features(self, text: str):
+        words = tokenize(text)
+        feats, weights = [], []
+        for w in words:
+            feats.append("w:" + w)
+            weights.append(1.0)
+            padded = f"#{w}#"
+            for i in range(max(1, len(padded) - self.ngram + 1)):
+                feats.append("c:" + padded[i:i + self.ngram])
+                weights.append(self.char_weight)
+        return feats, weights
+
+    def embed_one(self, text: str) -> np.ndarray:
+        feats, weights = self._features(text)
+        vec = np.zeros(self.dim, dtype=np.float32)
+        if not feats:
+            return vec
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in feats), dtype=np.uint64, count=len(feats))
+        signs = np.where(hashes & (1 << 31), -1.0, 1.0) * np.asarray(weights)
+        np.add.at(vec, (hashes % self.dim).astype(np.int64), signs.astype(np.float32))
+        # sublinear term frequency: long chunks are not dominated by repeated words
+        vec = np.sign(vec) * np.log1p(np.abs(vec))
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.vstack([self.embed_one(t) for t in texts])
+
+
+class ServingEndpointEmbedder:
+    """Model Serving embedding endpoint (e.g. databricks-bge-large-en), one request per batch of texts."""
+
+    def __init__(self, endpoint: str, client=None):
+        self.endpoint = endpoint
+        self._client = client
+
+    @property
+    def name(self) -> str:
+        return f"endpoint:{self.endpoint}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if self._client is None:
+            # databricks-sdk ships with the runtime (and serverless), no extra dependency
+            from databricks.sdk import WorkspaceClient
+
+            self._client = WorkspaceClient()
+        response = self._client.serving_endpoints.query(name=self.endpoint, input=list(texts))
+        data = sorted(response.data, key=lambda d: d.index or 0)
+        return np.asarray([d.embedding for d in data], dtype=np.float32)
+
+
+def get_embedder(kind: str, endpoint: Optional[str] = None) -> Embedder:
+    # "endpoint": Model Serving endpoint; "hashing": deterministic offline HashingEmbedder
+    if kind == "hashing":
+        return HashingEmbedder()
+    if kind == "endpoint":
+        if not endpoint:
+            raise ValueError("embedder 'endpoint' needs an embedding endpoint name")
+        return ServingEndpointEmbedder(endpoint)
+    raise ValueError(f"Unknown embedder: {kind!r} (expected 'endpoint' or 'hashing')")
+
+
+def content_sha(text: str) -> str:
+    # same value as Spark's sha2(content, 256), so hashes computed in SQL and in Python match
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def embed_batched(
+    texts: Sequence[str],
+    embedder: Embedder,
+    batch_size: int = 64,
+    max_concurrency: int = 4,
+    max_retries: int = 4,
+    base_delay: float = 1.0,
+    stats: Optional[Dict[str, float]] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> np.ndarray:
+    """
+    Embeds `texts` in batches of `batch_size`, with at most `max_concurrency`
+    batches in flight. A failed batch is retried up to `max_retries` times
+    with exponential backoff and jitter (rate limits and transient 5xx); the
+    last error is raised. Rows keep the order of `texts`. `stats`, when given,
+    is filled with batches / retries / seconds.
+    """
+    batches = [list(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    lock = threading.Lock()
+    counters = {"batches": len(batches), "texts": len(texts), "retries": 0}
+
+    def run(batch: List[str]) -> np.ndarray:
+        for attempt in range(max_retries + 1):
+            try:
+                vectors = np.asarray(embedder.embed(batch), dtype=np.float32)
+                if len(vectors) != len(batch):
+                    raise ValueError(f"embedder returned {len(vectors)} vectors for {len(batch)} texts")
+                return vectors
+            except Exception:
+                if attempt == max_retries:
+                    raise
+                with lock:
+                    counters["retries"] += 1
+                sleep(base_delay * (2 ** attempt) * (0.5 + random.random()))
+
+    t0 = time.perf_counter()
+    if max_concurrency <= 1 or len(batches) <= 1:
+        results = [run(b) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            results = list(pool.map(run, batches))
+    if stats is not None:
+        stats.update(counters, seconds=round(time.perf_counter() - t0, 3))
+    if not results:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.vstack(results)
@@ -0,0 +1,224 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing.context import TimeoutError as PoolTimeoutError
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from pypdf import PdfReader
+
+from src.lib.chunking import ChunkerConfig, chunk_document, chunk_text
+from src.lib.manifest import chunk_uid, doc_id_for, file_sha256
+from src.lib.page_cache import PageTextCache
+
+
+CHUNKS_DDL = (
+    "chunk_uid STRING, doc_id STRING, source_path STRING, doc_name STRING, "
+    "page BIGINT, chunk_id BIGINT, content STRING, lang STRING, "
+    "page_end BIGINT, char_start BIGINT, char_end BIGINT, chunker STRING"
+)
+CHUNK_COLUMNS = [c.split()[0] for c in CHUNKS_DDL.split(", ")]
+
+# (page, chunk_id, content, page_end, char_start, char_end)
+ChunkTuple = Tuple[int, int, str, int, Optional[int], Optional[int]]
+
+
+@dataclass
+class ExtractionFailure:
+    doc_name: str
+    error: str
+
+
+def list_pdfs(directory: str) -> List[str]:
+    return [f for f in os.listdir(directory) if f.lower().endswith(".pdf")]
+
+
+def extract_page_texts(source: Union[str, BinaryIO], start: int = 0, end: Optional[int] = None) -> List[str]:
+    # text of pages [start, end) of the pdf (path or binary stream)
+    reader = PdfReader(source)
+    return [(page.extract_text() or "").strip() for page in reader.pages[start:end]]
+
+
+def chunk_pages(pages: List[str], chunker: Optional[ChunkerConfig] = None) -> List[ChunkTuple]:
+    """
+    Chunks the page texts of one document. Returns tuples of
+    (page, chunk_id, content, page_end, char_start, char_end).
+    The legacy strategy chunks page by page (chunk_id restarts on each page and
+    has no offsets); the sentence strategy numbers chunks across the document.
+    """
+    chunker = chunker or ChunkerConfig()
+    if chunker.strategy == "legacy":
+        return [
+            (page_idx + 1, i, ch, page_idx + 1, None, None)
+            for page_idx, page_text in enumerate(pages)
+            for i, ch in enumerate(chunk_text(page_text, chunker.max_chars, chunker.overlap))
+        ]
+    return [
+        (c.page_start, i, c.content, c.page_end, c.char_start, c.char_end)
+        for i, c in enumerate(chunk_document(pages, chunker))
+    ]
+
+
+def chunk_pdf_pages(source: Union[str, BinaryIO], chunker: Optional[ChunkerConfig] = None) -> List[ChunkTuple]:
+    return chunk_pages(extract_page_texts(source), chunker)
+
+
+def _page_ranges(local_path: str, split_bytes: int, pages_per_task: int) -> List[Tuple[int, Optional[int]]]:
+    # small files are parsed in a single task; big ones are split in page ranges
+    if os.path.getsize(local_path) < split_bytes:
+        return [(0, None)]
+    n_pages = len(PdfReader(local_path).pages)
+    return [(s, min(s + pages_per_task, n_pages)) for s in range(0, max(n_pages, 1), pages_per_task)]
+
+
+def to_chunk_rows(
+    doc_name: str, source_dir: str, doc_id: str, chunks: Iterable[ChunkTuple], lang: str, chunker: str = ""
+) -> List[dict]:
+    # `chunker`: signature of the ChunkerConfig that cut the chunks, part of chunk_uid
+    return [
+        {
+            "chunk_uid": chunk_uid(doc_id, doc_name, page, chunk_id, chunker),
+            "doc_id": doc_id,
+            "source_path": f"{source_dir}/{doc_name}",
+            "doc_name": doc_name,
+            "page": page,
+            "chunk_id": chunk_id,
+            "content": content,
+            "lang": lang,
+            "page_end": page_end,
+            "char_start": char_start,
+            "char_end": char_end,
+            "chunker": chunker,
+        }
+        for page, chunk_id, content, page_end, char_start, char_end in chunks
+    ]
+
+
+def _doc_id(vol_local: str, doc_name: str, doc_ids: Optional[Dict[str, str]]) -> str:
+    if doc_ids and doc_name in doc_ids:
+        return doc_ids[doc_name]
+    return doc_id_for(file_sha256(os.path.join(vol_local, doc_name)))
+
+
+def _cached_page_texts(local_path: str, doc_id: str, cache: Optional[PageTextCache]) -> List[str]:
+    pages = cache.get(doc_id) if cache else None
+    if pages is None:
+        pages = extract_page_texts(local_path)
+        if cache:
+            cache.put(doc_id, pages)
+    return pages
+
+
+def iter_chunk_rows(
+    vol_local: str,
+    vol_dbfs: str,
+    lang: str = "pt-BR",
+    files: Optional[List[str]] = None,
+    doc_ids: Optional[Dict[str, str]] = None,
+    chunker: Optional[ChunkerConfig] = None,
+    cache: Optional[PageTextCache] = None,
+) -> Iterator[dict]:
+    """
+    Serial extraction: one PdfReader per file, on the current process.
+    `files` restricts the run to some pdfs of the volume and `doc_ids` reuses
+    content hashes already computed by the caller. With a `cache`, page text
+    of already parsed files is read from it instead of the pdf.
+    """
+    signature = (chunker or ChunkerConfig()).signature
+    for f in list_pdfs(vol_local) if files is None else files:
+        doc_id = _doc_id(vol_local, f, doc_ids)
+        pages = _cached_page_texts(os.path.join(vol_local, f), doc_id, cache)
+        yield from to_chunk_rows(f, vol_dbfs, doc_id, chunk_pages(pages, chunker), lang, signature)
+
+
+def iter_chunk_rows_parallel(
+    vol_local: str,
+    vol_dbfs: str,
+    lang: str = "pt-BR",
+    max_workers: Optional[int] = None,
+    doc_timeout: float = 300.0,
+    split_bytes: int = 2_000_000,
+    pages_per_task: int = 16,
+    files: Optional[List[str]] = None,
+    doc_ids: Optional[Dict[str, str]] = None,
+    failures: Optional[List[ExtractionFailure]] = None,
+    max_docs_in_flight: Optional[int] = None,
+    chunker: Optional[ChunkerConfig] = None,
+    cache: Optional[PageTextCache] = None,
+) -> Iterator[dict]:
+    """
+    Same rows as `iter_chunk_rows`, but documents (and page ranges of files
+    bigger than `split_bytes`) are parsed on a pool of worker processes.
+    Workers return page texts; chunking runs here, once all the pages of a
+    document are back, so chunks can cross page-range boundaries. Cache hits
+    never reach the pool, and the cache is only read/written by this process.
+
+    A document that raises or does not finish within `doc_timeout` seconds is
+    appended to `failures` and left out of the rows; the other documents are
+    not affected. Hung workers are terminated when the pool is closed.
+    At most `max_docs_in_flight` documents (default: 2x workers) are submitted
+    ahead of the consumer, so memory does not grow with the corpus.
+    """
+    files = list_pdfs(vol_local) if files is None else files
+    failures = failures if failures is not None else []
+    max_workers = max_workers or os.cpu_count() or 1
+    max_docs_in_flight = max_docs_in_flight or 2 * max_workers
+    signature = (chunker or ChunkerConfig()).signature
+
+    with multiprocessing.Pool(processes=max_workers) as pool:
+        queued = iter(files)
+        pending = deque()
+
+        def submit_next() -> bool:
+            for f in queued:
+                local_path = os.path.join(vol_local, f)
+                try:
+                    doc_id = _doc_id(vol_local, f, doc_ids)
+                    cached = cache.get(doc_id) if cache else None
+                    if cached is not None:
+                        pending.append((f, doc_id, cached, []))
+                        return True
+                    ranges = _page_ranges(local_path, split_bytes, pages_per_task)
+                except Exception as e:
+                    failures.append(ExtractionFailure(f, repr(e)))
+                    continue
+                tasks = [pool.apply_async(extract_page_texts, (local_path, s, e)) for s, e in ranges]
+                pending.append((f, doc_id, None, tasks))
+                return True
+            return False
+
+        while len(pending) < max_docs_in_flight and submit_next():
+            pass
+
+        # results are collected in submission order so the output matches the serial path
+        while pending:
+            f, doc_id, cached, tasks = pending.popleft()
+            pages = cached or []
+            deadline = time.monotonic() + doc_timeout
+            try:
+                for task in tasks:
+                    pages.extend(task.get(timeout=max(0.0, deadline - time.monotonic())))
+            except PoolTimeoutError:
+                failures.append(ExtractionFailure(f, f"timeout after {doc_timeout}s"))
+                pages = None
+            except Exception as e:
+                failures.append(ExtractionFailure(f, repr(e)))
+                pages = None
+            submit_next()
+            if pages is not None and cache and cached is None:
+                cache.put(doc_id, pages)
+            if pages is not None:
+                yield from to_chunk_rows(f, vol_dbfs, doc_id, chunk_pages(pages, chunker), lang, signature)
+
+
+def extract_chunk_rows(vol_local: str, vol_dbfs: str, **kwargs) -> List[dict]:
+    return list(iter_chunk_rows(vol_local, vol_dbfs, **kwargs))
+
+
+def extract_chunk_rows_parallel(
+    vol_local: str, vol_dbfs: str, **kwargs
+) -> Tuple[List[dict], List[ExtractionFailure]]:
+    failures: List[ExtractionFailure] = []
+    rows = list(iter_chunk_rows_parallel(vol_local, vol_dbfs, failures=failures, **kwargs))
+    return rows, failures
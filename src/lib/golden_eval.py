@@ -0,0 +1,257 @@
+import argparse
+import datetime
+import json
+import math
+import platform
+import re
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.lib.chunk_sweep import DEFAULT_QUESTIONS, _key, load_questions
+from src.lib.loadtest import SearchFn, local_index_fn, similarity_search_fn
+from src.lib.text import fold
+
+EVAL_COLUMNS = ["chunk_uid", "doc_name", "page", "page_end", "content"]
+# metrics where lower is worse; latency thresholds are maxima
+QUALITY_METRICS = ("recall_at_k", "hit_at_k", "ndcg_at_k", "snippet_hit_at_k", "mrr")
+
+
+def _snippet_key(text: str) -> str:
+    # accents, case and line breaks do not matter: PDF text wraps anywhere
+    return re.sub(r"\s+", " ", fold(text)).strip()
+
+
+def _pages(row: dict) -> range:
+    page = int(row["page"])
+    return range(page, int(row.get("page_end") or page) + 1)
+
+
+def score_query(item: dict, rows: List[dict], ks: Sequence[int]) -> dict:
+    """
+    Relevance of one ranked result list against the item's targets. A row is
+    relevant when one of its pages (page..page_end) is a target; each target
+    counts once, at the first rank that covers it. nDCG uses the targets'
+    `grade` (default 1) as gain.
+    """
+    grades = {(_key(t["doc_name"]), int(t["page"])): float(t.get("grade", 1)) for t in item["targets"]}
+    found_at: Dict[tuple, int] = {}
+    first_hit = None
+    snippet = _snippet_key(item["snippet"]) if item.get("snippet") else None
+    snippet_rank = None
+    for rank, row in enumerate(rows, start=1):
+        for page in _pages(row):
+            target = (_key(row["doc_name"]), page)
+            if target in grades and target not in found_at:
+                found_at[target] = rank
+                first_hit = first_hit or rank
+        if snippet and snippet_rank is None and snippet in _snippet_key(row.get("content") or ""):
+            snippet_rank = rank
+
+    ideal = sorted(grades.values(), reverse=True)
+    out = {"first_hit_rank": first_hit, "rr": round(1.0 / first_hit, 4) if first_hit else 0.0,
+           "recall_at_k": {}, "ndcg_at_k": {}, "snippet_rank": snippet_rank}
+    for k in ks:
+        out["recall_at_k"][str(k)] = round(sum(1 for r in found_at.values() if r <= k) / len(grades), 4)
+        dcg = sum(grades[t] / math.log2(r + 1) for t, r in found_at.items() if r <= k)
+        idcg = sum(g / math.log2(i + 2) for i, g in enumerate(ideal[:k]))
+        out["ndcg_at_k"][str(k)] = round(dcg / idcg, 4) if idcg else 0.0
+    out["retrieved"] = [[row["doc_name"], int(row["page"])] for row in rows]
+    return out
+
+
+def run_golden(search: SearchFn, questions: List[dict], ks: Sequence[int] = (1, 3, 5), repeats: int = 1) -> dict:
+    """
+    Runs every golden question through `search` (which must return at least
+    max(ks) rows) and aggregates recall@k, hit@k, MRR, nDCG@k, snippet
+    hit@k and latency. Latency per query is the median of `repeats` calls.
+    """
+    per_query = []
+    for item in questions:
+        latencies = []
+        for _ in range(max(repeats, 1)):
+            t0 = time.perf_counter()
+            rows = search(item["question"])
+            latencies.append((time.perf_counter() - t0) * 1000)
+        scored = score_query(item, rows[:max(ks)], ks)
+        per_query.append({"id": item.get("id") or item["question"], "question": item["question"],
+                          "latency_ms": round(float(np.median(latencies)), 3), **scored})
+
+    n = max(len(per_query), 1)
+    lat = [q["latency_ms"] for q in per_query]
+    with_snippet = [q for q, item in zip(per_query, questions) if item.get("snippet")]
+
+    def mean_at(key: str) -> Dict[str, float]:
+        return {str(k): round(sum(q[key][str(k)] for q in per_query) / n, 4) for k in ks}
+
+    return {
+        "metrics": {
+            "recall_at_k": mean_at("recall_at_k"),
+            "hit_at_k": {str(k): round(sum(1 for q in per_query if q["first_hit_rank"] and q["first_hit_rank"] <= k) / n, 4)
+                         for k in ks},
+            "mrr": round(sum(q["rr"] for q in per_query) / n, 4),
+            "ndcg_at_k": mean_at("ndcg_at_k"),
+            "snippet_hit_at_k": {
+                str(k): round(sum(1 for q in with_snippet if q["snippet_rank"] and q["snippet_rank"] <= k)
+                              / max(len(with_snippet), 1), 4)
+                for k in ks
+            },
+            "latency_ms_p50": round(float(np.percentile(lat, 50)), 3) if lat else None,
+            "latency_ms_p95": round(float(np.percentile(lat, 95)), 3) if lat else None,
+        },
+        "queries": per_query,
+    }
+
+
+def _flatten(metrics: dict) -> Dict[str, float]:
+    # {"recall_at_k": {"5": 0.9}, "mrr": 0.7} -> {"recall_at_k@5": 0.9, "mrr": 0.7}
+    flat = {}
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update({f"{name}@{k}": v for k, v in value.items()})
+        elif value is not None:
+            flat[name] = value
+    return flat
+
+
+def _is_quality(name: str) -> bool:
+    return name.split("@")[0] in QUALITY_METRICS
+
+
+def check_thresholds(run: dict, thresholds: dict, baseline: Optional[dict] = None) -> List[str]:
+    """
+    Failures of `run` against `thresholds` (same shape as the metrics;
+    quality metrics are minima, latency_ms_* maxima) and, with a
+    `baseline` run, quality metrics that dropped more than `max_drop`.
+    """
+    failures = []
+    metrics = _flatten(run["metrics"])
+    limits = _flatten({k: v for k, v in thresholds.items() if k != "max_drop"})
+    for name, limit in limits.items():
+        value = metrics.get(name)
+        if value is None:
+            failures.append(f"{name}: not measured (threshold {limit})")
+        elif _is_quality(name) and value < limit:
+            failures.append(f"{name}: {value} < {limit}")
+        elif not _is_quality(name) and value > limit:
+            failures.append(f"{name}: {value} > {limit}")
+    max_drop = thresholds.get("max_drop")
+    if baseline is not None and max_drop is not None:
+        for name, old in _flatten(baseline["metrics"]).items():
+            new = metrics.get(name)
+            if _is_quality(name) and new is not None and old - new > max_drop:
+                failures.append(f"{name}: {new} dropped {round(old - new, 4)} from baseline {old} (max_drop {max_drop})")
+    return failures
+
+
+def diff_runs(base: dict, new: dict) -> dict:
+    """Metric deltas (new - base) and the questions whose first relevant rank or snippet rank changed."""
+    old_m, new_m = _flatten(base["metrics"]), _flatten(new["metrics"])
+    metrics = {
+        name: {"base": old_m.get(name), "new": new_m.get(name),
+               "delta": round(new_m[name] - old_m[name], 4) if name in old_m and name in new_m else None}
+        for name in sorted(set(old_m) | set(new_m))
+    }
+    old_q = {q["id"]: q for q in base["queries"]}
+    changed = []
+    for q in new["queries"]:
+        prev = old_q.pop(q["id"], None)
+        if prev is None:
+            changed.append({"id": q["id"], "change": "added"})
+            continue
+        fields = {f: [prev.get(f), q.get(f)] for f in ("first_hit_rank", "snippet_rank") if prev.get(f) != q.get(f)}
+        if fields:
+            worse = any((b is None and a is not None) or (a is not None and b is not None and b > a) for a, b in fields.values())
+            changed.append({"id": q["id"], "change": "worse" if worse else "better", **fields})
+    changed += [{"id": qid, "change": "removed"} for qid in old_q]
+    return {"base": base.get("label"), "new": new.get("label"), "metrics": metrics, "queries": changed}
+
+
+def _print_summary(run: dict, failures: List[str], file=sys.stderr) -> None:
+    for name, value in _flatten(run["metrics"]).items():
+        print(f"{name:<22} {value}", file=file)
+    for q in run["queries"]:
+        print(f"  {q['id']:<24} first_hit={q['first_hit_rank']} snippet={q['snippet_rank']} {q['latency_ms']} ms", file=file)
+    print("FAILED:\n  " + "\n  ".join(failures) if failures else "PASSED", file=file)
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def _read_json(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Retrieval regression suite on the golden questions.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_p = sub.add_parser("run", help="evaluate a backend; exit 1 when a threshold fails")
+    run_p.add_argument("--backend", choices=["local", "bm25", "hybrid", "remote"], default="local")
+    run_p.add_argument("--golden", default=DEFAULT_QUESTIONS)
+    run_p.add_argument("--pdf-dir", help="local backends; defaults to pdf_dir in the golden file")
+    run_p.add_argument("--config", default="conf/demo_config.yml", help="remote backend")
+    run_p.add_argument("--k", type=_ints, default=[1, 3, 5])
+    run_p.add_argument("--repeats", type=int, default=3)
+    run_p.add_argument("--label", help="name of this run in reports and diffs")
+    run_p.add_argument("--baseline", help="previous run JSON: fail on drops larger than max_drop")
+    run_p.add_argument("--output", help="run JSON path (default: stdout)")
+    diff_p = sub.add_parser("diff", help="compare two run JSON files")
+    diff_p.add_argument("base")
+    diff_p.add_argument("new")
+    args = parser.parse_args(argv)
+
+    if args.command == "diff":
+        print(json.dumps(diff_runs(_read_json(args.base), _read_json(args.new)), ensure_ascii=False, indent=2))
+        return 0
+
+    spec = load_questions(args.golden)
+    num_results = max(args.k)
+    if args.backend == "remote":
+        from databricks.vector_search.client import VectorSearchClient
+
+        from src.lib.config import load_config
+        from src.lib.embeddings import get_embedder
+
+        cfg = load_config(args.config)
+        index = VectorSearchClient(disable_notice=True).get_index(
+            endpoint_name=cfg.vector_search_endpoint, index_name=cfg.vector_search_index)
+        embedder = get_embedder(cfg.embedder, cfg.embedding_model_endpoint) if cfg.embedding_mode == "precomputed" else None
+        search = similarity_search_fn(index, EVAL_COLUMNS, num_results, embedder=embedder,
+                                      queries=[q["question"] for q in spec["questions"]])
+    else:
+        search = local_index_fn(args.pdf_dir or spec["pdf_dir"], args.backend, num_results, columns=EVAL_COLUMNS)
+
+    run = run_golden(search, spec["questions"], args.k, repeats=args.repeats)
+    run = {
+        "label": args.label or args.backend,
+        "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "backend": args.backend,
+        "golden": args.golden,
+        "ks": args.k,
+        **run,
+    }
+    baseline = _read_json(args.baseline) if args.baseline else None
+    failures = check_thresholds(run, spec.get("thresholds") or {}, baseline)
+    run["failures"] = failures
+    if baseline is not None:
+        run["diff"] = diff_runs(baseline, run)
+
+    payload = json.dumps(run, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    _print_summary(run, failures)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    # python -m src.lib.golden_eval run --backend hybrid --output run.json [--baseline previous.json]
+    # python -m src.lib.golden_eval diff previous.json run.json
+    sys.exit(main())
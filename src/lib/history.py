@@ -0,0 +1,289 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from src.lib.chunking import estimate_tokens
+
+# summarize(previous summary, turns to fold in) -> new summary
+Summarizer = Callable[[str, List[List[dict]]], str]
+
+_CITATION_RE = re.compile(r"\[[^\[\]\n]{1,120}? p\.\d+(?:-\d+)?\]")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+SUMMARY_HEADER = "Summary of the earlier conversation ({turns} turns):\n"
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, list):
+        return " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return content if isinstance(content, str) else ("" if content is None else str(content))
+
+
+def message_tokens(message: dict) -> int:
+    # content + tool call arguments + a few tokens of per-message framing
+    calls = message.get("tool_calls") or []
+    args = " ".join((c.get("function") or {}).get("arguments", "") for c in calls if isinstance(c, dict))
+    return estimate_tokens(_text(message.get("content"))) + estimate_tokens(args) + 4
+
+
+def split_turns(messages: Sequence[dict]) -> Tuple[List[dict], List[List[dict]]]:
+    """(leading messages, turns): a turn is a user message and every assistant/tool message after it."""
+    head, turns = [], []
+    for m in messages:
+        if m.get("role") == "user":
+            turns.append([m])
+        elif turns:
+            turns[-1].append(m)
+        else:
+            head.append(m)
+    return head, turns
+
+
+def _chain(fingerprint: str, turn: List[dict]) -> str:
+    payload = json.dumps(turn, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256((fingerprint + payload).encode("utf-8")).hexdigest()[:24]
+
+
+def render_turns(turns: Sequence[List[dict]], tool_chars: int = 300) -> str:
+    """Turns as plain text for a summarizer; tool outputs reduced to their citations (or a short head)."""
+    lines = []
+    for turn in turns:
+        for m in turn:
+            role, text = m.get("role"), " ".join(_text(m.get("content")).split())
+            if role == "tool":
+                cites = list(dict.fromkeys(_CITATION_RE.findall(text)))
+                lines.append("Tool: " + (" ".join(cites) if cites else text[:tool_chars]))
+            elif role == "assistant" and m.get("tool_calls"):
+                args = [(c.get("function") or {}).get("arguments", "") for c in m["tool_calls"]]
+                lines.append("Assistant searched: " + "; ".join(args) + (f" {text}" if text else ""))
+            elif text:
+                lines.append(f"{'User' if role == 'user' else 'Assistant'}: {text}")
+    return "\n".join(lines)
+
+
+def extractive_summary(previous: str, turns: List[List[dict]], answer_chars: int = 300) -> str:
+    """Offline summarizer: each folded turn as its question, the start of its answer and the sources cited."""
+    lines = [previous] if previous else []
+    for turn in turns:
+        question = " ".join(_text(turn[0].get("content")).split())
+        answers = [_text(m.get("content")) for m in turn if m.get("role") == "assistant" and _text(m.get("content"))]
+        answer = " ".join(answers[-1].split()) if answers else ""
+        short = ""
+        for sentence in _SENTENCE_END_RE.split(answer):
+            if short and len(short) + len(sentence) > answer_chars:
+                break
+            short = f"{short} {sentence}".strip()
+        cites = list(dict.fromkeys(c for m in turn if m.get("role") == "tool" for c in _CITATION_RE.findall(_text(m.get("content")))))
+        line = f"- Q: {question[:answer_chars]}"
+        line += f" | A: {short[:answer_chars]}" if short else ""
+        line += f" | Sources: {' '.join(cites)}" if cites else ""
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _cut(text: str, max_tokens: int) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    end = int(len(text) * max_tokens / max(estimate_tokens(text), 1))
+    while end > 0 and estimate_tokens(text[:end]) > max_tokens:
+        end = end * 9 // 10
+    space = text.rfind(" ", 0, end)
+    return text[:space if space > 0 else end].rstrip() + " …"
+
+
+@dataclass
+class SessionSummary:
+    text: str
+    turns: int  # leading turns of the session folded into the text
+    fingerprint: str  # hash chain of those turns: an edited history does not reuse the summary
+    expires_at: float
+
+
+@dataclass
+class HistoryReport:
+    turns: int
+    summarized_turns: int
+    verbatim_turns: int
+    prompt_tokens: int
+    original_tokens: int
+    summary: str = "none"  # none | cached | incremental | rebuilt
+    truncated: int = 0  # messages cut to stay under the ceiling
+
+
+class HistoryManager:
+    """
+    Fits a conversation under `max_tokens`: the last `keep_turns` turns go
+    verbatim, older turns (with their tool outputs) are folded into a
+    rolling summary placed after the leading system messages. Summaries are
+    cached per session and extended incrementally: a request folds only the
+    turns that left the window since the previous one, in batches of
+    `fold_batch` turns (so the summarizer runs every few turns, not on every
+    turn). When summary + window still exceed the ceiling, more turns are
+    folded, then the summary and the largest messages are cut. A failing
+    `summarize` falls back to `extractive_summary`. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        summarize: Summarizer = extractive_summary,
+        keep_turns: int = 6,
+        fold_batch: int = 2,
+        max_tokens: int = 12000,
+        summary_max_tokens: int = 800,
+        max_sessions: int = 2048,
+        ttl_s: float = 6 * 3600.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.summarize = summarize
+        self.keep_turns = keep_turns
+        self.fold_batch = max(fold_batch, 1)
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self._sessions: "OrderedDict[str, SessionSummary]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "summaries_cached": 0, "summaries_incremental": 0, "summaries_rebuilt": 0,
+                          "turns_folded": 0, "summarizer_errors": 0, "truncations": 0}
+
+    def _cached(self, key: str, turns: List[List[dict]]) -> Optional[SessionSummary]:
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or entry.expires_at <= self.clock():
+                self._sessions.pop(key, None)
+                return None
+            self._sessions.move_to_end(key)
+        if entry.turns > len(turns):
+            return None
+        fingerprint = ""
+        for turn in turns[:entry.turns]:
+            fingerprint = _chain(fingerprint, turn)
+        return entry if fingerprint == entry.fingerprint else None
+
+    def _store(self, key: str, entry: SessionSummary) -> None:
+        with self._lock:
+            self._sessions[key] = entry
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def _fold(self, previous: str, turns: List[List[dict]]) -> str:
+        try:
+            text = self.summarize(previous, turns)
+        except Exception:
+            with self._lock:
+                self._counters["summarizer_errors"] += 1
+            text = extractive_summary(previous, turns)
+        # over the limit, the oldest lines go first: a rolling summary keeps the recent part of the session
+        lines = (text or previous).split("\n")
+        while len(lines) > 1 and sum(estimate_tokens(line) + 1 for line in lines) > self.summary_max_tokens:
+            lines.pop(0)
+        return _cut("\n".join(lines), self.summary_max_tokens)
+
+    def fit(self, messages: List[dict], session_id: Optional[str] = None) -> Tuple[List[dict], HistoryReport]:
+        """The messages to send instead of `messages`, and what was done to them."""
+        head, turns = split_turns(messages)
+        tokens = [sum(message_tokens(m) for m in t) for t in turns]
+        head_tokens = sum(message_tokens(m) for m in head)
+        original = head_tokens + sum(tokens)
+        with self._lock:
+            self._counters["requests"] += 1
+        if len(turns) <= self.keep_turns and original <= self.max_tokens:
+            return list(messages), HistoryReport(len(turns), 0, len(turns), original, original)
+
+        # no session id: the first question identifies the conversation
+        key = session_id or "anon:" + _chain("", turns[0])
+        entry = self._cached(key, turns)
+        done = entry.turns if entry else 0
+
+        # fold in whole batches, then as many more turns as the ceiling needs (the current turn always stays)
+        target = max(done, done + (len(turns) - self.keep_turns - done) // self.fold_batch * self.fold_batch)
+        budget = self.max_tokens - head_tokens - (self.summary_max_tokens + 16 if target or done else 0)
+        while target < len(turns) - 1 and sum(tokens[target:]) > budget:
+            if target == 0:
+                budget -= self.summary_max_tokens + 16
+            target += 1
+
+        summary = entry.text if entry else ""
+        report = HistoryReport(len(turns), target, len(turns) - target, 0, original)
+        if target > done:
+            summary = self._fold(summary, turns[done:target])
+            fingerprint = entry.fingerprint if entry else ""
+            for turn in turns[done:target]:
+                fingerprint = _chain(fingerprint, turn)
+            self._store(key, SessionSummary(summary, target, fingerprint, self.clock() + self.ttl_s))
+            report.summary = "incremental" if entry else "rebuilt"
+            with self._lock:
+                self._counters["summaries_" + report.summary] += 1
+                self._counters["turns_folded"] += target - done
+        elif target:
+            report.summary = "cached"
+            with self._lock:
+                self._counters["summaries_cached"] += 1
+
+        fitted = list(head)
+        if target:
+            fitted.append({"role": "system", "content": SUMMARY_HEADER.format(turns=target) + summary})
+        fitted += [dict(m) for t in turns[target:] for m in t]
+        report.truncated = self._enforce_ceiling(fitted, len(head))
+        report.prompt_tokens = sum(message_tokens(m) for m in fitted)
+        if report.truncated:
+            with self._lock:
+                self._counters["truncations"] += 1
+        return fitted, report
+
+    def _enforce_ceiling(self, messages: List[dict], protected: int) -> int:
+        # last resort: halve the largest message after the leading ones until the prompt fits
+        cut = 0
+        for _ in range(64):
+            total = sum(message_tokens(m) for m in messages)
+            if total <= self.max_tokens:
+                break
+            candidates = [i for i in range(protected, len(messages)) if isinstance(messages[i].get("content"), str)]
+            if not candidates:
+                break
+            i = max(candidates, key=lambda j: message_tokens(messages[j]))
+            size = message_tokens(messages[i])
+            keep = max(size - (total - self.max_tokens), size // 2, 8)
+            messages[i]["content"] = _cut(messages[i]["content"], keep)
+            cut += 1
+        return cut
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "sessions": len(self._sessions)}
+
+
+if __name__ == "__main__":
+    # python -m src.lib.history: a 30-question session, prompt size per turn with and without the manager
+    from src.lib.chunk_sweep import DEFAULT_QUESTIONS, load_questions
+
+    questions = [q["question"] for q in load_questions(DEFAULT_QUESTIONS)["questions"]]
+    manager = HistoryManager(keep_turns=4, fold_batch=2, max_tokens=3000, summary_max_tokens=400)
+    conversation = [{"role": "system", "content": "Você é uma analista de compras e responde perguntas sobre contratos."}]
+    passage = ("[DEMO_Contrato_Adquirencia_PagServ.pdf p.1] Cláusula 2.3 qualquer das partes pode rescindir mediante "
+               "aviso prévio escrito de 30 (trinta) dias, sem prejuízo das obrigações vencidas. ") * 6
+    for n in range(30):
+        question = questions[n % len(questions)]
+        conversation.append({"role": "user", "content": question})
+        t0 = time.perf_counter()
+        fitted, report = manager.fit(conversation, session_id="demo")
+        ms = (time.perf_counter() - t0) * 1000
+        if n % 5 == 4:
+            print(f"turn {n + 1:>2}: {report.original_tokens:>6} -> {report.prompt_tokens:>5} tokens "
+                  f"({report.summarized_turns} summarized, {report.verbatim_turns} verbatim, {report.summary}) {ms:.2f} ms")
+        call_id = f"call_{n}"
+        conversation += [
+            {"role": "assistant", "content": None, "tool_calls": [
+                {"id": call_id, "type": "function", "function": {"name": "search", "arguments": json.dumps({"query": question})}}]},
+            {"role": "tool", "tool_call_id": call_id, "content": passage},
+            {"role": "assistant", "content": "Conforme a Cláusula 2.3, o aviso prévio é de 30 dias. Fonte: página 1."},
+        ]
+    print("stats:", manager.stats)
+    print(fitted[1]["content"][-400:])
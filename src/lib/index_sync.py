@@ -0,0 +1,290 @@
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+# one row per sync_if_stale call (notebook 03 appends them to contracts_index_sync_log)
+SYNC_METRICS_DDL = (
+    "index_name STRING, source_table STRING, status STRING, source_version BIGINT, "
+    "indexed_version_before BIGINT, indexed_version BIGINT, rows_changed BIGINT, "
+    "commit_at DOUBLE, triggered_at DOUBLE, searchable_at DOUBLE, embedding_s DOUBLE, "
+    "lag_s DOUBLE, polls BIGINT, message STRING"
+)
+
+
+@dataclass
+class SyncMetrics:
+    index_name: str
+    source_table: Optional[str]
+    status: str  # "up_to_date", "synced", "timeout" or "failed"
+    source_version: int
+    indexed_version_before: Optional[int] = None
+    indexed_version: Optional[int] = None
+    rows_changed: Optional[int] = None  # CDF rows between the two versions
+    commit_at: Optional[float] = None  # epoch seconds of the source commit
+    triggered_at: Optional[float] = None
+    searchable_at: Optional[float] = None
+    # trigger -> version indexed: the update pipeline time, dominated by embedding the changed rows
+    embedding_s: Optional[float] = None
+    lag_s: Optional[float] = None  # source commit -> searchable
+    polls: int = 0
+    message: Optional[str] = None
+
+
+def table_version(spark, table: str):
+    """Latest Delta version of `table` and its commit time (epoch seconds)."""
+    last = spark.sql(f"DESCRIBE HISTORY {table} LIMIT 1").collect()[0]
+    return int(last["version"]), last["timestamp"].timestamp()
+
+
+def rows_changed(spark, table: str, after_version: Optional[int], to_version: int) -> Optional[int]:
+    # rows inserted/updated/deleted after `after_version`, from the Change Data Feed; None if it can not be read
+    start = 0 if after_version is None else after_version + 1
+    if start > to_version:
+        return 0
+    try:
+        return spark.sql(
+            f"SELECT count(*) AS n FROM table_changes('{table}', {start}, {to_version}) "
+            "WHERE _change_type <> 'update_preimage'"
+        ).collect()[0]["n"]
+    except Exception:
+        return None
+
+
+def _status(desc: dict) -> dict:
+    return (desc or {}).get("status", {}) or {}
+
+
+def indexed_version(desc: dict) -> Optional[int]:
+    """Source version the index has processed, from `index.describe()` (None before the first sync)."""
+    status = _status(desc)
+    for key in ("triggered_update_status", "continuous_update_status", "failed_status"):
+        version = (status.get(key) or {}).get("last_processed_commit_version")
+        if version is not None:
+            return int(version)
+    return None
+
+
+def is_busy(desc: dict) -> bool:
+    # an update is running (or the initial snapshot is being built): a new sync would be rejected
+    state = _status(desc).get("detailed_state", "") or ""
+    if state.endswith("NO_PENDING_UPDATE"):
+        return False
+    return "PROVISIONING" in state or "UPDATE" in state or "UPDATING" in state
+
+
+def is_failed(desc: dict) -> bool:
+    return "FAILED" in (_status(desc).get("detailed_state", "") or "")
+
+
+class SyncController:
+    """
+    Triggers a sync of a TRIGGERED Delta Sync index only when the source
+    table has a Delta version past the last indexed one, waits for it with
+    exponential backoff (`initial_interval` doubling up to `max_interval`,
+    giving up after `timeout` seconds) and returns the sync metrics.
+
+    `client` is a VectorSearchClient or anything with the same
+    `get_index(endpoint_name=, index_name=)` -> index with `describe()` and
+    `sync()` surface (e.g. StubVectorSearchClient). `clock`/`sleep` can be
+    replaced to run against a simulated clock.
+    """
+
+    def __init__(
+        self,
+        client,
+        endpoint_name: str,
+        index_name: str,
+        initial_interval: float = 2.0,
+        max_interval: float = 60.0,
+        timeout: float = 1800.0,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+        log: Callable[[str], None] = print,
+    ):
+        self.client = client
+        self.endpoint_name = endpoint_name
+        self.index_name = index_name
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.log = log
+
+    def _index(self):
+        return self.client.get_index(endpoint_name=self.endpoint_name, index_name=self.index_name)
+
+    def _wait(self, index, done: Callable[[dict], bool], deadline: float):
+        # polls describe() until done(desc), the index fails or the deadline passes; returns (desc, polls)
+        interval = self.initial_interval
+        polls = 0
+        while True:
+            desc = index.describe()
+            polls += 1
+            if done(desc) or is_failed(desc) or self.clock() >= deadline:
+                return desc, polls
+            self.log(f"Waiting for index '{self.index_name}': {_status(desc).get('detailed_state')}, "
+                     f"indexed version {indexed_version(desc)}, next poll in {interval:.0f}s")
+            self.sleep(min(interval, max(deadline - self.clock(), 0)))
+            interval = min(interval * 2, self.max_interval)
+
+    def sync_if_stale(
+        self,
+        source_version: int,
+        commit_at: Optional[float] = None,
+        rows: Optional[int] = None,
+        source_table: Optional[str] = None,
+    ) -> SyncMetrics:
+        index = self._index()
+        deadline = self.clock() + self.timeout
+        # an update already running (e.g. the initial snapshot after create) is awaited, not re-triggered
+        desc, polls = self._wait(index, lambda d: not is_busy(d), deadline)
+        before = indexed_version(desc)
+        metrics = SyncMetrics(
+            index_name=self.index_name,
+            source_table=source_table,
+            status="up_to_date",
+            source_version=source_version,
+            indexed_version_before=before,
+            indexed_version=before,
+            rows_changed=rows,
+            commit_at=commit_at,
+            polls=polls,
+        )
+        if is_failed(desc) or is_busy(desc):
+            metrics.status = "failed" if is_failed(desc) else "timeout"
+            metrics.message = _status(desc).get("message")
+            return metrics
+        if before is not None and before >= source_version:
+            return metrics
+
+        metrics.triggered_at = self.clock()
+        index.sync()
+        desc, polls = self._wait(
+            index,
+            lambda d: not is_busy(d) and (indexed_version(d) or -1) >= source_version,
+            deadline,
+        )
+        metrics.polls += polls
+        metrics.indexed_version = indexed_version(desc)
+        if is_failed(desc):
+            metrics.status = "failed"
+            metrics.message = _status(desc).get("message")
+        elif (metrics.indexed_version or -1) < source_version or is_busy(desc):
+            metrics.status = "timeout"
+            metrics.message = f"version {source_version} not indexed after {self.timeout:.0f}s"
+        else:
+            metrics.status = "synced"
+            metrics.searchable_at = self.clock()
+            metrics.embedding_s = metrics.searchable_at - metrics.triggered_at
+            if commit_at is not None:
+                metrics.lag_s = metrics.searchable_at - commit_at
+        return metrics
+
+
+def append_metrics_json(path: str, metrics: SyncMetrics) -> None:
+    # JSON lines log, one object per sync
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(asdict(metrics), ensure_ascii=False) + "\n")
+
+
+def write_metrics_delta(spark, table: str, metrics: SyncMetrics) -> None:
+    spark.createDataFrame([asdict(metrics)], schema=SYNC_METRICS_DDL).write.mode("append").saveAsTable(table)
+
+
+###############################################################################
+## Stub client (local runs without a Vector Search endpoint)
+###############################################################################
+
+
+class StubIndex:
+    """
+    Mimics a TRIGGERED Delta Sync index: `sync()` starts an update that
+    indexes `source_version()` after `seconds_per_row` * rows (plus
+    `base_latency`) of `clock` time; `describe()` reports it like the real API.
+    """
+
+    def __init__(self, source_version: Callable[[], int], clock: Callable[[], float] = time.time,
+                 base_latency: float = 5.0, seconds_per_row: float = 0.01,
+                 rows: Optional[Callable[[int, int], int]] = None):
+        self.source_version = source_version
+        self.clock = clock
+        self.base_latency = base_latency
+        self.seconds_per_row = seconds_per_row
+        self.rows = rows or (lambda start, end: 0)
+        self.version: Optional[int] = None
+        self.pending = None  # (version, done_at)
+        self.sync_calls = 0
+
+    def _advance(self):
+        if self.pending and self.clock() >= self.pending[1]:
+            self.version, self.pending = self.pending[0], None
+
+    def sync(self):
+        self._advance()
+        if self.pending:
+            raise RuntimeError("An update is already in progress")
+        self.sync_calls += 1
+        target = self.source_version()
+        n = self.rows(-1 if self.version is None else self.version, target)
+        self.pending = (target, self.clock() + self.base_latency + n * self.seconds_per_row)
+
+    def describe(self) -> dict:
+        self._advance()
+        state = "ONLINE_TRIGGERED_UPDATE" if self.pending else "ONLINE_NO_PENDING_UPDATE"
+        status = {"ready": True, "detailed_state": state, "message": ""}
+        if self.version is not None:
+            status["triggered_update_status"] = {"last_processed_commit_version": self.version}
+        return {"status": status}
+
+
+class StubVectorSearchClient:
+    def __init__(self, **index_kwargs):
+        self.index_kwargs = index_kwargs
+        self.indexes = {}
+
+    def get_index(self, endpoint_name: str, index_name: str):
+        key = (endpoint_name, index_name)
+        if key not in self.indexes:
+            self.indexes[key] = StubIndex(**self.index_kwargs)
+        return self.indexes[key]
+
+
+if __name__ == "__main__":
+    # Simulated run against the stub: python -m src.lib.index_sync [log.jsonl]
+    import sys
+
+    class FakeClock:
+        def __init__(self):
+            self.now = 1_700_000_000.0
+
+        def __call__(self):
+            return self.now
+
+        def sleep(self, seconds):
+            self.now += seconds
+
+    clock = FakeClock()
+    source = {"version": 0}
+    changes = lambda start, end: 400 * (end - max(start, 0))  # rows written per commit
+    client = StubVectorSearchClient(source_version=lambda: source["version"], clock=clock, rows=changes)
+    ctl = SyncController(client, "stub-endpoint", "cat.sch.contracts_chunks_vs",
+                         clock=clock, sleep=clock.sleep, log=lambda msg: None)
+    log_path = sys.argv[1] if len(sys.argv) > 1 else None
+
+    indexed = None
+    for version in [3, 3, 5, 9]:
+        commit_at = clock() - 20  # the commit landed 20s before the controller ran
+        source["version"] = version
+        m = ctl.sync_if_stale(version, commit_at=commit_at, rows=changes(-1 if indexed is None else indexed, version),
+                              source_table="cat.sch.contracts_chunks")
+        indexed = m.indexed_version
+        print(f"v{version}: {m.status:<10} indexed {m.indexed_version_before} -> {m.indexed_version} "
+              f"rows={m.rows_changed} embedding_s={m.embedding_s} lag_s={m.lag_s} polls={m.polls}")
+        if log_path:
+            append_metrics_json(log_path, m)
+        clock.sleep(30)
+    print("sync() calls:", client.get_index("stub-endpoint", "cat.sch.contracts_chunks_vs").sync_calls)
@@ -0,0 +1,559 @@
+import asyncio
+import contextvars
+import inspect
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+# open_stream(endpoint, request) -> chunks of a streaming chat completion
+OpenStream = Callable[[str, dict], Iterable[Any]]
+# open_astream(endpoint, request) -> async iterable of chunks, or an awaitable of one (AsyncOpenAI)
+OpenAStream = Callable[[str, dict], Any]
+
+RETRYABLE_STATUS = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+# transport errors of the openai SDK / httpx, matched by name so neither has to be importable
+_RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout", "ReadTimeout",
+                     "ReadError", "RemoteProtocolError", "IncompleteReadError"}
+
+
+class FirstTokenTimeout(TimeoutError):
+    """No chunk within the time-to-first-token deadline."""
+
+
+class StreamStalled(TimeoutError):
+    """The stream started but no chunk arrived within `stall_timeout_s`."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Every endpoint's circuit breaker is open."""
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Throttling, 5xx, timeouts and dropped connections; not 4xx request errors."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    code = status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    return type(exc).__name__ in _RETRYABLE_ERRORS
+
+
+def expo(base: float = 0.5, factor: float = 2.0, max_value: float = 8.0) -> Iterator[float]:
+    # same shape as backoff.expo(base=factor, factor=base, max_value=...)
+    n = 0
+    while True:
+        yield min(base * factor ** n, max_value)
+        n += 1
+
+
+def full_jitter(value: float) -> float:
+    # same as backoff.full_jitter: anywhere in [0, value], so clients that failed together spread out
+    return random.uniform(0, value)
+
+
+class CircuitBreaker:
+    """
+    Closed until `failure_threshold` consecutive failures, then open (calls
+    are refused) for `reset_s`; then half-open: one probe goes through and
+    its outcome closes or re-opens the circuit. Only endpoint failures
+    (is_retryable) count: a rejected request says nothing of the endpoint.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_s: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_s = reset_s
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opens = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and self.clock() - self._opened_at >= self.reset_s:
+                self.state, self._probing = "half_open", False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return self.state == "closed"
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state, self.failures, self._probing = "closed", 0, False
+
+    def record_request_error(self) -> None:
+        # the endpoint answered, rejecting the request (4xx): not a failure; a half-open probe closes the circuit
+        with self._lock:
+            if self.state == "half_open":
+                self.state, self.failures, self._probing = "closed", 0, False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                self.state, self._opened_at, self._probing = "open", self.clock(), False
+
+
+class LatencyWindow:
+    """The last `size` time-to-first-token samples of an endpoint."""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < max(min_samples, 1):
+                return None
+            return float(np.percentile(np.fromiter(self._samples, dtype=np.float64), p))
+
+
+class _Attempt:
+    # one request on its own thread, pushing (attempt, kind, payload) to the shared queue:
+    # kind is "chunk", "end" or "error"
+    def __init__(self, endpoint: str, hedge: bool, open_stream: OpenStream, request: dict, events: queue.Queue):
+        self.endpoint = endpoint
+        self.hedge = hedge
+        self.cancelled = threading.Event()
+        self._stream = None
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(self._run, open_stream, request, events),
+                         name="llm-stream", daemon=True).start()
+
+    def _run(self, open_stream: OpenStream, request: dict, events: queue.Queue) -> None:
+        try:
+            self._stream = open_stream(self.endpoint, request)
+            for chunk in self._stream:
+                if self.cancelled.is_set():
+                    break
+                events.put((self, "chunk", chunk))
+            else:
+                events.put((self, "end", None))
+        except Exception as e:
+            events.put((self, "error", e))
+        finally:
+            if self.cancelled.is_set():
+                self._close()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        self._close()
+
+    def _close(self) -> None:
+        # the SDK's Stream.close() drops the connection, so the thread stops reading a losing hedge
+        try:
+            close = getattr(self._stream, "close", None)
+            if close:
+                close()
+        except Exception:
+            pass  # a generator running on its thread can not be closed from here; it sees `cancelled`
+
+
+class _AsyncAttempt:
+    def __init__(self, endpoint: str, hedge: bool, open_astream: OpenAStream, request: dict, events: asyncio.Queue):
+        self.endpoint = endpoint
+        self.hedge = hedge
+        self.task = asyncio.ensure_future(self._run(open_astream, request, events))
+
+    async def _run(self, open_astream: OpenAStream, request: dict, events: asyncio.Queue) -> None:
+        stream = None
+        try:
+            stream = open_astream(self.endpoint, request)
+            if inspect.isawaitable(stream):
+                stream = await stream
+            async for chunk in stream:
+                events.put_nowait((self, "chunk", chunk))
+            events.put_nowait((self, "end", None))
+        except Exception as e:
+            events.put_nowait((self, "error", e))
+        finally:
+            close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+            if close:
+                try:
+                    result = close()
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    pass
+
+    def cancel(self) -> None:
+        self.task.cancel()
+
+
+class ResilientLLMClient:
+    """
+    Streaming chat completions that survive a slow or failing endpoint.
+    Before the first chunk, retryable errors (429, 5xx, timeouts, dropped
+    connections) are retried with jittered exponential delays (`wait_gen` /
+    `jitter`, the `backoff` package's generators fit) within `retry_budget_s`;
+    after it, errors propagate, since the caller has already streamed
+    tokens. Each attempt must produce a chunk within `ttft_timeout_s`; with
+    `hedge`, a second identical request is sent when the first has no chunk
+    after the endpoint's p95 time-to-first-token (at least `hedge_min_s`,
+    after `hedge_min_samples` requests) and whichever streams first wins.
+    Each endpoint has a CircuitBreaker; when the primary's circuit is open or
+    its retries are exhausted, the next of `endpoints` (fallbacks) is used.
+    `stream` runs each attempt on a thread; `astream` is the asyncio version.
+    """
+
+    def __init__(
+        self,
+        open_stream: Optional[OpenStream],
+        endpoints: Sequence[str],
+        open_astream: Optional[OpenAStream] = None,
+        max_retries: int = 3,
+        retry_budget_s: float = 30.0,
+        ttft_timeout_s: float = 30.0,
+        stall_timeout_s: float = 60.0,
+        hedge: bool = False,
+        hedge_min_s: float = 1.0,
+        hedge_min_samples: int = 20,
+        failure_threshold: int = 5,
+        reset_s: float = 30.0,
+        wait_gen: Callable[[], Iterator[Optional[float]]] = expo,
+        jitter: Callable[[float], float] = full_jitter,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not endpoints:
+            raise ValueError("at least one endpoint is required")
+        self.open_stream = open_stream
+        self.open_astream = open_astream
+        self.endpoints = list(endpoints)
+        self.max_retries = max_retries
+        self.retry_budget_s = retry_budget_s
+        self.ttft_timeout_s = ttft_timeout_s
+        self.stall_timeout_s = stall_timeout_s
+        self.hedge = hedge
+        self.hedge_min_s = hedge_min_s
+        self.hedge_min_samples = hedge_min_samples
+        self.wait_gen = wait_gen
+        self.jitter = jitter
+        self.sleep = sleep
+        self.clock = clock
+        self.breakers = {e: CircuitBreaker(failure_threshold, reset_s, clock) for e in self.endpoints}
+        self.ttft = {e: LatencyWindow() for e in self.endpoints}
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "retries": 0, "ttft_timeouts": 0, "hedges": 0, "hedge_wins": 0,
+                          "fallbacks": 0, "short_circuits": 0, "failures": 0}
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    def hedge_after(self, endpoint: str) -> Optional[float]:
+        """Seconds without a chunk before the hedge request goes out (None: no hedging yet)."""
+        if not self.hedge:
+            return None
+        p95 = self.ttft[endpoint].percentile(95, self.hedge_min_samples)
+        return None if p95 is None else max(p95, self.hedge_min_s)
+
+    def _delays(self) -> Iterator[float]:
+        for value in self.wait_gen():
+            if value is not None:  # backoff's generators start with a bare yield
+                yield self.jitter(value)
+
+    def _should_retry(self, exc: Exception, attempt: int, started: float, delays: Iterator[float]) -> Optional[float]:
+        # the delay before the next attempt, or None to give up
+        if isinstance(exc, FirstTokenTimeout):
+            self._count("ttft_timeouts")
+        if attempt >= self.max_retries or not is_retryable(exc):
+            return None
+        delay = next(delays)
+        if self.clock() - started + delay > self.retry_budget_s:
+            return None
+        self._count("retries")
+        return delay
+
+    # -- threads -----------------------------------------------------------------------------------
+
+    def _first_chunk(self, endpoint: str, request: dict) -> tuple:
+        events: queue.Queue = queue.Queue()
+        start = self.clock()
+        deadline = start + self.ttft_timeout_s
+        hedge_after = self.hedge_after(endpoint)
+        hedge_at = start + hedge_after if hedge_after is not None else None
+        attempts = [_Attempt(endpoint, False, self.open_stream, request, events)]
+        winner = None
+        try:
+            while True:
+                wake = min(deadline, hedge_at) if hedge_at is not None else deadline
+                try:
+                    attempt, kind, payload = events.get(timeout=max(wake - self.clock(), 0.0))
+                except queue.Empty:
+                    if hedge_at is not None and self.clock() >= hedge_at:
+                        hedge_at = None
+                        attempts.append(_Attempt(endpoint, True, self.open_stream, request, events))
+                        self._count("hedges")
+                    elif self.clock() >= deadline:
+                        raise FirstTokenTimeout(f"{endpoint}: no token in {self.ttft_timeout_s:g} s")
+                    continue
+                if kind == "error":
+                    attempts.remove(attempt)
+                    if not attempts:
+                        raise payload
+                    continue
+                winner = attempt
+                self.ttft[endpoint].add(self.clock() - start)
+                if attempt.hedge:
+                    self._count("hedge_wins")
+                return attempt, kind, payload, events
+        finally:
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel()
+
+    def _rest(self, winner: _Attempt, events: queue.Queue) -> Iterator[Any]:
+        while True:
+            try:
+                attempt, kind, payload = events.get(timeout=self.stall_timeout_s)
+            except queue.Empty:
+                raise StreamStalled(f"{winner.endpoint}: no chunk in {self.stall_timeout_s:g} s") from None
+            if attempt is not winner:
+                continue  # a cancelled hedge still finishing
+            if kind == "chunk":
+                yield payload
+            elif kind == "end":
+                return
+            else:
+                raise payload
+
+    def _open(self, endpoint: str, request: dict) -> tuple:
+        started, delays = self.clock(), self._delays()
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._first_chunk(endpoint, request)
+            except Exception as e:
+                delay = self._should_retry(e, attempt, started, delays)
+                if delay is None:
+                    raise
+                self.sleep(delay)
+
+    def stream(self, request: dict) -> Iterator[Any]:
+        """Chunks of one completion from the first healthy endpoint."""
+        self._count("requests")
+        error: Exception = CircuitOpenError(f"circuit open for {', '.join(self.endpoints)}")
+        for i, endpoint in enumerate(self.endpoints):
+            breaker = self.breakers[endpoint]
+            if not breaker.allow():
+                self._count("short_circuits")
+                continue
+            try:
+                winner, kind, payload, events = self._open(endpoint, request)
+            except Exception as e:
+                error = e
+                if not is_retryable(e):
+                    breaker.record_request_error()
+                    break  # a bad request fails the same on every endpoint
+                breaker.record_failure()
+                continue
+            breaker.record_success()
+            if i:
+                self._count("fallbacks")
+            try:
+                if kind == "chunk":
+                    yield payload
+                    yield from self._rest(winner, events)
+            except Exception as e:
+                # tokens already went to the caller: no retry, but a failing endpoint is marked
+                if is_retryable(e):
+                    breaker.record_failure()
+                self._count("failures")
+                raise
+            finally:
+                winner.cancel()
+            return
+        self._count("failures")
+        raise error
+
+    # -- asyncio -----------------------------------------------------------------------------------
+
+    async def _afirst_chunk(self, endpoint: str, request: dict) -> tuple:
+        events: asyncio.Queue = asyncio.Queue()
+        start = self.clock()
+        deadline = start + self.ttft_timeout_s
+        hedge_after = self.hedge_after(endpoint)
+        hedge_at = start + hedge_after if hedge_after is not None else None
+        attempts = [_AsyncAttempt(endpoint, False, self.open_astream, request, events)]
+        winner = None
+        try:
+            while True:
+                wake = min(deadline, hedge_at) if hedge_at is not None else deadline
+                try:
+                    attempt, kind, payload = await asyncio.wait_for(events.get(), max(wake - self.clock(), 0.0))
+                except asyncio.TimeoutError:
+                    if hedge_at is not None and self.clock() >= hedge_at:
+                        hedge_at = None
+                        attempts.append(_AsyncAttempt(endpoint, True, self.open_astream, request, events))
+                        self._count("hedges")
+                    elif self.clock() >= deadline:
+                        raise FirstTokenTimeout(f"{endpoint}: no token in {self.ttft_timeout_s:g} s") from None
+                    continue
+                if kind == "error":
+                    attempts.remove(attempt)
+                    if not attempts:
+                        raise payload
+                    continue
+                winner = attempt
+                self.ttft[endpoint].add(self.clock() - start)
+                if attempt.hedge:
+                    self._count("hedge_wins")
+                return attempt, kind, payload, events
+        finally:
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel()
+
+    async def _arest(self, winner: _AsyncAttempt, events: asyncio.Queue) -> AsyncIterator[Any]:
+        while True:
+            try:
+                attempt, kind, payload = await asyncio.wait_for(events.get(), self.stall_timeout_s)
+            except asyncio.TimeoutError:
+                raise StreamStalled(f"{winner.endpoint}: no chunk in {self.stall_timeout_s:g} s") from None
+            if attempt is not winner:
+                continue
+            if kind == "chunk":
+                yield payload
+            elif kind == "end":
+                return
+            else:
+                raise payload
+
+    async def _aopen(self, endpoint: str, request: dict) -> tuple:
+        started, delays = self.clock(), self._delays()
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._afirst_chunk(endpoint, request)
+            except Exception as e:
+                delay = self._should_retry(e, attempt, started, delays)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def astream(self, request: dict) -> AsyncIterator[Any]:
+        """`stream` on the event loop (requires `open_astream`)."""
+        self._count("requests")
+        error: Exception = CircuitOpenError(f"circuit open for {', '.join(self.endpoints)}")
+        for i, endpoint in enumerate(self.endpoints):
+            breaker = self.breakers[endpoint]
+            if not breaker.allow():
+                self._count("short_circuits")
+                continue
+            try:
+                winner, kind, payload, events = await self._aopen(endpoint, request)
+            except Exception as e:
+                error = e
+                if not is_retryable(e):
+                    breaker.record_request_error()
+                    break
+                breaker.record_failure()
+                continue
+            breaker.record_success()
+            if i:
+                self._count("fallbacks")
+            try:
+                if kind == "chunk":
+                    yield payload
+                    async for chunk in self._arest(winner, events):
+                        yield chunk
+            except Exception as e:
+                if is_retryable(e):
+                    breaker.record_failure()
+                self._count("failures")
+                raise
+            finally:
+                winner.cancel()
+            return
+        self._count("failures")
+        raise error
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        endpoints = {}
+        for e in self.endpoints:
+            p50, p95 = self.ttft[e].percentile(50), self.ttft[e].percentile(95)
+            endpoints[e] = {
+                "circuit": self.breakers[e].state,
+                "circuit_opens": self.breakers[e].opens,
+                "ttft_p50_s": None if p50 is None else round(p50, 3),
+                "ttft_p95_s": None if p95 is None else round(p95, 3),
+            }
+        return {**counters, "endpoints": endpoints}
+
+
+if __name__ == "__main__":
+    # python -m src.lib.llm_client: the same requests against a faulty stub endpoint, plain vs resilient
+    from concurrent.futures import ThreadPoolExecutor
+
+    from src.lib.agent_bench import RawClient
+    from src.lib.llm_stub import StubLLMServer
+
+    primary = StubLLMServer(ttft_s=0.15, tokens=10, error_rate=0.1, error_status=429, slow_rate=0.04, slow_ttft_s=2.0)
+    secondary = StubLLMServer(ttft_s=0.25, tokens=10, seed=1)
+    clients = {"primary": RawClient(primary.start()), "secondary": RawClient(secondary.start())}
+    request = {"messages": [{"role": "user", "content": "Qual o aviso prévio?"}]}
+
+    def open_stream(endpoint: str, req: dict):
+        return clients[endpoint].stream(req["messages"])
+
+    def run(client: Optional[ResilientLLMClient], n: int = 150) -> List[Optional[float]]:
+        def one(_) -> Optional[float]:
+            t0 = time.perf_counter()
+            try:
+                chunks = client.stream(request) if client else open_stream("primary", request)
+                next(iter(chunks))
+                ttft = time.perf_counter() - t0
+                for _ in chunks:
+                    pass
+                return ttft
+            except Exception:
+                return None
+        with ThreadPoolExecutor(8) as pool:
+            return list(pool.map(one, range(n)))
+
+    def report(name: str, ttfts: List[Optional[float]], client: Optional[ResilientLLMClient] = None) -> None:
+        ok = [t * 1000 for t in ttfts if t is not None]
+        p50, p95, p99 = np.percentile(ok, [50, 95, 99]) if ok else (0, 0, 0)
+        print(f"{name:<22} errors {len(ttfts) - len(ok):>3}/{len(ttfts)}  ttft p50 {p50:6.0f} p95 {p95:6.0f} "
+              f"p99 {p99:6.0f} ms")
+        if client:
+            print(" " * 23 + str({k: v for k, v in client.stats.items() if v and k != "endpoints"}))
+
+    try:
+        report("plain", run(None))
+        retrying = ResilientLLMClient(open_stream, ["primary"], wait_gen=lambda: expo(0.05, max_value=0.5))
+        report("retries", run(retrying), retrying)
+        hedging = ResilientLLMClient(open_stream, ["primary"], wait_gen=lambda: expo(0.05, max_value=0.5),
+                                     hedge=True, hedge_min_s=0.2, hedge_min_samples=10)
+        run(hedging, 30)  # learn the endpoint's p95
+        report("retries + hedging", run(hedging), hedging)
+        primary.error_rate = 1.0  # outage: the breaker opens and traffic moves to the fallback
+        failover = ResilientLLMClient(open_stream, ["primary", "secondary"], max_retries=1,
+                                      wait_gen=lambda: expo(0.05, max_value=0.5), failure_threshold=3, reset_s=60)
+        report("outage + fallback", run(failover), failover)
+        print(" " * 23 + str(failover.stats["endpoints"]))
+    finally:
+        primary.stop()
+        secondary.stop()
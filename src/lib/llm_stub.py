@@ -0,0 +1,213 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Optional
+
+# canned answer streamed word by word (pt-BR, like the real agent's answers)
+ANSWER = (
+    "Conforme a Cláusula 2.3 do Contrato de Prestação de Serviços de Pagamento (DEMO), qualquer das Partes "
+    "pode rescindir mediante aviso prévio escrito de 30 (trinta) dias. Fonte: DEMO_Contrato_Adquirencia_PagServ.pdf, "
+    "página 1."
+)
+
+
+class StubLLMServer:
+    """
+    OpenAI-compatible chat completions server for load tests (stdlib asyncio,
+    runs on a background thread). Waits `ttft_s` before the first chunk, then
+    streams `tokens` chunks `token_interval_s` apart. When the request offers
+    tools and has no tool output yet, the turn is a call to the first tool
+    with the user's question as `query`, like the agent's retrieval turn.
+    Faults: `error_rate` of the requests get `error_status` (503, 429...)
+    and `slow_rate` of them wait `slow_ttft_s` instead of `ttft_s` (a
+    latency tail); the attributes can be changed while serving (an outage:
+    `error_rate = 1.0`). Serves `POST {base_url}/chat/completions` with and
+    without `stream`.
+    """
+
+    def __init__(self, ttft_s: float = 0.3, tokens: int = 40, token_interval_s: float = 0.01,
+                 error_rate: float = 0.0, tool_call_first: bool = True, host: str = "127.0.0.1", port: int = 0,
+                 seed: int = 0, error_status: int = 503, slow_rate: float = 0.0, slow_ttft_s: float = 5.0):
+        self.ttft_s = ttft_s
+        self.tokens = tokens
+        self.token_interval_s = token_interval_s
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_ttft_s = slow_ttft_s
+        self.tool_call_first = tool_call_first
+        self.host = host
+        self.port = port
+        self.stats = {"requests": 0, "errors": 0, "in_flight": 0, "peak_in_flight": 0}
+        self._rng = random.Random(seed)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+        self._connections = set()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/serving-endpoints"
+
+    def start(self) -> str:
+        started = threading.Event()
+
+        def serve() -> None:
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, name="stub-llm", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.base_url
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+
+        async def close() -> None:
+            self._server.close()
+            # idle keep-alive connections would otherwise outlive the loop
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self) -> "StubLLMServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:  # keep-alive: one connection carries many requests
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if method != "POST" or not path.rstrip("/").endswith("/chat/completions"):
+                    await self._send_json(writer, 404, {"error": {"message": f"no route {method} {path}"}})
+                else:
+                    await self._completion(writer, json.loads(body or b"{}"))
+                if headers.get("connection", "").lower() == "close":
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # CancelledError: stop() closing the connection; not re-raised, the server is going away
+            return
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        reason = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error",
+                  503: "Service Unavailable"}.get(status, "Error")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+    def _turn(self, body: dict) -> dict:
+        # the assistant turn this request gets: a retrieval tool call, or the final answer
+        messages = body.get("messages") or []
+        tools = body.get("tools") or []
+        has_tool_output = any(m.get("role") == "tool" for m in messages)
+        if self.tool_call_first and tools and not has_tool_output:
+            question = next((m.get("content") for m in reversed(messages) if m.get("role") == "user"), "") or ""
+            if isinstance(question, list):
+                question = " ".join(p.get("text", "") for p in question if isinstance(p, dict))
+            name = tools[0].get("function", {}).get("name", "search")
+            return {"tool_call": {"id": f"call_{self._rng.getrandbits(48):x}", "name": name,
+                                  "arguments": json.dumps({"query": question}, ensure_ascii=False)}}
+        words = ANSWER.split(" ")
+        words = (words * (self.tokens // len(words) + 1))[:self.tokens]
+        return {"tokens": [w + " " for w in words]}
+
+    async def _completion(self, writer: asyncio.StreamWriter, body: dict) -> None:
+        self.stats["requests"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.stats["in_flight"])
+        try:
+            slow = self._rng.random() < self.slow_rate
+            failed = self._rng.random() < self.error_rate
+            await asyncio.sleep(self.slow_ttft_s if slow else self.ttft_s)
+            if failed:
+                self.stats["errors"] += 1
+                await self._send_json(writer, self.error_status, {"error": {
+                    "message": "stub: simulated fault", "code": str(self.error_status)}})
+                return
+            turn = self._turn(body)
+            completion_id = f"chatcmpl-stub-{self.stats['requests']}"
+            base = {"id": completion_id, "created": int(time.time()), "model": body.get("model", "stub")}
+            if not body.get("stream"):
+                message = {"role": "assistant", "content": "".join(turn.get("tokens", [])) or None}
+                if "tool_call" in turn:
+                    call = turn["tool_call"]
+                    message["tool_calls"] = [{"id": call["id"], "type": "function",
+                                              "function": {"name": call["name"], "arguments": call["arguments"]}}]
+                finish = "tool_calls" if "tool_call" in turn else "stop"
+                await self._send_json(writer, 200, {**base, "object": "chat.completion", "choices": [
+                    {"index": 0, "message": message, "finish_reason": finish}]})
+                return
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"Transfer-Encoding: chunked\r\n\r\n")
+
+            async def event(delta: dict, finish: Optional[str] = None) -> None:
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+                data = f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+                writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+                await writer.drain()
+
+            if "tool_call" in turn:
+                call = turn["tool_call"]
+                await event({"role": "assistant", "content": None, "tool_calls": [{
+                    "index": 0, "id": call["id"], "type": "function",
+                    "function": {"name": call["name"], "arguments": call["arguments"]}}]})
+                await event({}, "tool_calls")
+            else:
+                for i, token in enumerate(turn["tokens"]):
+                    if i:
+                        await asyncio.sleep(self.token_interval_s)
+                    await event({"role": "assistant", "content": token} if i == 0 else {"content": token})
+                await event({}, "stop")
+            done = b"data: [DONE]\n\n"
+            writer.write(f"{len(done):x}\r\n".encode("latin-1") + done + b"\r\n0\r\n\r\n")
+            await writer.drain()
+        finally:
+            self.stats["in_flight"] -= 1
+
+
+if __name__ == "__main__":
+    # python -m src.lib.llm_stub [port]: serve until Ctrl+C (point an OpenAI client at the printed base_url)
+    import sys
+
+    server = StubLLMServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8555)
+    print("Stub LLM at", server.start())
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import yaml
+
+from src.lib.bm25 import BM25Index, HybridRetriever, rows_from_result, vector_search_fn
+from src.lib.chunk_sweep import DEFAULT_QUESTIONS
+
+# search(query) -> result rows; raising counts as an error
+SearchFn = Callable[[str], List[dict]]
+DEFAULT_COLUMNS = ["chunk_uid", "doc_name", "page", "content"]
+
+
+def load_queries(path: str) -> List[str]:
+    """Queries from a questions YAML (`questions: [{question: ...}]`, see conf/benchmark_questions.yml) or a text file, one per line."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yml", ".yaml")):
+            spec = yaml.safe_load(f)
+            items = spec["questions"] if isinstance(spec, dict) else spec
+            return [q["question"] if isinstance(q, dict) else str(q) for q in items]
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def similarity_search_fn(index, columns: Sequence[str] = DEFAULT_COLUMNS, num_results: int = 5,
+                         embedder=None, queries: Sequence[str] = ()) -> SearchFn:
+    """
+    Adapts a Vector Search index / LocalVectorIndex / TieredIndex. With an
+    `embedder` (self-managed embeddings) the query vectors of `queries` are
+    computed up front, so the measured latency is the index alone.
+    """
+    vectors = {q: v.tolist() for q, v in zip(queries, embedder.embed(list(queries)))} if embedder else {}
+
+    def search(query: str) -> List[dict]:
+        if embedder:
+            vector = vectors.get(query) or embedder.embed([query])[0].tolist()
+            result = index.similarity_search(query_vector=vector, columns=list(columns), num_results=num_results)
+        else:
+            result = index.similarity_search(query_text=query, columns=list(columns), num_results=num_results)
+        return rows_from_result(result)
+    return search
+
+
+class StubRetriever:
+    """
+    Stand-in for the Vector Search endpoint: sleeps a log-normal latency
+    around `latency_ms` (sleep releases the GIL, like a network call) and
+    fails `error_rate` of the calls. Shows how the harness itself behaves
+    under concurrency without touching the workspace.
+    """
+
+    def __init__(self, latency_ms: float = 40.0, sigma: float = 0.35, error_rate: float = 0.0,
+                 num_results: int = 5, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.num_results = num_results
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, query: str) -> List[dict]:
+        with self._lock:
+            delay = self.latency_ms / 1000 * self._rng.lognormvariate(0, self.sigma)
+            fail = self._rng.random() < self.error_rate
+            rows = self._rng.randint(max(self.num_results - 2, 0), self.num_results)
+        time.sleep(delay)
+        if fail:
+            raise TimeoutError("stub: simulated endpoint error")
+        return [{"chunk_uid": f"stub-{i}", "content": query * (i + 1)} for i in range(rows)]
+
+
+def local_index_fn(pdf_dir: str, backend: str = "local", num_results: int = 5,
+                   columns: Sequence[str] = DEFAULT_COLUMNS) -> SearchFn:
+    """
+    In-process stand-in over the PDFs in `pdf_dir`: "local" (LocalVectorIndex
+    + HashingEmbedder), "bm25" or "hybrid" (BM25 fused with the local vectors).
+    """
+    from src.lib.embeddings import HashingEmbedder
+    from src.lib.extract import chunk_pages, extract_page_texts, list_pdfs, to_chunk_rows
+    from src.lib.local_index import LocalVectorIndex
+
+    if backend not in ("local", "bm25", "hybrid"):
+        raise ValueError(f"Unknown local backend: {backend!r} (expected 'local', 'bm25' or 'hybrid')")
+    columns = list(columns)
+    rows = []
+    for name in sorted(list_pdfs(pdf_dir)):
+        rows += to_chunk_rows(name, pdf_dir, name, chunk_pages(extract_page_texts(os.path.join(pdf_dir, name))), "pt-BR")
+    rows = [{c: r[c] for c in dict.fromkeys(columns + ["content"])} for r in rows]
+    if backend == "local":
+        return similarity_search_fn(LocalVectorIndex.from_rows(rows, HashingEmbedder()), columns, num_results)
+
+    vector_fn = None
+    if backend == "hybrid":
+        vector_fn = vector_search_fn(LocalVectorIndex.from_rows(rows, HashingEmbedder()), columns)
+    retriever = HybridRetriever(BM25Index.build(rows, columns=columns), vector_fn, columns=columns)
+    return lambda query: retriever.retrieve(query, num_results)
+
+
+@dataclass
+class Sample:
+    started_s: float  # since the start of the measured phase
+    latency_s: float
+    rows: Optional[int] = None
+    chars: Optional[int] = None
+    error: Optional[str] = None
+
+
+def _call(search: SearchFn, query: str, clock: Callable[[], float], t_start: float) -> Sample:
+    t0 = clock()
+    try:
+        rows = search(query)
+    except Exception as e:
+        return Sample(t0 - t_start, clock() - t0, error=type(e).__name__)
+    latency = clock() - t0
+    chars = sum(len(str(r.get("content") or "")) for r in rows)
+    return Sample(t0 - t_start, latency, rows=len(rows), chars=chars)
+
+
+class _Schedule:
+    # hands out query indices until `requests` are issued or `duration_s` has passed
+    def __init__(self, requests: Optional[int], duration_s: Optional[float], clock: Callable[[], float]):
+        self.requests = requests
+        self.deadline = clock() + duration_s if duration_s else None
+        self.clock = clock
+        self.issued = 0
+        self._lock = threading.Lock()
+
+    def next(self) -> Optional[int]:
+        with self._lock:
+            if self.requests is not None and self.issued >= self.requests:
+                return None
+            if self.deadline is not None and self.clock() >= self.deadline:
+                return None
+            self.issued += 1
+            return self.issued - 1
+
+
+def _run_threads(search: SearchFn, queries: Sequence[str], concurrency: int, schedule: _Schedule,
+                 clock: Callable[[], float], t_start: float) -> List[Sample]:
+    samples: List[Sample] = []
+
+    def worker() -> None:
+        while (i := schedule.next()) is not None:
+            samples.append(_call(search, queries[i % len(queries)], clock, t_start))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for f in [pool.submit(worker) for _ in range(concurrency)]:
+            f.result()
+    return samples
+
+
+async def _run_asyncio(search, queries: Sequence[str], concurrency: int, schedule: _Schedule,
+                       clock: Callable[[], float], t_start: float) -> List[Sample]:
+    # coroutine search functions are awaited as is; blocking ones run on a pool of `concurrency` threads
+    samples: List[Sample] = []
+    loop = asyncio.get_running_loop()
+    is_async = asyncio.iscoroutinefunction(search)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        async def worker() -> None:
+            while (i := schedule.next()) is not None:
+                query = queries[i % len(queries)]
+                if not is_async:
+                    samples.append(await loop.run_in_executor(pool, _call, search, query, clock, t_start))
+                    continue
+                t0 = clock()
+                try:
+                    rows = await search(query)
+                    samples.append(Sample(t0 - t_start, clock() - t0, rows=len(rows),
+                                          chars=sum(len(str(r.get("content") or "")) for r in rows)))
+                except Exception as e:
+                    samples.append(Sample(t0 - t_start, clock() - t0, error=type(e).__name__))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+def _dist(values, digits: int = 2, percentiles: Sequence[int] = (50, 90, 95, 99)) -> Dict[str, float]:
+    if not len(values):
+        return {}
+    arr = np.asarray(values, dtype=np.float64)
+    out = {"min": arr.min(), "mean": arr.mean()}
+    out.update({f"p{p}": np.percentile(arr, p) for p in percentiles})
+    out["max"] = arr.max()
+    return {k: round(float(v), digits) for k, v in out.items()}
+
+
+def summarize(samples: List[Sample], wall_s: float) -> dict:
+    """Latency percentiles are over successful requests only; errors are counted by type."""
+    ok = [s for s in samples if s.error is None]
+    errors = Counter(s.error for s in samples if s.error is not None)
+    timeline = []
+    for second in range(int(wall_s) + 1 if samples else 0):
+        window = [s for s in samples if second <= s.started_s < second + 1]
+        ok_window = [s.latency_s * 1000 for s in window if s.error is None]
+        timeline.append({
+            "second": second, "requests": len(window), "errors": len(window) - len(ok_window),
+            "p95_ms": round(float(np.percentile(ok_window, 95)), 2) if ok_window else None,
+        })
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": sum(errors.values()),
+        "error_rate": round(sum(errors.values()) / len(samples), 4) if samples else 0.0,
+        "error_types": dict(errors),
+        "wall_s": round(wall_s, 3),
+        "throughput_qps": round(len(samples) / wall_s, 2) if wall_s else None,
+        "latency_ms": _dist([s.latency_s * 1000 for s in ok]),
+        "result_rows": {**_dist([s.rows for s in ok], 1), "histogram": dict(sorted(Counter(s.rows for s in ok).items()))},
+        "result_chars": _dist([s.chars for s in ok], 0),
+        # per second of the run: throttling or a warming endpoint shows up as a drift here
+        "timeline": timeline,
+    }
+
+
+def run_load(
+    search: SearchFn,
+    queries: Sequence[str],
+    concurrency: int = 8,
+    requests: Optional[int] = None,
+    duration_s: Optional[float] = None,
+    warmup: int = 0,
+    mode: str = "threads",
+    clock: Callable[[], float] = time.perf_counter,
+) -> dict:
+    """
+    Closed-loop load: `concurrency` workers each send the next query as soon
+    as their previous one returns, cycling through `queries`. Runs `warmup`
+    requests first (not measured: connection setup, caches), then either
+    `requests` requests or as many as fit in `duration_s` (in-flight
+    requests at the deadline still complete and count). `mode`: "threads"
+    or "asyncio".
+    """
+    if not queries:
+        raise ValueError("No queries to run")
+    if requests is None and duration_s is None:
+        requests = len(queries) * max(concurrency, 1)
+    if mode not in ("threads", "asyncio"):
+        raise ValueError(f"Unknown mode: {mode!r} (expected 'threads' or 'asyncio')")
+
+    def phase(n: Optional[int], seconds: Optional[float]) -> tuple:
+        t_start = clock()
+        schedule = _Schedule(n, seconds, clock)
+        if mode == "threads":
+            samples = _run_threads(search, queries, concurrency, schedule, clock, t_start)
+        else:
+            samples = asyncio.run(_run_asyncio(search, queries, concurrency, schedule, clock, t_start))
+        return samples, clock() - t_start
+
+    warm = phase(warmup, None)[0] if warmup else []
+    samples, wall_s = phase(requests, duration_s)
+    return {
+        "concurrency": concurrency,
+        "mode": mode,
+        "warmup_requests": len(warm),
+        "warmup_errors": sum(1 for s in warm if s.error is not None),
+        **summarize(samples, wall_s),
+    }
+
+
+def run_sweep(search: SearchFn, queries: Sequence[str], concurrency: Sequence[int], **kwargs) -> dict:
+    runs = [run_load(search, queries, concurrency=c, **kwargs) for c in concurrency]
+    return {
+        "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "queries": len(queries),
+        "runs": runs,
+    }
+
+
+def print_table(report: dict, file=sys.stderr) -> None:
+    print(f"{'conc':>5} {'reqs':>6} {'qps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err%':>6} {'rows':>5}", file=file)
+    for r in report["runs"]:
+        lat = r["latency_ms"]
+        print(f"{r['concurrency']:>5} {r['requests']:>6} {r['throughput_qps']:>8} {lat.get('p50', '-'):>8} "
+              f"{lat.get('p95', '-'):>8} {lat.get('p99', '-'):>8} {r['error_rate'] * 100:>6.2f} "
+              f"{r['result_rows'].get('p50', '-'):>5}", file=file)
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrent retrieval load test.")
+    parser.add_argument("--backend", choices=["stub", "local", "bm25", "hybrid", "remote"], default="stub")
+    parser.add_argument("--queries", default=DEFAULT_QUESTIONS, help="questions YAML or text file (one query per line)")
+    parser.add_argument("--concurrency", type=_ints, default=[1, 4, 8, 16])
+    parser.add_argument("--requests", type=int, help="requests per concurrency level")
+    parser.add_argument("--duration", type=float, help="seconds per concurrency level (instead of --requests)")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--mode", choices=["threads", "asyncio"], default="threads")
+    parser.add_argument("--k", type=int, default=5, help="num_results per query")
+    parser.add_argument("--pdf-dir", default="assets/pdfs/pt-br", help="local/bm25/hybrid backends")
+    parser.add_argument("--config", default="conf/demo_config.yml", help="remote backend")
+    parser.add_argument("--stub-latency-ms", type=float, default=40.0)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="JSON report path (default: stdout)")
+    args = parser.parse_args(argv)
+
+    queries = load_queries(args.queries)
+    if args.backend == "stub":
+        search = StubRetriever(args.stub_latency_ms, error_rate=args.stub_error_rate, num_results=args.k)
+    elif args.backend == "remote":
+        from databricks.vector_search.client import VectorSearchClient
+
+        from src.lib.config import load_config
+        from src.lib.embeddings import get_embedder
+
+        cfg = load_config(args.config)
+        index = VectorSearchClient(disable_notice=True).get_index(
+            endpoint_name=cfg.vector_search_endpoint, index_name=cfg.vector_search_index)
+        embedder = get_embedder(cfg.embedder, cfg.embedding_model_endpoint) if cfg.embedding_mode == "precomputed" else None
+        search = similarity_search_fn(index, DEFAULT_COLUMNS, args.k, embedder=embedder, queries=queries)
+    else:
+        search = local_index_fn(args.pdf_dir, args.backend, args.k)
+
+    report = run_sweep(search, queries, args.concurrency, requests=args.requests, duration_s=args.duration,
+                       warmup=args.warmup, mode=args.mode)
+    report["backend"] = args.backend
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    print_table(report)
+    return 0
+
+
+if __name__ == "__main__":
+    # python -m src.lib.loadtest --backend stub|local|bm25|hybrid|remote [--duration 30] [--output report.json]
+    sys.exit(main())
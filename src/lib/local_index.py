@@ -0,0 +1,380 @@
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.lib.embeddings import Embedder, embed_batched
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize_int8(vectors: np.ndarray):
+    # symmetric per-vector quantization: v ~= codes * scale, codes in [-127, 127]
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iters: int = 10, sample: int = 256, seed: int = 0) -> np.ndarray:
+    """k unit-norm centroids (cosine k-means), trained on at most `sample` * k vectors."""
+    rng = np.random.RandomState(seed)
+    train = vectors[rng.choice(len(vectors), min(len(vectors), sample * k), replace=False)]
+    centroids = train[rng.choice(len(train), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        nonempty = counts > 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        sums[nonempty] = np.add.reduceat(train[order], starts, axis=0)
+        empty = ~nonempty
+        # an empty cluster is restarted on a random training vector
+        sums[empty] = train[rng.choice(len(train), int(empty.sum()))]
+        centroids = _normalize_rows(sums)
+    return centroids
+
+
+def filter_mask(columns: Dict[str, np.ndarray], filters: Optional[Dict[str, Any]], n: int) -> Optional[np.ndarray]:
+    """
+    Row mask for Vector Search style filters: {"doc_name": "a.pdf"}, {"doc_name": ["a", "b"]},
+    {"doc_name NOT": "a.pdf"}, {"page >=": 2} (also <, <=, >), {"content LIKE": "multa"}.
+    """
+    if not filters:
+        return None
+    mask = np.ones(n, dtype=bool)
+    for key, value in filters.items():
+        name, _, op = key.partition(" ")
+        if name not in columns:
+            raise ValueError(f"Filter on unknown column: {name!r}")
+        col = columns[name]
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        op = op.strip().upper()
+        if op in ("", "NOT"):
+            hit = np.isin(col, list(values))
+            mask &= ~hit if op == "NOT" else hit
+        elif op in ("<", "<=", ">", ">="):
+            v = value
+            mask &= {"<": col < v, "<=": col <= v, ">": col > v, ">=": col >= v}[op]
+        elif op == "LIKE":
+            needle = str(value).lower()
+            mask &= np.fromiter((needle in str(x).lower() for x in col), dtype=bool, count=n)
+        else:
+            raise ValueError(f"Unsupported filter operator: {key!r}")
+    return mask
+
+
+def search_result(stored: Dict[str, np.ndarray], columns: List[str], positions, scores) -> dict:
+    # Vector Search response shape: manifest.columns + result.data_array, the score as last column
+    data = [[stored[c][i] for c in columns] + [float(s)] for i, s in zip(positions, scores)]
+    return {
+        "manifest": {
+            "column_count": len(columns) + 1,
+            "columns": [{"name": c} for c in columns] + [{"name": "score"}],
+        },
+        "result": {"row_count": len(data), "data_array": data},
+    }
+
+
+class LocalVectorIndex:
+    """
+    In-process vector index with the `similarity_search` result shape of a
+    Databricks Vector Search index (`result.data_array`, score last), for
+    offline runs and as a low-latency tier in front of the remote index.
+
+    Vectors are unit-normalized and kept in one contiguous float32 array;
+    with `quantize` an int8 copy (one scale per vector, 4x smaller) is what
+    the ANN pass scores. With `nlist` > 0 the vectors are grouped by an IVF
+    (spherical k-means) and stored list by list, so a query only scores the
+    `nprobe` closest lists. The best `rescore` x num_results candidates are
+    then re-scored exactly with the float32 vectors. `nlist=0` is exact
+    brute force. By default (`nlist=None`) the IVF starts at 4096 vectors
+    and `quantize` follows it: numpy has no int8 BLAS, so an int8 full scan
+    plus the rescore is slower than the float32 scan alone, and only worth
+    it for the memory it saves after `save` + `load(mmap=True)` (float32
+    vectors on disk, only the int8 codes resident).
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        columns: Dict[str, Sequence],
+        embedder: Optional[Embedder] = None,
+        quantize: Optional[bool] = None,
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        rescore: int = 4,
+        seed: int = 0,
+    ):
+        vectors = _normalize_rows(vectors)
+        n = len(vectors)
+        if nlist is None:
+            nlist = int(np.sqrt(n)) if n >= 4096 else 0
+        if quantize is None:
+            quantize = bool(nlist)
+        self.embedder = embedder
+        self.nprobe = nprobe
+        self.rescore = rescore
+        self.dim = vectors.shape[1] if n else 0
+
+        if nlist:
+            self.centroids = spherical_kmeans(vectors, nlist, seed=seed)
+            assign = np.concatenate([
+                np.argmax(vectors[i:i + 8192] @ self.centroids.T, axis=1) for i in range(0, n, 8192)
+            ])
+            order = np.argsort(assign, kind="stable")
+            self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+        else:
+            self.centroids = None
+            order = np.arange(n)
+            self.offsets = np.array([0, n])
+        # rows stored in list order: a list is one contiguous slice
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.codes, self.scales = quantize_int8(self.vectors) if quantize and n else (None, None)
+        self.columns = {name: np.asarray(values, dtype=object)[order] for name, values in columns.items()}
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def nbytes(self) -> int:
+        # resident size: memory-mapped float32 vectors (see load) are not counted
+        size = 0 if isinstance(self.vectors, np.memmap) else self.vectors.nbytes
+        if self.codes is not None:
+            size += self.codes.nbytes + self.scales.nbytes
+        if self.centroids is not None:
+            size += self.centroids.nbytes
+        return size
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[dict], embedder: Optional[Embedder] = None,
+                  vector_column: str = "embedding", text_column: str = "content", **kwargs):
+        """Rows with `vector_column`, or `text_column` embedded with `embedder` when the vectors are missing."""
+        rows = list(rows)
+        if rows and rows[0].get(vector_column) is not None:
+            vectors = np.asarray([r[vector_column] for r in rows], dtype=np.float32)
+        elif embedder is not None:
+            vectors = embed_batched([r[text_column] for r in rows], embedder)
+        else:
+            raise ValueError(f"Rows have no {vector_column!r} column and no embedder was given")
+        names = [k for k in (rows[0] if rows else {}) if k != vector_column]
+        return cls(vectors.reshape(len(rows), -1), {k: [r[k] for r in rows] for k in names}, embedder, **kwargs)
+
+    @classmethod
+    def from_table(cls, spark, table: str, columns: Sequence[str], embedder: Optional[Embedder] = None, **kwargs):
+        # loads `columns` (+ `embedding` when the table has precomputed vectors) from a Delta table
+        has_vectors = "embedding" in spark.read.table(table).columns
+        select = list(dict.fromkeys(list(columns) + ["content"] + (["embedding"] if has_vectors else [])))
+        rows = [r.asDict() for r in spark.read.table(table).select(*select).toLocalIterator()]
+        return cls.from_rows(rows, embedder, **kwargs)
+
+    def _candidates(self, q: np.ndarray, k: int, mask: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        # positions worth an exact score; None means every row (unfiltered brute force)
+        if self.centroids is not None:
+            lists = np.argsort(-(self.centroids @ q))[:self.nprobe]
+            idx = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+        elif mask is None and self.codes is None:
+            return None
+        else:
+            idx = np.arange(len(self.vectors))
+        if mask is not None:
+            idx = idx[mask[idx]]
+        if self.codes is None or len(idx) <= k * self.rescore:
+            return idx
+        if self.centroids is None and mask is None:
+            approx = (self.codes @ q) * self.scales  # contiguous scan, no gather
+        else:
+            approx = (self.codes[idx] @ q) * self.scales[idx]
+        keep = k * self.rescore
+        return idx[np.argpartition(-approx, keep - 1)[:keep]]
+
+    def search(self, query_vector, k: int = 10, filters: Optional[Dict[str, Any]] = None):
+        """Positions and exact cosine scores of the top-k rows, best first."""
+        if not len(self.vectors):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        q = _normalize_rows(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        mask = filter_mask(self.columns, filters, len(self.vectors))
+        idx = self._candidates(q, k, mask)
+        if idx is None:
+            scores = self.vectors @ q
+            idx = np.arange(len(self.vectors))
+            if len(idx) > k:
+                part = np.argpartition(-scores, k - 1)[:k]
+                idx, scores = idx[part], scores[part]
+        elif not len(idx):
+            return idx, np.zeros(0, dtype=np.float32)
+        else:
+            scores = self.vectors[idx] @ q
+        top = np.argsort(-scores, kind="stable")[:k]
+        return idx[top], scores[top]
+
+    def similarity_search(
+        self,
+        query_text: Optional[str] = None,
+        query_vector: Optional[Sequence[float]] = None,
+        columns: Optional[List[str]] = None,
+        num_results: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ) -> dict:
+        # same shape as VectorSearchIndex.similarity_search; extra kwargs (disable_notice, ...) are ignored
+        if query_vector is None:
+            if query_text is None or self.embedder is None:
+                raise ValueError("query_text needs an embedder; pass query_vector instead")
+            query_vector = self.embedder.embed([query_text])[0]
+        positions, scores = self.search(query_vector, num_results, filters)
+        return search_result(self.columns, list(columns or self.columns), positions, scores)
+
+    def save(self, path: str) -> None:
+        # one .npy per array, so load() can memory-map the float32 vectors
+        os.makedirs(path, exist_ok=True)
+        arrays = {"vectors": self.vectors, "offsets": self.offsets}
+        if self.centroids is not None:
+            arrays["centroids"] = self.centroids
+        if self.codes is not None:
+            arrays.update(codes=self.codes, scales=self.scales)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        meta = {
+            "nprobe": self.nprobe,
+            "rescore": self.rescore,
+            "columns": {k: v.tolist() for k, v in self.columns.items()},
+        }
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, embedder: Optional[Embedder] = None, mmap: bool = True) -> "LocalVectorIndex":
+        """
+        With `mmap` the float32 vectors stay on disk and only the rows being
+        re-scored are read, so a quantized index keeps just the int8 codes in memory.
+        """
+        def array(name, mode=None):
+            file = os.path.join(path, f"{name}.npy")
+            return np.load(file, mmap_mode=mode) if os.path.exists(file) else None
+
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls.__new__(cls)
+        index.embedder = embedder
+        index.nprobe, index.rescore = meta["nprobe"], meta["rescore"]
+        index.codes, index.scales = array("codes"), array("scales")
+        index.vectors = array("vectors", "r" if mmap and index.codes is not None else None)
+        index.dim = index.vectors.shape[1] if len(index.vectors) else 0
+        index.centroids, index.offsets = array("centroids"), array("offsets")
+        index.columns = {k: np.asarray(v, dtype=object) for k, v in meta["columns"].items()}
+        return index
+
+
+class TieredIndex:
+    """
+    Local index first, remote Vector Search index as fallback: the remote
+    one is only queried when the local index fails, returns fewer than
+    num_results rows or its best score is below `min_score`.
+    """
+
+    def __init__(self, local: LocalVectorIndex, remote, min_score: float = 0.0):
+        self.local = local
+        self.remote = remote
+        self.min_score = min_score
+        self.local_hits = 0
+        self.remote_calls = 0
+
+    def similarity_search(self, num_results: int = 10, **kwargs) -> dict:
+        try:
+            res = self.local.similarity_search(num_results=num_results, **kwargs)
+            rows = res["result"]["data_array"]
+            if len(rows) >= min(num_results, len(self.local)) and rows and rows[0][-1] >= self.min_score:
+                self.local_hits += 1
+                return res
+        except Exception:
+            pass
+        self.remote_calls += 1
+        return self.remote.similarity_search(num_results=num_results, **kwargs)
+
+
+def benchmark(vectors: np.ndarray, queries: np.ndarray, k: int = 10, configs: Optional[List[dict]] = None) -> List[dict]:
+    """recall@k against exact brute force, latency percentiles and memory for each index config."""
+    exact = LocalVectorIndex(vectors, {}, quantize=False, nlist=0)
+    truth = [set(exact.search(q, k)[0].tolist()) for q in queries]
+    # positions differ between indexes (rows are stored in list order): compare by original row id
+    ids = np.arange(len(vectors))
+    configs = configs or [
+        {},  # the defaults
+        {"quantize": False, "nlist": 0},
+        {"quantize": True, "nlist": 0},
+        {"quantize": True, "nlist": None, "nprobe": 4},
+        {"quantize": True, "nlist": None, "nprobe": 8},
+        {"quantize": True, "nlist": None, "nprobe": 16},
+        {"quantize": False, "nlist": None, "nprobe": 8},
+    ]
+    out = []
+    for cfg in configs:
+        t0 = time.perf_counter()
+        index = LocalVectorIndex(vectors, {"id": ids}, **cfg)
+        build_s = time.perf_counter() - t0
+        latencies, recall = [], 0.0
+        for q, expected in zip(queries, truth):
+            t0 = time.perf_counter()
+            positions, _ = index.search(q, k)
+            latencies.append(time.perf_counter() - t0)
+            found = {int(index.columns["id"][p]) for p in positions}
+            recall += len(found & expected) / max(len(expected), 1)
+        lat = np.asarray(latencies) * 1000
+        out.append({
+            **{k_: v for k_, v in cfg.items()},
+            "default": not cfg,
+            "quantize_used": index.codes is not None,
+            "nlist_used": 0 if index.centroids is None else len(index.centroids),
+            "recall_at_k": round(recall / len(queries), 4),
+            "p50_ms": round(float(np.percentile(lat, 50)), 3),
+            "p99_ms": round(float(np.percentile(lat, 99)), 3),
+            "build_s": round(build_s, 3),
+            "mb": round(index.nbytes / 1e6, 1),
+            # what stays in memory after save() + load(mmap=True)
+            "mmap_resident_mb": round((index.nbytes - (index.vectors.nbytes if index.codes is not None else 0)) / 1e6, 1),
+        })
+    return out
+
+
+if __name__ == "__main__":
+    # Recall/latency against brute force: python -m src.lib.local_index [n_vectors] [dim] [report.json]
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 384
+    rng = np.random.RandomState(7)
+    # clustered synthetic corpus (real embeddings are far from uniform), queries near corpus points
+    centers = _normalize_rows(rng.randn(max(n // 1000, 1), dim))
+    noise = lambda m: rng.randn(m, dim).astype(np.float32) / np.sqrt(dim)
+    data = _normalize_rows(centers[rng.randint(len(centers), size=n)] + 1.5 * noise(n))
+    queries = _normalize_rows(data[rng.randint(n, size=200)] + 1.0 * noise(200))
+
+    results = benchmark(data, queries, k=10)
+    print(f"{n} vectors x {dim} dims, {len(queries)} queries, k=10")
+    print(f"{'config':<34} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8} {'MB':>7} {'mmap MB':>8}")
+    for r in results:
+        r["name"] = f"{'int8' if r['quantize_used'] else 'f32'} " + (
+            f"ivf{r['nlist_used']} nprobe={r.get('nprobe', 8)}" if r["nlist_used"] else "brute force")
+        name = r["name"] + (" (default)" if r["default"] else "")
+        print(f"{name:<34} {r['recall_at_k']:>7} {r['p50_ms']:>8} {r['p99_ms']:>8} {r['build_s']:>8} {r['mb']:>7} {r['mmap_resident_mb']:>8}")
+    default = next(r for r in results if r["default"])
+    exact = next(r for r in results if r["name"] == "f32 brute force")
+    print(f"default ({default['name']}): p50 {default['p50_ms']} ms vs {exact['p50_ms']} ms for the exact f32 scan")
+    fastest = min((r for r in results if r["recall_at_k"] >= 0.95), key=lambda r: r["p50_ms"])
+    if fastest["name"] == default["name"]:
+        print(f"the default ({default['name']}) is the fastest config with recall >= 0.95")
+    else:
+        print(f"{fastest['name']} is the fastest config with recall >= 0.95, the default ({default['name']}) "
+              f"is {default['p50_ms'] / fastest['p50_ms']:.1f}x its p50")
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], "w", encoding="utf-8") as f:
+            json.dump({"n": n, "dim": dim, "queries": len(queries), "k": 10, "results": results}, f, indent=2)
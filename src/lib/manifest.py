@@ -0,0 +1,133 @@
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class FileState:
+    doc_name: str
+    source_path: str
+    doc_id: str
+    size_bytes: int
+    modified_at: float
+
+
+@dataclass
+class IngestPlan:
+    new: List[FileState] = field(default_factory=list)
+    changed: List[FileState] = field(default_factory=list)
+    # same bytes, chunked with another ChunkerConfig: same doc_id, told apart by the chunker column
+    rechunked: List[FileState] = field(default_factory=list)
+    unchanged: List[FileState] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+
+    @property
+    def to_extract(self) -> List[FileState]:
+        return self.new + self.changed + self.rechunked
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def doc_id_for(content_sha256: str) -> str:
+    # doc_id is derived from the file bytes, so re-running on the same pdf gives the same id
+    return content_sha256[:32]
+
+
+def chunk_uid(doc_id: str, doc_name: str, page: int, chunk_id: int, chunker: str = "") -> str:
+    # doc_name: byte-identical files under two names share the doc_id but not their chunks' keys;
+    # the chunker signature keeps the new chunks of a rechunked doc from colliding with the old ones
+    key = f"{doc_id}:{doc_name}:{chunker}:{page}:{chunk_id}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def known_sha256(staged: Dict[str, dict], path: str, doc_name: str) -> Optional[str]:
+    # hash recorded by the staging manifest, trusted only while the file keeps the size and mtime it had when staged
+    entry = staged.get(doc_name)
+    if not entry:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if st.st_size == entry.get("size_bytes") and st.st_mtime == entry.get("modified_at"):
+        return entry.get("sha256")
+    return None
+
+
+def scan_files(
+    vol_local: str, vol_dbfs: str, files: List[str], staged: Optional[Dict[str, dict]] = None
+) -> List[FileState]:
+    # `staged`: entries of the staging manifest (01_stage_pdfs_to_volume), so staged files are not hashed again
+    out = []
+    for f in files:
+        local_path = os.path.join(vol_local, f)
+        st = os.stat(local_path)
+        sha = (staged and known_sha256(staged, local_path, f)) or file_sha256(local_path)
+        out.append(FileState(
+            doc_name=f,
+            source_path=f"{vol_dbfs}/{f}",
+            doc_id=doc_id_for(sha),
+            size_bytes=st.st_size,
+            modified_at=st.st_mtime,
+        ))
+    return out
+
+
+def plan_ingestion(
+    files: List[FileState], manifest: Dict[str, Tuple[str, Optional[str]]], chunker: Optional[str] = None
+) -> IngestPlan:
+    """
+    Compares the scanned files with the manifest (doc_name -> (doc_id, chunker
+    signature) of the last ingested version) and splits them in new / changed /
+    rechunked / unchanged / deleted.
+    """
+    plan = IngestPlan()
+    seen = set()
+    for f in files:
+        seen.add(f.doc_name)
+        previous = manifest.get(f.doc_name)
+        if previous is None:
+            plan.new.append(f)
+        elif previous[0] != f.doc_id:
+            plan.changed.append(f)
+        elif chunker is not None and previous[1] != chunker:
+            plan.rechunked.append(f)
+        else:
+            plan.unchanged.append(f)
+    plan.deleted = sorted(name for name in manifest if name not in seen)
+    return plan
+
+
+def sql_string(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def stale_chunks_predicate(plan: IngestPlan, skip: Iterable[str] = (), chunker: Optional[str] = None) -> Optional[str]:
+    """
+    SQL predicate over contracts_chunks matching the previous version of every
+    changed document, the chunks of every rechunked document not cut with
+    `chunker` (the current signature), plus all chunks of deleted ones.
+    Documents in `skip` (e.g. failed extraction) keep their old chunks.
+    """
+    skip = set(skip)
+    clauses = [
+        f"(doc_name = {sql_string(f.doc_name)} AND doc_id <> {sql_string(f.doc_id)})"
+        for f in plan.changed
+        if f.doc_name not in skip
+    ]
+    if chunker is not None:
+        clauses += [
+            f"(doc_name = {sql_string(f.doc_name)} AND NOT chunker <=> {sql_string(chunker)})"
+            for f in plan.rechunked
+            if f.doc_name not in skip
+        ]
+    if plan.deleted:
+        clauses.append(f"doc_name IN ({', '.join(sql_string(n) for n in plan.deleted)})")
+    return " OR ".join(clauses) or None
@@ -0,0 +1,295 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from src.lib.chunking import estimate_tokens
+from src.lib.history import message_tokens
+
+# seconds, 10 per decade (26% apart) from 1 ms to ~2 min: quantiles within a few percent
+LATENCY_BUCKETS = tuple(float(f"{10 ** (i / 10):.3g}") for i in range(-30, 22))
+# per-request counts (loop iterations, tool calls)
+COUNT_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+# prompt / completion tokens of one LLM call
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+# the agent's non-latency histograms
+AGENT_BUCKETS = {
+    "agent_iterations": COUNT_BUCKETS,
+    "llm_prompt_tokens": TOKEN_BUCKETS,
+    "llm_completion_tokens": TOKEN_BUCKETS,
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram (Prometheus-style upper bounds plus +Inf) with
+    count, sum and max. Quantiles are interpolated inside the bucket that
+    holds the rank, so their error is bounded by the bucket width. Not
+    thread-safe on its own: Metrics holds the lock.
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lo = self.bounds[i - 1] if i > 0 else 0.0
+                hi = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(lo + (hi - lo) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        def r(v: Optional[float]) -> Optional[float]:
+            return None if v is None else round(v, 6)
+
+        return {
+            "count": self.count, "sum": r(self.sum), "mean": r(self.sum / self.count) if self.count else None,
+            "p50": r(self.quantile(0.5)), "p95": r(self.quantile(0.95)), "p99": r(self.quantile(0.99)),
+            "max": r(self.max),
+        }
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    if not labels:
+        return ()
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _prom_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"'.replace("\n", " ") for k, v in pairs) + "}"
+
+
+def _prom_number(v: float) -> str:
+    return "+Inf" if math.isinf(v) else f"{v:g}"
+
+
+class Metrics:
+    """
+    In-process histograms and counters keyed by name and labels, for the
+    agent's per-stage latency, token and cache metrics (independent of
+    MLflow tracing). An observation is a dict lookup, a bisect and a few
+    additions under one lock. Histogram buckets are LATENCY_BUCKETS unless
+    `buckets` names others. Read with snapshot() (JSON) or prometheus()
+    (text exposition format); profile() collects the observations of a
+    block of code on their own.
+    """
+
+    def __init__(self, buckets: Optional[Dict[str, Sequence[float]]] = None,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.buckets = dict(buckets or {})
+        self.clock = clock
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._profiles: Tuple["Metrics", ...] = ()
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(self.buckets.get(name, LATENCY_BUCKETS))
+            hist.observe(value)
+        for profile in self._profiles:
+            profile.observe(name, value, **labels)
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        for profile in self._profiles:
+            profile.inc(name, value, **labels)
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """Observes the block's duration in seconds, also when it raises."""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.observe(name, self.clock() - start, **labels)
+
+    @contextmanager
+    def profile(self) -> Iterator["Metrics"]:
+        """
+        A fresh Metrics receiving every observation made (from any thread) while the block runs, on top
+        of this one: `with metrics.profile() as p: ...`, then p.snapshot() or format_snapshot(p.snapshot()).
+        """
+        profile = Metrics(self.buckets, self.clock)
+        with self._lock:
+            self._profiles = self._profiles + (profile,)
+        try:
+            yield profile
+        finally:
+            with self._lock:
+                self._profiles = tuple(p for p in self._profiles if p is not profile)
+
+    def counter(self, name: str, **labels: Any) -> float:
+        with self._lock:
+            return self._counters.get((name, _labels(labels)), 0)
+
+    def hit_rate(self, name: str) -> Optional[float]:
+        """hits / lookups of a counter labelled result=hit|miss (None before the first lookup)."""
+        hits, misses = self.counter(name, result="hit"), self.counter(name, result="miss")
+        return round(hits / (hits + misses), 4) if hits + misses else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """{"histograms": {name: [{labels, count, sum, mean, p50, p95, p99, max}]}, "counters": {name: [{labels, value}]}}"""
+        with self._lock:
+            histograms = sorted((k, h.summary()) for k, h in self._histograms.items())
+            counters = sorted(self._counters.items())
+        out: Dict[str, Dict[str, List[Dict[str, Any]]]] = {"histograms": {}, "counters": {}}
+        for (name, labels), summary in histograms:
+            out["histograms"].setdefault(name, []).append({"labels": dict(labels), **summary})
+        for (name, labels), value in counters:
+            out["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return out
+
+    def prometheus(self, prefix: str = "") -> str:
+        """Prometheus text exposition format: cumulative `_bucket{le=...}`, `_sum` and `_count`; counters as `_total`."""
+        with self._lock:
+            histograms = sorted((k, list(h.bounds), list(h.counts), h.sum, h.count) for k, h in self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines, typed = [], set()
+        for (name, labels), bounds, counts, total, count in histograms:
+            metric = prefix + name
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, n in zip(bounds + [math.inf], counts):
+                cumulative += n
+                lines.append(f"{metric}_bucket{_prom_labels(labels, (('le', _prom_number(bound)),))} {cumulative}")
+            lines.append(f"{metric}_sum{_prom_labels(labels)} {total:g}")
+            lines.append(f"{metric}_count{_prom_labels(labels)} {count}")
+        for (name, labels), value in counters:
+            metric = prefix + name + "_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_prom_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def format_snapshot(snapshot: Dict[str, Any]) -> str:
+    """Histograms as a p50/p95/p99 table (values in their own unit: seconds for *_seconds), then the counters."""
+    lines = [f"{'histogram':<44} {'count':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"]
+    for name, series in snapshot["histograms"].items():
+        for s in series:
+            label = name + ("{" + ",".join(f"{k}={v}" for k, v in s["labels"].items()) + "}" if s["labels"] else "")
+            lines.append(f"{label:<44} {s['count']:>7} " + " ".join(
+                f"{s[k]:>9.4g}" if s[k] is not None else f"{'-':>9}" for k in ("mean", "p50", "p95", "p99", "max")
+            ))
+    for name, series in snapshot["counters"].items():
+        for s in series:
+            label = name + ("{" + ",".join(f"{k}={v}" for k, v in s["labels"].items()) + "}" if s["labels"] else "")
+            lines.append(f"{label:<44} {s['value']:>7g}")
+    for name, rate in (snapshot.get("hit_rates") or {}).items():
+        lines.append(f"{name + ' hit rate':<44} {'-' if rate is None else f'{rate:.2%}':>7}")
+    return "\n".join(lines)
+
+
+class LLMCallMeter:
+    """
+    One streamed chat completion: `add` each chunk dict, `done` when the
+    stream ends (or fails) to record llm_call_seconds, llm_ttft_seconds
+    (first content or tool call delta), llm_prompt_tokens and
+    llm_completion_tokens. Tokens come from the usage chunk when the
+    endpoint sends one (stream_options include_usage), else are estimated
+    from the request messages and the streamed deltas.
+    """
+
+    def __init__(self, metrics: Metrics, request: Dict[str, Any]):
+        self.metrics = metrics
+        self.request = request
+        self.start = metrics.clock()
+        self.ttft_s: Optional[float] = None
+        self.usage: Optional[Dict[str, Any]] = None
+        self._completion: List[str] = []
+
+    def add(self, chunk: Dict[str, Any]) -> None:
+        if chunk.get("usage"):
+            self.usage = chunk["usage"]
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta") or {}
+            parts = [delta["content"]] if isinstance(delta.get("content"), str) else []
+            parts += [(tc.get("function") or {}).get("arguments") or "" for tc in delta.get("tool_calls") or []]
+            if any(parts):
+                if self.ttft_s is None:
+                    self.ttft_s = self.metrics.clock() - self.start
+                self._completion.extend(parts)
+
+    def done(self) -> None:
+        self.metrics.observe("llm_call_seconds", self.metrics.clock() - self.start)
+        if self.ttft_s is not None:
+            self.metrics.observe("llm_ttft_seconds", self.ttft_s)
+        usage = self.usage or {}
+        prompt = usage.get("prompt_tokens") or sum(message_tokens(m) for m in self.request.get("messages", []))
+        completion = usage.get("completion_tokens") or estimate_tokens("".join(self._completion))
+        self.metrics.observe("llm_prompt_tokens", prompt)
+        self.metrics.observe("llm_completion_tokens", completion)
+        self.metrics.inc("llm_token_counts", source="usage" if self.usage else "estimated")
+
+
+if __name__ == "__main__":
+    # python -m src.lib.metrics: simulated agent stages, the cost of an observation, and a profiled block
+    import random
+
+    import numpy as np
+
+    metrics = Metrics(buckets=AGENT_BUCKETS)
+    rng = random.Random(7)
+    ttft = [rng.lognormvariate(math.log(0.6), 0.4) for _ in range(5000)]
+    for t in ttft:
+        metrics.observe("llm_ttft_seconds", t)
+        metrics.observe("tool_seconds", rng.lognormvariate(math.log(0.08), 0.5), tool="hybrid_search")
+        metrics.observe("agent_iterations", rng.choice([2, 2, 2, 3, 4]))
+        metrics.inc("retrieval_cache", result="hit" if rng.random() < 0.3 else "miss")
+    exact = np.percentile(ttft, [50, 95, 99])
+    summary = metrics.snapshot()["histograms"]["llm_ttft_seconds"][0]
+    print(f"ttft p50/p95/p99 exact {exact.round(3)} vs histogram "
+          f"{[round(summary[k], 3) for k in ('p50', 'p95', 'p99')]}")
+
+    n = 200_000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        metrics.observe("tool_seconds", 0.05, tool="hybrid_search")
+    print(f"observe: {(time.perf_counter() - t0) / n * 1e9:.0f} ns")
+
+    with metrics.profile() as p:
+        with metrics.timer("request_seconds"):
+            time.sleep(0.05)
+    print(format_snapshot(p.snapshot()))
+    print(format_snapshot(metrics.snapshot()))
+    print(metrics.prometheus("agent_")[:600])
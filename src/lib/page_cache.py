@@ -0,0 +1,123 @@
+import gzip
+import json
+import os
+import re
+import time
+import uuid
+from typing import List, Optional
+
+import pypdf
+
+# bump the suffix when the cleanup applied to extracted text changes
+EXTRACTOR = f"pypdf-{pypdf.__version__}-v1"
+
+
+class PageTextCache:
+    """
+    On-disk cache of extracted page text, one gzip JSONL file per
+    (document content hash, extractor) pair, so re-chunking never calls
+    PdfReader for a file it has already parsed. `root` can be a local
+    directory or a path on the Volume.
+
+    Entries older than `max_age_s` and, past `max_bytes`, the least recently
+    used ones are removed by `evict()`.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        extractor: str = EXTRACTOR,
+        max_bytes: Optional[int] = None,
+        max_age_s: Optional[float] = None,
+    ):
+        self.root = root
+        self.extractor = extractor
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.write_errors = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, doc_id: str) -> str:
+        safe = re.sub(r"[^0-9A-Za-z._-]+", "_", self.extractor)
+        return os.path.join(self.root, f"{doc_id}.{safe}.jsonl.gz")
+
+    def get(self, doc_id: str) -> Optional[List[str]]:
+        path = self._path(doc_id)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                pages = [json.loads(line)["text"] for line in f]
+        except (OSError, EOFError, ValueError, KeyError):
+            # missing or truncated entry: treated as a miss and rewritten by the caller
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(path)  # mtime is the LRU clock used by evict()
+        except OSError:
+            pass
+        return pages
+
+    def put(self, doc_id: str, pages: List[str]) -> None:
+        path = self._path(doc_id)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                for i, text in enumerate(pages, start=1):
+                    f.write(json.dumps({"page": i, "text": text}, ensure_ascii=False) + "\n")
+            os.replace(tmp, path)
+        except OSError:
+            # a failed cache write only costs a re-parse next time
+            self.write_errors += 1
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.writes += 1
+
+    def evict(self) -> int:
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".jsonl.gz"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        removed = []
+        now = time.time()
+        if self.max_age_s is not None:
+            removed = [e for e in entries if now - e[0] > self.max_age_s]
+        expired = {path for _, _, path in removed}
+        kept = sorted(e for e in entries if e[2] not in expired)
+        if self.max_bytes is not None:
+            total = sum(size for _, size, _ in kept)
+            while kept and total > self.max_bytes:
+                oldest = kept.pop(0)
+                total -= oldest[1]
+                removed.append(oldest)
+
+        for _, _, path in removed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.evictions += len(removed)
+        return len(removed)
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "write_errors": self.write_errors,
+            "evictions": self.evictions,
+        }
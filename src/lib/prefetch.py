@@ -0,0 +1,213 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.lib.bm25 import lexical_tokens
+from src.lib.metrics import Metrics
+
+
+def query_similarity(query: str, prefetched: str) -> float:
+    """Share of the query's BM25 terms found in the prefetched text (1.0: the model searched a subset of the question)."""
+    terms = set(lexical_tokens(query))
+    if not terms:
+        return 0.0
+    return len(terms & set(lexical_tokens(prefetched))) / len(terms)
+
+
+class Prefetch:
+    """One request's speculative search: claimed at most once, by the first matching tool call."""
+
+    def __init__(self, tool_name: str, query: str, future: Future, started: float):
+        self.tool_name = tool_name
+        self.query = query
+        self.future = future
+        self.started = started
+        self.done_at: Optional[float] = None
+        self.outcome: Optional[str] = None  # hit | miss | unused | error, once settled
+        self.mismatched = False  # the tool was called with a different query
+        self.lock = threading.Lock()
+
+
+class RetrievalPrefetcher:
+    """
+    Speculative retrieval: `start` searches the user's question with
+    `tool_name` in the background while the first LLM call is in flight;
+    `claim` serves that result to the model's call of the same tool when
+    its query matches (query_similarity >= `min_similarity`), waiting for
+    the search if it is still running. Waste is bounded two ways: at most
+    `max_in_flight` searches run at once (extra requests skip), and when
+    more than `max_waste` of the last `window` prefetches went unused or
+    missed, only one request in `probe_every` prefetches until the ratio
+    recovers. Thread-safe.
+    """
+
+    def __init__(self, tool_name: str, min_similarity: float = 0.8, min_query_terms: int = 2, max_in_flight: int = 4,
+                 window: int = 50, min_samples: int = 10, max_waste: float = 0.5, probe_every: int = 10,
+                 wait_s: float = 30.0, metrics: Optional[Metrics] = None, clock: Callable[[], float] = time.perf_counter):
+        self.tool_name = tool_name
+        self.min_similarity = min_similarity
+        self.min_query_terms = min_query_terms
+        self.max_in_flight = max_in_flight
+        self.min_samples = min_samples
+        self.max_waste = max_waste
+        self.probe_every = probe_every
+        self.wait_s = wait_s
+        self.metrics = metrics
+        self.clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="prefetch")
+        self._wasted: deque = deque(maxlen=window)  # per settled prefetch: True when it was not used
+        self._counters = {"started": 0, "hit": 0, "miss": 0, "unused": 0, "error": 0, "skipped": 0, "throttled": 0}
+        self._saved_s = 0.0
+        self._in_flight = 0
+        self._since_probe = 0
+        self._lock = threading.Lock()
+
+    @property
+    def throttled(self) -> bool:
+        with self._lock:
+            return self._throttled()
+
+    def _throttled(self) -> bool:
+        return len(self._wasted) >= self.min_samples and sum(self._wasted) / len(self._wasted) > self.max_waste
+
+    def _count(self, name: str) -> None:
+        # caller holds self._lock
+        self._counters[name] += 1
+        if self.metrics is not None:
+            self.metrics.inc("prefetch", result=name)
+
+    def start(self, query: str, search: Callable[[str], Any]) -> Optional[Prefetch]:
+        """Starts `search(query)` in the background (in a copy of the caller's context); None when skipped."""
+        if len(set(lexical_tokens(query))) < self.min_query_terms:
+            return None
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                self._count("skipped")
+                return None
+            if self._throttled():
+                self._since_probe += 1
+                if self._since_probe < self.probe_every:
+                    self._count("throttled")
+                    return None
+            self._since_probe = 0
+            self._in_flight += 1
+            self._count("started")
+        future = self._executor.submit(contextvars.copy_context().run, search, query)
+        prefetch = Prefetch(self.tool_name, query, future, self.clock())
+
+        def done(_: Future) -> None:
+            prefetch.done_at = self.clock()
+            with self._lock:
+                self._in_flight -= 1
+
+        future.add_done_callback(done)
+        return prefetch
+
+    def matches(self, prefetch: Prefetch, tool_name: str, args: Dict[str, Any]) -> bool:
+        if tool_name != prefetch.tool_name or not isinstance(args.get("query"), str):
+            return False
+        if any(v not in (None, "", [], {}) for k, v in args.items() if k != "query"):
+            return False  # filters etc.: the prefetch searched without them
+        return query_similarity(args["query"], prefetch.query) >= self.min_similarity
+
+    def claim(self, prefetch: Optional[Prefetch], tool_name: str, args: Dict[str, Any]) -> Tuple[bool, Any]:
+        """(True, result) when the prefetched search answers this tool call, else (False, None): run the tool."""
+        if prefetch is None or tool_name != prefetch.tool_name:
+            return False, None
+        with prefetch.lock:
+            if prefetch.outcome is not None:
+                return False, None
+            if not self.matches(prefetch, tool_name, args):
+                prefetch.mismatched = True
+                return False, None
+            claimed_at = self.clock()
+            try:
+                result = prefetch.future.result(timeout=self.wait_s)
+            except Exception:
+                self._settle(prefetch, "error")
+                return False, None
+            self._settle(prefetch, "hit", saved_s=min(prefetch.done_at or claimed_at, claimed_at) - prefetch.started)
+            return True, result
+
+    def finish(self, prefetch: Optional[Prefetch]) -> Optional[str]:
+        """Settles an unclaimed prefetch at the end of its request (a search not yet started is cancelled). Returns the outcome."""
+        if prefetch is None:
+            return None
+        with prefetch.lock:
+            if prefetch.outcome is None:
+                prefetch.future.cancel()
+                failed = prefetch.future.done() and not prefetch.future.cancelled() and prefetch.future.exception() is not None
+                self._settle(prefetch, "error" if failed else "miss" if prefetch.mismatched else "unused")
+            return prefetch.outcome
+
+    def _settle(self, prefetch: Prefetch, outcome: str, saved_s: float = 0.0) -> None:
+        prefetch.outcome = outcome
+        with self._lock:
+            self._count(outcome)
+            self._wasted.append(outcome != "hit")
+            self._saved_s += saved_s
+        if self.metrics is not None and outcome == "hit":
+            self.metrics.observe("prefetch_saved_seconds", saved_s)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            settled = sum(self._counters[k] for k in ("hit", "miss", "unused", "error"))
+            return {
+                **self._counters,
+                "hit_rate": round(self._counters["hit"] / settled, 4) if settled else 0.0,
+                "recent_waste": round(sum(self._wasted) / len(self._wasted), 4) if self._wasted else 0.0,
+                "throttling": self._throttled(),
+                "saved_s": round(self._saved_s, 3),
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # python -m src.lib.prefetch: simulated requests (LLM turn, retrieval, answer), serial vs prefetched
+    import random
+
+    from src.lib.chunk_sweep import DEFAULT_QUESTIONS, load_questions
+
+    LLM_TURN_S, SEARCH_S = 0.30, 0.12
+    questions = [q["question"] for q in load_questions(DEFAULT_QUESTIONS)["questions"]]
+    rng = random.Random(3)
+
+    def search(query: str) -> list:
+        time.sleep(SEARCH_S)
+        return [{"doc_name": "contrato.pdf", "page": 1, "content": query}]
+
+    def model_query(question: str, calls_tool: float) -> Optional[str]:
+        # the model's search: None (answers directly), the question's terms, or other terms
+        r = rng.random()
+        if r > calls_tool:
+            return None
+        terms = lexical_tokens(question)
+        return " ".join(rng.sample(terms, max(1, len(terms) * 2 // 3))) if r < calls_tool * 0.85 else "vigencia reajuste"
+
+    def request(question: str, prefetcher: Optional[RetrievalPrefetcher], calls_tool: float) -> float:
+        t0 = time.perf_counter()
+        prefetch = prefetcher.start(question, search) if prefetcher else None
+        time.sleep(LLM_TURN_S)
+        query = model_query(question, calls_tool)
+        if query is not None:
+            hit, _ = prefetcher.claim(prefetch, "search", {"query": query}) if prefetcher else (False, None)
+            if not hit:
+                search(query)
+            time.sleep(LLM_TURN_S)
+        if prefetcher:
+            prefetcher.finish(prefetch)
+        return time.perf_counter() - t0
+
+    for label, calls_tool in (("mostly retrieval", 0.9), ("small talk (no retrieval)", 0.05)):
+        prefetcher = RetrievalPrefetcher("search", min_samples=8)
+        for name, p in (("serial", None), ("prefetch", prefetcher)):
+            rng.seed(3)
+            lat = [request(questions[i % len(questions)], p, calls_tool) for i in range(40)]
+            print(f"{label:<26} {name:<9} mean {sum(lat) / len(lat) * 1000:7.1f} ms")
+        print(f"{'':<26} stats {prefetcher.stats}")
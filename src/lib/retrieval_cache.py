@@ -0,0 +1,196 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.lib.text import fold
+
+# argument names that carry the query text of the retrieval tools
+QUERY_ARGS = ("query", "query_text", "question")
+
+
+def normalize_query(text: str) -> str:
+    # case, accents, spacing and trailing punctuation do not change the retrieval: "Aviso prévio?" == "aviso previo"
+    return " ".join(fold(text).split()).rstrip("?!.;: ")
+
+
+def cache_key(tool_name: str, args: Dict[str, Any]) -> str:
+    """Tool name + normalized query + the remaining arguments (filters, num_results) in a canonical order."""
+    canonical = {k: normalize_query(v) if k in QUERY_ARGS and isinstance(v, str) else v for k, v in args.items()}
+    return tool_name + ":" + json.dumps(canonical, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class VersionPoller:
+    """
+    Last known value of `version_fn` (e.g. the source-table version an index
+    has processed), refreshed at most every `check_s` seconds so callers on
+    the hot path do not pay a round trip. A failing `version_fn` keeps the
+    previous value and counts an error.
+    """
+
+    def __init__(self, version_fn: Callable[[], Any], check_s: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.version_fn = version_fn
+        self.check_s = check_s
+        self.clock = clock
+        self.errors = 0
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self) -> Any:
+        now = self.clock()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_s:
+                return self._version
+            # claimed before the call: concurrent callers keep the old value instead of polling too
+            self._checked_at = now
+        try:
+            version = self.version_fn()
+        except Exception:
+            with self._lock:
+                self.errors += 1
+                return self._version
+        with self._lock:
+            self._version = version
+            return version
+
+
+def _size(value: Any) -> int:
+    # the agent hands tool results to the LLM as str(), so that is what a cached result costs
+    return len(str(value).encode("utf-8"))
+
+
+class RetrievalCache:
+    """
+    LRU cache of retrieval tool results, bounded by `max_entries` and
+    `max_bytes`, entries expiring after `ttl_s`. `version_fn` returns the
+    source-table version the index has processed; it is polled at most every
+    `version_check_s` and a change drops every entry, so results never
+    outlive a re-sync of the index. Thread-safe; `stats` counts hits,
+    misses, evictions, expirations and invalidations.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 32 << 20,
+        ttl_s: float = 600.0,
+        version_fn: Optional[Callable[[], Any]] = None,
+        version_check_s: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.clock = clock
+        # an unreachable index keeps the last version (and the entries); the TTL still applies
+        self._poller = VersionPoller(version_fn, version_check_s, clock) if version_fn else None
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def _check_version(self) -> None:
+        if self._poller is None:
+            return
+        version = self._poller.current()
+        with self._lock:
+            if version != self._version:
+                if self._version is not None or self._entries:
+                    self._counters["invalidations"] += 1
+                self._entries.clear()
+                self._bytes = 0
+                self._version = version
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        self._check_version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= self.clock():
+                self._drop(key)
+                self._counters["expirations"] += 1
+                entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return True, entry[0]
+
+    def put(self, key: str, value: Any) -> None:
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, size, self.clock() + self.ttl_s)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def _drop(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get_or_compute(self, tool_name: str, args: Dict[str, Any], compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """(result, hit). Errors raised by `compute` propagate and are not cached."""
+        key = cache_key(tool_name, args)
+        hit, value = self.get(key)
+        if hit:
+            return value, True
+        value = compute()
+        self.put(key, value)
+        return value, False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "version_errors": self._poller.errors if self._poller else 0,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "index_version": self._version,
+            }
+
+
+if __name__ == "__main__":
+    # python -m src.lib.retrieval_cache: repeat questions served from the cache vs a simulated 80 ms tool call
+    import random
+
+    from src.lib.chunk_sweep import DEFAULT_QUESTIONS, load_questions
+
+    questions = [q["question"] for q in load_questions(DEFAULT_QUESTIONS)["questions"]]
+    version = {"v": 7}
+    cache = RetrievalCache(max_entries=256, version_fn=lambda: version["v"], version_check_s=0.0)
+
+    def tool(query: str) -> list:
+        time.sleep(0.08)
+        return [{"doc_name": "DEMO.pdf", "page": 1, "content": query * 20}]
+
+    rng = random.Random(0)
+    timings = {True: [], False: []}
+    for i in range(60):
+        q = rng.choice(questions)
+        # users retype the same question with different casing/accents/punctuation
+        q = rng.choice([q, q.lower(), q.rstrip("?"), fold(q)])
+        if i == 40:
+            version["v"] = 8  # index re-synced: everything is fetched again
+        t0 = time.perf_counter()
+        _, hit = cache.get_or_compute("contract_search", {"query": q, "num_results": 5}, lambda: tool(q))
+        timings[hit].append((time.perf_counter() - t0) * 1e6)
+    print(f"hit:  {len(timings[True])} calls, median {sorted(timings[True])[len(timings[True]) // 2]:.1f} us")
+    print(f"miss: {len(timings[False])} calls, median {sorted(timings[False])[len(timings[False]) // 2] / 1000:.1f} ms")
+    print("stats:", cache.stats)
@@ -0,0 +1,160 @@
+import datetime
+import hashlib
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+from src.lib.manifest import doc_id_for, file_sha256, known_sha256
+
+# written next to the staged PDFs; read by 02_extract_chunk_to_delta to skip re-hashing them
+STAGING_MANIFEST = "_staging_manifest.json"
+BLOCK_SIZE = 4 << 20
+# a temp file untouched for this long is a leftover; a copy in flight (of any run) rewrites its own every block
+STALE_TMP_AGE_S = 3600
+
+
+@dataclass
+class StagedFile:
+    doc_name: str
+    status: str  # "copied", "skipped" (same size and hash at the destination) or "failed"
+    size_bytes: int = 0
+    sha256: Optional[str] = None
+    modified_at: Optional[float] = None  # mtime of the destination file
+    staged_at: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def doc_id(self) -> Optional[str]:
+        return doc_id_for(self.sha256) if self.sha256 else None
+
+
+def load_staging_manifest(dst_dir: str) -> Dict[str, dict]:
+    # doc_name -> {size_bytes, sha256, modified_at, staged_at}; empty when missing or unreadable
+    try:
+        with open(os.path.join(dst_dir, STAGING_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def write_staging_manifest(dst_dir: str, entries: Dict[str, dict]) -> str:
+    path = os.path.join(dst_dir, STAGING_MANIFEST)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "files": entries}, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+    return path
+
+
+def copy_file(src: str, dst: str, block_size: int = BLOCK_SIZE) -> str:
+    """
+    Streams `src` to `dst` in `block_size` blocks through a temp file in the
+    destination directory, renamed over `dst` once complete, so readers never
+    see a partial pdf. Returns the sha256 of the copied bytes.
+    """
+    h = hashlib.sha256()
+    tmp = f"{dst}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+            for block in iter(lambda: fsrc.read(block_size), b""):
+                h.update(block)
+                fdst.write(block)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return h.hexdigest()
+
+
+def _stage_one(src_dir: str, dst_dir: str, doc_name: str, manifest: Dict[str, dict], block_size: int) -> StagedFile:
+    src = os.path.join(src_dir, doc_name)
+    dst = os.path.join(dst_dir, doc_name)
+    size = os.path.getsize(src)
+    sha = None
+    if os.path.exists(dst) and os.path.getsize(dst) == size:
+        src_sha = file_sha256(src, block_size)
+        if src_sha == (known_sha256(manifest, dst, doc_name) or file_sha256(dst, block_size)):
+            sha = src_sha
+    status = "skipped" if sha else "copied"
+    if sha is None:
+        sha = copy_file(src, dst, block_size)
+    previous = manifest.get(doc_name, {})
+    return StagedFile(
+        doc_name=doc_name,
+        status=status,
+        size_bytes=size,
+        sha256=sha,
+        modified_at=os.stat(dst).st_mtime,
+        staged_at=(previous.get("staged_at") if status == "skipped" else None)
+        or datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+    )
+
+
+def remove_stale_temp_files(dst_dir: str, max_age_s: float = STALE_TMP_AGE_S) -> int:
+    # leftovers of an interrupted run (copies are only visible under their final name after the rename);
+    # recent ones may belong to a concurrent run and are left alone
+    removed = 0
+    cutoff = time.time() - max_age_s
+    for name in os.listdir(dst_dir):
+        if name.endswith(".tmp"):
+            path = os.path.join(dst_dir, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def stage_pdfs(
+    src_dir: str,
+    dst_dir: str,
+    files: Optional[List[str]] = None,
+    max_workers: int = 8,
+    block_size: int = BLOCK_SIZE,
+    on_result: Optional[Callable[[StagedFile], None]] = None,
+) -> List[StagedFile]:
+    """
+    Copies the PDFs of `src_dir` to `dst_dir` with a pool of `max_workers`
+    threads (the copy is I/O bound). A file whose destination already has the
+    same size and sha256 is skipped, so re-runs only copy new or changed files
+    and an interrupted run resumes where it stopped. The staging manifest
+    (STAGING_MANIFEST) is rewritten at the end with the hash of every staged
+    file; a failed copy keeps its previous entry and is reported as "failed".
+    """
+    if files is None:
+        files = sorted(f for f in os.listdir(src_dir) if f.lower().endswith(".pdf"))
+    os.makedirs(dst_dir, exist_ok=True)
+    remove_stale_temp_files(dst_dir)
+    manifest = load_staging_manifest(dst_dir)
+
+    results: List[StagedFile] = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {pool.submit(_stage_one, src_dir, dst_dir, f, manifest, block_size): f for f in files}
+        for fut in as_completed(futures):
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = StagedFile(doc_name=futures[fut], status="failed", error=repr(e))
+            results.append(res)
+            if on_result:
+                on_result(res)
+
+    entries = {
+        name: entry for name, entry in manifest.items()
+        if os.path.exists(os.path.join(dst_dir, name))
+    }
+    for res in results:
+        if res.status != "failed":
+            entry = asdict(res)
+            for k in ("doc_name", "status", "error"):
+                entry.pop(k)
+            entries[res.doc_name] = entry
+    write_staging_manifest(dst_dir, entries)
+    return sorted(results, key=lambda r: r.doc_name)
@@ -0,0 +1,148 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Generic, Iterator, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class StartupProfiler:
+    """
+    Wall-clock timings of a process's startup steps (imports, client
+    construction, warmup), relative to the profiler's creation. Step names
+    are "kind:component" ("import:mlflow", "init:workspace_client",
+    "warmup:tools"); steps may nest or overlap (concurrent init). Thread-safe.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self.clock = clock
+        self.t0 = clock()
+        self._steps = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        start = self.clock()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            end = self.clock()
+            with self._lock:
+                self._steps.append({
+                    "step": name, "start_s": round(start - self.t0, 4), "seconds": round(end - start, 4),
+                    "thread": threading.current_thread().name, **({"error": error} if error else {}),
+                })
+
+    def report(self) -> Dict[str, Any]:
+        """Steps in start order, plus per kind: step count, summed seconds and wall span (< sum when concurrent)."""
+        with self._lock:
+            steps = sorted(self._steps, key=lambda s: s["start_s"])
+        kinds: Dict[str, Dict[str, float]] = {}
+        for s in steps:
+            kind = s["step"].split(":", 1)[0]
+            k = kinds.setdefault(kind, {"steps": 0, "seconds": 0.0, "first_s": s["start_s"], "last_s": 0.0})
+            k["steps"] += 1
+            k["seconds"] += s["seconds"]
+            k["last_s"] = max(k["last_s"], s["start_s"] + s["seconds"])
+        by_kind = {
+            kind: {"steps": k["steps"], "seconds": round(k["seconds"], 4), "wall_s": round(k["last_s"] - k["first_s"], 4)}
+            for kind, k in kinds.items()
+        }
+        return {"since_start_s": round(self.clock() - self.t0, 4), "by_kind": by_kind, "steps": steps}
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f"{'step':<34} {'start s':>8} {'seconds':>8}  thread"]
+    for s in report["steps"]:
+        lines.append(f"{s['step']:<34} {s['start_s']:>8.3f} {s['seconds']:>8.3f}  {s['thread']}"
+                     + (f"  ({s['error']})" if "error" in s else ""))
+    for kind, k in report["by_kind"].items():
+        lines.append(f"{kind + ' (total)':<34} {'':>8} {k['seconds']:>8.3f}  wall {k['wall_s']:.3f} s, {k['steps']} steps")
+    for name, error in (report.get("errors") or {}).items():
+        lines.append(f"failed: {name}: {error}")
+    return "\n".join(lines)
+
+
+class Lazy(Generic[T]):
+    """
+    Value built by `factory` on the first `get()`, exactly once even when
+    callers race (they wait for the first one). A failing factory raises to
+    its caller and runs again on the next `get()`. Timed as "init:<name>"
+    when a profiler is given.
+    """
+
+    def __init__(self, factory: Callable[[], T], name: str, profiler: Optional[StartupProfiler] = None):
+        self.factory = factory
+        self.name = name
+        self.profiler = profiler
+        self._value: Optional[T] = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def get(self) -> T:
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                if self.profiler:
+                    with self.profiler.step(f"init:{self.name}"):
+                        self._value = self.factory()
+                else:
+                    self._value = self.factory()
+                self._ready = True
+        return self._value
+
+    def reset(self) -> None:
+        with self._lock:
+            self._value, self._ready = None, False
+
+
+def run_concurrently(steps: Dict[str, Callable[[], Any]], profiler: Optional[StartupProfiler] = None,
+                     kind: str = "init", max_workers: int = 8) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """
+    Runs independent setup steps at the same time (each in a copy of the caller's context, timed as
+    "<kind>:<name>"). Returns (results, errors) by step name; a failed step does not stop the others.
+    """
+
+    def timed(name: str, fn: Callable[[], Any]) -> Any:
+        if profiler is None:
+            return fn()
+        with profiler.step(f"{kind}:{name}"):
+            return fn()
+
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(steps))), thread_name_prefix=kind) as pool:
+        futures = {name: pool.submit(contextvars.copy_context().run, timed, name, fn) for name, fn in steps.items()}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+    return results, errors
+
+
+if __name__ == "__main__":
+    # python -m src.lib.startup: serial vs concurrent init of independent (simulated) clients, and lazy reuse
+    profiler = StartupProfiler()
+    with profiler.step("import:numpy"):
+        import numpy  # noqa: F401
+
+    latencies = {"workspace_client": 0.30, "uc_toolkit": 0.45, "vector_search_tool": 0.60, "bm25_index": 0.25}
+    for name, seconds in latencies.items():
+        with profiler.step(f"serial:{name}"):
+            time.sleep(seconds)
+    run_concurrently({name: (lambda s=seconds: time.sleep(s)) for name, seconds in latencies.items()}, profiler)
+
+    client = Lazy(lambda: time.sleep(0.2) or object(), "openai_client", profiler)
+    run_concurrently({f"request_{i}": client.get for i in range(4)}, profiler, kind="request")
+    print(format_report(profiler.report()))
@@ -0,0 +1,29 @@
+import re
+import unicodedata
+from typing import List
+
+_NON_ALNUM_RE = re.compile(r"[^0-9a-z]+")
+
+# function words that only add noise to bag-of-words features
+STOPWORDS = {
+    "a", "ao", "aos", "as", "com", "como", "da", "das", "de", "do", "dos", "e", "ela", "ele", "em",
+    "entre", "esta", "este", "isso", "na", "nas", "no", "nos", "o", "os", "ou", "para", "pela",
+    "pelo", "por", "qual", "quais", "quando", "quanto", "que", "se", "sao", "ser", "sobre", "um",
+    "uma", "onde", "fala", "the", "of", "and", "to", "in", "for", "is", "on", "what", "which",
+}
+
+
+def fold(text: str) -> str:
+    # lowercase without accents, punctuation kept: "Cláusula 5.2 – Multa" -> "clausula 5.2 – multa"
+    folded = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(ch for ch in folded if not unicodedata.combining(ch))
+
+
+def normalize(text: str) -> str:
+    # lowercase, no accents, only letters/digits: "Cláusula 5.2 – Multa" -> "clausula 5 2 multa"
+    return _NON_ALNUM_RE.sub(" ", fold(text)).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    # accent-folded lowercase words, without stopwords
+    return [w for w in normalize(text).split() if w not in STOPWORDS]
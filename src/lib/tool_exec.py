@@ -0,0 +1,151 @@
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence
+
+
+# process-wide cap on live tool threads: a timed-out call keeps its thread until the tool returns,
+# so while a dependency hangs, new calls fail fast instead of piling up threads request after request
+MAX_TOOL_THREADS = 64
+TOOL_THREADS = threading.BoundedSemaphore(MAX_TOOL_THREADS)
+
+
+class ToolCapacityExhausted(RuntimeError):
+    pass
+
+
+@dataclass
+class ToolResult:
+    index: int  # position of the call in the batch
+    output: Any = None
+    error: Optional[str] = None  # set instead of output when the call raised or timed out
+    seconds: float = 0.0
+    timed_out: bool = False
+    rejected: bool = False  # never started: tool capacity exhausted
+
+
+def run_in_thread(
+    fn: Callable[[], Any], name: str = "agent-tool", capacity: threading.BoundedSemaphore = TOOL_THREADS
+) -> Future:
+    """
+    Runs `fn` on a new daemon thread, in a copy of the caller's context (trace spans opened inside stay
+    children of the request's trace). A call that never returns holds only its own thread, and one slot
+    of `capacity` until it does: with every slot taken, ToolCapacityExhausted is raised and no thread starts.
+    """
+    if not capacity.acquire(blocking=False):
+        raise ToolCapacityExhausted("tool capacity exhausted: every tool thread is busy, try again later")
+    future: Future = Future()
+    future.set_running_or_notify_cancel()
+    ctx = contextvars.copy_context()
+
+    def target() -> None:
+        try:
+            future.set_result(ctx.run(fn))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            capacity.release()
+
+    try:
+        threading.Thread(target=target, name=name, daemon=True).start()
+    except BaseException:
+        capacity.release()
+        raise
+    return future
+
+
+class ParallelToolRunner:
+    """
+    Runs the tool calls of one LLM turn at the same time, at most
+    `max_workers` at once per batch, yielding each ToolResult as soon as it
+    finishes (completion order; `index` gives the call order back). Each
+    call gets its own thread (run_in_thread), so concurrent requests do not
+    queue behind each other's tools and a stuck tool starves nobody. A call
+    that runs longer than `timeout_s` from its own start is reported as
+    timed out, its slot goes to the next queued call, and its late result
+    is discarded. Threads of all runners count against `capacity`; a call
+    that finds it full gets an error result right away.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        timeout_s: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        capacity: threading.BoundedSemaphore = TOOL_THREADS,
+    ):
+        self.max_workers = max_workers
+        self.timeout_s = timeout_s
+        self.clock = clock
+        self.capacity = capacity
+
+    def run(self, calls: Sequence[Callable[[], Any]]) -> Iterator[ToolResult]:
+        finished: queue.Queue = queue.Queue()
+        queued = list(enumerate(calls))[::-1]
+        running: Dict[int, float] = {}  # index -> start time
+
+        def execute(index: int, fn: Callable[[], Any]) -> None:
+            started = running[index]
+            try:
+                finished.put(ToolResult(index, output=fn(), seconds=self.clock() - started))
+            except Exception as e:
+                finished.put(ToolResult(index, error=f"Error: {type(e).__name__}: {e}", seconds=self.clock() - started))
+
+        def launch() -> None:
+            while queued and len(running) < self.max_workers:
+                index, fn = queued.pop()
+                running[index] = self.clock()
+                try:
+                    run_in_thread(lambda index=index, fn=fn: execute(index, fn), f"agent-tool-{index}", self.capacity)
+                except ToolCapacityExhausted as e:
+                    finished.put(ToolResult(index, error=f"Error: {e}", rejected=True))
+
+        launch()
+        while running:
+            wait_s = max(min(running.values()) + self.timeout_s - self.clock(), 0.0)
+            ready = []
+            try:
+                ready.append(finished.get(timeout=wait_s))
+                while True:
+                    ready.append(finished.get_nowait())
+            except queue.Empty:
+                pass
+            # late results of calls already reported as timed out are dropped
+            ready = [r for r in ready if r.index in running]
+            now = self.clock()
+            for index, started in sorted(running.items()):
+                if now - started >= self.timeout_s and all(r.index != index for r in ready):
+                    # a running call can not be interrupted: its thread finishes in the background and is ignored
+                    ready.append(ToolResult(index, error=f"Error: tool call timed out after {self.timeout_s:g} s",
+                                            seconds=now - started, timed_out=True))
+            for r in ready:
+                del running[r.index]
+            launch()
+            yield from ready
+
+
+if __name__ == "__main__":
+    # python -m src.lib.tool_exec: a multi-query retrieval turn, sequential vs parallel
+    # four retrieval calls and one stuck tool
+    latencies = [0.25, 0.12, 0.30, 0.08, 3.0]
+    calls = [lambda s=s: time.sleep(s) or f"slept {s} s" for s in latencies]
+
+    t0 = time.perf_counter()
+    for fn in calls:
+        fn()
+    sequential = time.perf_counter() - t0
+
+    runner = ParallelToolRunner(max_workers=8, timeout_s=0.5)
+    t0 = time.perf_counter()
+    results = []
+    for r in runner.run(calls):
+        results.append(r)
+        print(f"  call {r.index} done at {time.perf_counter() - t0:.3f} s"
+              + (" (timed out)" if r.timed_out else f" in {r.seconds:.3f} s"))
+    parallel = time.perf_counter() - t0
+    print(f"sequential {sequential:.3f} s (sum of latencies) | parallel {parallel:.3f} s "
+          f"(max of latencies, capped by the {runner.timeout_s} s timeout)")
+    print("call order:", [r.index for r in sorted(results, key=lambda r: r.index)])
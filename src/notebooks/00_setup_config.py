@@ -12,7 +12,7 @@
 # COMMAND ----------
 
 import os
-from src.lib.config import load_config, volume_dbfs_path, volume_local_path
+from src.lib.config import index_source_table, load_config, volume_dbfs_path, volume_local_path
 
 # COMMAND ----------
 
@@ -41,5 +41,6 @@ print(cfg)
 print("\nVolume (dbfs):", volume_dbfs_path(cfg))
 print("Volume (local):", volume_local_path(cfg))
 print("\nTabela source (chunks):", cfg.source_table)
+print("Tabela fonte do índice (dedup):", index_source_table(cfg))
 print("Vector Search endpoint:", cfg.vector_search_endpoint)
 print("Vector Search index:", cfg.vector_search_index)
\ No newline at end of file
@@ -2,9 +2,14 @@
 # MAGIC %md
 # MAGIC # 01 - Copy workspace pdf files to volume
 # MAGIC
-# MAGIC - Source: `assets/pdfs/pt-br/`
+# MAGIC - Source: `pdf_source_dir` in `conf/demo_config.yml` (default `assets/pdfs/pt-br/`)
 # MAGIC - Destination: `dbfs:/Volumes/<catalog>/<schema>/<volume>/`
 # MAGIC
+# MAGIC Files are streamed in blocks by a thread pool and written through a temp file + rename.
+# MAGIC Files whose size and sha256 already match the destination are skipped, so re-runs (or a
+# MAGIC run resumed after a failure) only copy new or changed PDFs. The hashes are kept in
+# MAGIC `_staging_manifest.json` on the volume, which notebook 02 uses instead of re-hashing.
+# MAGIC
 # MAGIC > If you prefer, you can skip this notebook and just upload via the Volume UI.
 # MAGIC
 
@@ -17,6 +22,7 @@
 
 import os
 from src.lib.config import load_config, volume_dbfs_path, volume_local_path
+from src.lib.staging import STAGING_MANIFEST, stage_pdfs
 
 # COMMAND ----------
 
@@ -26,7 +32,7 @@ REPO_ROOT = os.path.dirname(NOTRBOOK_PARENT)
 CONFIG_PATH = os.path.join(REPO_ROOT, "conf", "demo_config.yml")
 cfg = load_config(CONFIG_PATH)
 
-src_dir = os.path.join(REPO_ROOT, "assets", "pdfs", "pt-br")
+src_dir = os.path.join(REPO_ROOT, cfg.pdf_source_dir)
 dst_dir = volume_local_path(cfg)
 
 print("Source:", src_dir)
@@ -45,24 +51,19 @@ spark.sql(f"CREATE VOLUME IF NOT EXISTS {catalog_name}.{schema_name}.{volume_nam
 
 # COMMAND ----------
 
-import os
+# concurrent copies (I/O bound) and read/write block size
+STAGE_WORKERS = 8
+BLOCK_SIZE = 4 << 20
+
+def report(res):
+    print(f"{res.status:>7}: {res.doc_name}" + (f" ({res.error})" if res.error else ""))
+
+results = stage_pdfs(src_dir, dst_dir, max_workers=STAGE_WORKERS, block_size=BLOCK_SIZE, on_result=report)
 
-# List PDF files in the source directory
-files = [
-    f
-    for f in os.listdir(src_dir)
-    if f.lower().endswith(".pdf")
-]
-
-file_names = [f for f in files]
-
-for idx, fname in enumerate(files, 1):
-    src_path = os.path.join(src_dir, fname)
-    dst_path = os.path.join(dst_dir, fname)
-     
-    print(f"{src_path} - {dst_path}")
-
-    with open(src_path, "rb") as fsrc:
-        with open(dst_path, "wb") as fdst:
-            fdst.write(fsrc.read())
-    print(f"{idx}: {src_path} -> {dst_path}")
\ No newline at end of file
+failed = [r for r in results if r.status == "failed"]
+print("Copied:", sum(r.status == "copied" for r in results),
+      "| Skipped (unchanged):", sum(r.status == "skipped" for r in results),
+      "| Failed:", len(failed))
+print("Manifest:", os.path.join(dst_dir, STAGING_MANIFEST))
+if failed:
+    raise RuntimeError(f"{len(failed)} file(s) failed to stage: {[r.doc_name for r in failed]}")
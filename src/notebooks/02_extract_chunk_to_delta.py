@@ -3,7 +3,31 @@
 # MAGIC # 02 - Extract text from PDFs and generate chunks (Delta)
 # MAGIC
 # MAGIC Output: Delta table `contracts_chunks` with columns:
-# MAGIC - `doc_id`, `source_path`, `doc_name`, `page`, `chunk_id`, `content`, `lang`
+# MAGIC - `chunk_uid`, `doc_id`, `source_path`, `doc_name`, `page`, `chunk_id`, `content`, `lang`,
+# MAGIC   `page_end`, `char_start`, `char_end`, `chunker`
+# MAGIC
+# MAGIC Chunks are cut on clause headings ("Cláusula 5.2", "2.1 ...") and sentence ends and may cross
+# MAGIC pages: `page`/`page_end` is the page span and `char_start`/`char_end` the offsets in the
+# MAGIC whitespace-normalized document text (`chunking.document_text`). `python -m src.lib.chunking` measures
+# MAGIC it at least as fast per MB as `chunk_text`; `CHUNKER = ChunkerConfig(strategy="legacy")` restores the
+# MAGIC fixed 900/120 windows per page.
+# MAGIC
+# MAGIC Ingestion is incremental: `doc_id` is derived from the PDF bytes and `chunk_uid` from
+# MAGIC (`doc_id`, `doc_name`, `chunker`, `page`, `chunk_id`), so byte-identical PDFs under two names keep
+# MAGIC distinct chunks. The manifest table `contracts_ingest_manifest` keeps the
+# MAGIC `doc_id` (and chunker settings) of every ingested file, so unchanged PDFs are skipped and only the chunks of
+# MAGIC new/changed/rechunked/deleted PDFs are merged (the Change Data Feed carries only the real delta).
+# MAGIC Old chunks are deleted only once the new ones are written, so a failed extraction keeps the previous version.
+# MAGIC
+# MAGIC Dedup: exact and near-duplicate chunks (MinHash + LSH) are collapsed into
+# MAGIC `cfg.index_source_table` (`contracts_chunks_dedup`), one canonical chunk per cluster with
+# MAGIC `duplicate_count` and the `sources` (doc/page) it stands for. That is the table the index reads.
+# MAGIC
+# MAGIC Embeddings (`embedding_mode: precomputed`): `embedding`, `content_sha` and `embedding_model` are
+# MAGIC filled here in batches; vectors are reused by content hash from `contracts_embedding_cache`.
+# MAGIC
+# MAGIC BM25: a lexical inverted index of the index source table is saved to the Volume
+# MAGIC (`_bm25/`), used by the agent's hybrid search tool for exact terms (clause numbers, "D+30", rates).
 
 # COMMAND ----------
 
@@ -12,9 +36,21 @@
 
 # COMMAND ----------
 
-import os, re, uuid
-from pypdf import PdfReader
-from src.lib.config import load_config, volume_local_path, volume_dbfs_path
+import os
+import time
+from pyspark.sql.functions import col
+from src.lib.bm25 import BM25Index
+from src.lib.config import bm25_index_path, index_source_table, load_config, volume_local_path, volume_dbfs_path
+from src.lib.chunking import ChunkerConfig
+from src.lib.dedup import dedup_chunks
+from src.lib.delta_writer import iter_record_batches, write_chunk_batches, write_chunks_df
+from src.lib.embedding_stage import embed_chunks_table
+from src.lib.embeddings import get_embedder
+from src.lib.extract import CHUNK_COLUMNS, ExtractionFailure, iter_chunk_rows, iter_chunk_rows_parallel, list_pdfs
+from src.lib.manifest import plan_ingestion, scan_files, stale_chunks_predicate
+from src.lib.page_cache import PageTextCache
+from src.lib.spark_extract import extract_chunks_df
+from src.lib.staging import load_staging_manifest
 
 # COMMAND ----------
 
@@ -27,50 +63,108 @@ cfg = load_config(CONFIG_PATH)
 vol_local = volume_local_path(cfg)
 vol_dbfs = volume_dbfs_path(cfg)
 
-pdf_files = [f for f in os.listdir(vol_local) if f.lower().endswith(".pdf")]
+pdf_files = list_pdfs(vol_local)
 print("Read PDF files from volume:", vol_local)
 print("PDF files found:", len(pdf_files))
 
 # COMMAND ----------
 
+# create catalog/schema if needed
+spark.sql(f"CREATE CATALOG IF NOT EXISTS {cfg.catalog}")
+spark.sql(f"CREATE SCHEMA IF NOT EXISTS {cfg.catalog}.{cfg.schema}")
+
+chunks_table = f"{cfg.catalog}.{cfg.schema}.contracts_chunks"
+manifest_table = f"{cfg.catalog}.{cfg.schema}.contracts_ingest_manifest"
+
+# sentence/clause-aware chunks; max_tokens budgets them in estimated tokens instead of chars
+# (~3x the chunking time: every token is counted), strategy="legacy" for fixed windows per page
+CHUNKER = ChunkerConfig(strategy="sentence", max_chars=900, overlap=120)
+
+# a table written with an older set of columns (e.g. before chunk_uid) can not be merged: rebuild it once
+incremental = (
+    spark.catalog.tableExists(chunks_table)
+    and set(CHUNK_COLUMNS) <= set(spark.read.table(chunks_table).columns)
+)
+
+manifest = {}
+if incremental and spark.catalog.tableExists(manifest_table):
+    manifest = {
+        r.doc_name: (r.doc_id, r.asDict().get("chunker"))
+        for r in spark.read.table(manifest_table).collect()
+    }
+
+# hashes recorded by 01_stage_pdfs_to_volume: only files changed outside the staging step are hashed here
+files = scan_files(vol_local, vol_dbfs, pdf_files, staged=load_staging_manifest(vol_local))
+plan = plan_ingestion(files, manifest, chunker=CHUNKER.signature)
+print("New:", len(plan.new), "| Changed:", len(plan.changed), "| Rechunked:", len(plan.rechunked),
+      "| Unchanged (skipped):", len(plan.unchanged), "| Deleted:", len(plan.deleted))
+
+# COMMAND ----------
+
 #extract chuncks from pdf files
+# EXTRACT_MODE = "driver": PDFs are read from the Volume on the driver;
+#   EXTRACT_WORKERS = 1 keeps the original serial loop, > 1 parses the PDFs
+#   (and page ranges of big files) on a process pool.
+# EXTRACT_MODE = "spark": PDFs are loaded with the binaryFile source and parsed
+#   on the executors (mapInPandas), so ingestion scales with the cluster.
+EXTRACT_MODE = "driver"
+EXTRACT_WORKERS = os.cpu_count() or 1
+DOC_TIMEOUT_S = 300
+# rows per Arrow record batch / Delta micro-batch: bounds driver memory regardless of corpus size
+WRITE_BATCH_ROWS = 2048
+# extracted page text cached by (file hash, extractor version): re-chunking runs never re-parse a pdf.
+# Set PAGE_CACHE_DIR = None to disable (e.g. a local dir like "/local_disk0/page_cache" also works)
+PAGE_CACHE_DIR = f"{vol_local}/_page_cache"
+page_cache = (
+    PageTextCache(PAGE_CACHE_DIR, max_bytes=2 * 1024**3, max_age_s=30 * 24 * 3600)
+    if PAGE_CACHE_DIR else None
+)
+
+to_extract = [f.doc_name for f in plan.to_extract]
+doc_ids = {f.doc_name: f.doc_id for f in plan.to_extract}
+
+failures = []
+if EXTRACT_MODE == "spark":
+    df_new = extract_chunks_df(spark, vol_dbfs, vol_dbfs, files=to_extract, chunker=CHUNKER)
+    write_chunks_df(spark, chunks_table, df_new, create_table=not incremental)
+    # executors skip corrupt pdfs: a doc with no chunk of this doc_id and chunker in the table is reported as failed
+    current = spark.read.table(chunks_table).where(col("chunker") == CHUNKER.signature)
+    ingested = {r.doc_id for r in current.select("doc_id").distinct().collect()}
+    failures = [
+        ExtractionFailure(f.doc_name, "no chunks extracted")
+        for f in plan.to_extract
+        if f.doc_id not in ingested
+    ]
+    written = current.where(col("doc_id").isin(list(doc_ids.values()))).count()
+else:
+    if EXTRACT_WORKERS > 1:
+        rows = iter_chunk_rows_parallel(
+            vol_local, vol_dbfs, max_workers=EXTRACT_WORKERS, doc_timeout=DOC_TIMEOUT_S,
+            files=to_extract, doc_ids=doc_ids, failures=failures, chunker=CHUNKER, cache=page_cache,
+        )
+    else:
+        rows = iter_chunk_rows(
+            vol_local, vol_dbfs, files=to_extract, doc_ids=doc_ids, chunker=CHUNKER, cache=page_cache
+        )
+
+    # extract -> chunk -> Arrow batches -> Delta, one micro-batch at a time
+    written = write_chunk_batches(
+        spark, chunks_table, iter_record_batches(rows, batch_size=WRITE_BATCH_ROWS), create_table=not incremental
+    )
+
+for fail in failures:
+    print(f"Failed to extract {fail.doc_name}: {fail.error}")
+if page_cache:
+    page_cache.evict()
+    print("Page text cache:", page_cache.stats)
+failed_docs = {fail.doc_name for fail in failures}
 
-def chunk_text(text: str, max_chars: int = 900, overlap: int = 120):
-    text = re.sub(r"\s+", " ", (text or "")).strip()
-    if not text:
-        return []
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(len(text), start + max_chars)
-        chunks.append(text[start:end])
-        if end == len(text):
-            break
-        start = max(0, end - overlap)
-    return chunks
-
-rows = []
-for f in os.listdir(vol_local):
-    if not f.lower().endswith(".pdf"):
-        continue
-    local_path = os.path.join(vol_local, f)
-    reader = PdfReader(local_path)
-    doc_id = str(uuid.uuid4())
-    for page_idx, page in enumerate(reader.pages):
-        page_text = (page.extract_text() or "").strip()
-        for i, ch in enumerate(chunk_text(page_text)):
-            rows.append({
-                "doc_id": doc_id,
-                "source_path": f"{vol_dbfs}/{f}",
-                "doc_name": f,
-                "page": page_idx + 1,
-                "chunk_id": i,
-                "content": ch,
-                "lang": "pt-BR"
-            })
-
-df = spark.createDataFrame(rows)
-display(df.limit(5))
+# old versions of changed/rechunked docs and deleted docs leave the table only after the new chunks are in
+stale = stale_chunks_predicate(plan, skip=failed_docs, chunker=CHUNKER.signature) if incremental else None
+if stale:
+    spark.sql(f"DELETE FROM {chunks_table} WHERE {stale}")
+
+print("Table:", chunks_table, "| chunks written:", written, "| stale docs removed:", bool(stale))
 
 # COMMAND ----------
 
@@ -86,18 +180,107 @@ display(df_chunks)
 
 # COMMAND ----------
 
-# create catalog/schema if needed
-spark.sql(f"CREATE CATALOG IF NOT EXISTS {cfg.catalog}")
-spark.sql(f"CREATE SCHEMA IF NOT EXISTS {cfg.catalog}.{cfg.schema}")
-
-# save delta table with change data feed enabled
-(df.write
+# manifest: unchanged + successfully extracted files; a failed changed/rechunked doc keeps its previous entry
+manifest_rows = [
+    (f.doc_name, f.source_path, f.doc_id, CHUNKER.signature, f.size_bytes, f.modified_at)
+    for f in plan.to_extract
+    if f.doc_name not in failed_docs
+] + [
+    (f.doc_name, f.source_path, *manifest[f.doc_name], f.size_bytes, f.modified_at)
+    for f in plan.unchanged + [f for f in plan.changed + plan.rechunked if f.doc_name in failed_docs]
+]
+(spark.createDataFrame(
+    manifest_rows,
+    schema="doc_name STRING, source_path STRING, doc_id STRING, chunker STRING, size_bytes BIGINT, modified_at DOUBLE",
+ ).write
   .mode("overwrite")
   .option("overwriteSchema", "true")
-  .option("delta.enableChangeDataFeed", "true")
-  .saveAsTable(f"{cfg.catalog}.{cfg.schema}.contracts_chunks"))
+  .saveAsTable(manifest_table))
+
+print("Manifest:", manifest_table, "files:", len(manifest_rows))
+
+# COMMAND ----------
+
+# self-managed embeddings (embedding_mode: precomputed): batched calls to the embedder, vectors reused
+# by content hash from contracts_embedding_cache, so re-chunking and re-syncs only embed new text
+EMBED_BATCH_SIZE = 64
+EMBED_CONCURRENCY = 4
+EMBED_MAX_RETRIES = 4
+
+if cfg.embedding_mode == "precomputed":
+    embedder = get_embedder(cfg.embedder, cfg.embedding_model_endpoint)
+    embed_stats = embed_chunks_table(
+        spark, chunks_table, f"{cfg.catalog}.{cfg.schema}.contracts_embedding_cache", embedder,
+        batch_size=EMBED_BATCH_SIZE, max_concurrency=EMBED_CONCURRENCY, max_retries=EMBED_MAX_RETRIES,
+    )
+    print("Embeddings:", embedder.name, embed_stats)
+
+# COMMAND ----------
+
+# near-duplicate elimination (MinHash + LSH banding) before indexing
+DEDUP_THRESHOLD = 0.85
+dedup_table = index_source_table(cfg)
+
+if dedup_table != chunks_table:
+    # current canonical chunks stay canonical, so the merge below only touches real changes
+    prefer = set()
+    dedup_exists = spark.catalog.tableExists(dedup_table)
+    if dedup_exists:
+        prefer = {r.chunk_uid for r in spark.read.table(dedup_table).select("chunk_uid").collect()}
+
+    chunk_rows = (
+        r.asDict()
+        for r in spark.read.table(chunks_table)
+            .select("chunk_uid", "doc_name", "page", "chunk_id", "content")
+            .toLocalIterator()
+    )
+    clusters = dedup_chunks(chunk_rows, threshold=DEDUP_THRESHOLD, prefer=prefer)
+    canonical = spark.createDataFrame(
+        [(c.canonical_uid, len(c.members), c.sources) for c in clusters],
+        schema="chunk_uid STRING, duplicate_count BIGINT, sources STRING",
+    )
+    df_dedup = spark.read.table(chunks_table).join(canonical, "chunk_uid")
+
+    if not dedup_exists or not set(df_dedup.columns) <= set(spark.read.table(dedup_table).columns):
+        (df_dedup.write
+          .mode("overwrite")
+          .option("overwriteSchema", "true")
+          .option("delta.enableChangeDataFeed", "true")
+          .saveAsTable(dedup_table))
+    else:
+        compared = ["content", "sources"] + (["embedding"] if "embedding" in df_dedup.columns else [])
+        unchanged = " AND ".join(f"t.{c} <=> s.{c}" for c in compared)
+        df_dedup.createOrReplaceTempView("dedup_chunks")
+        spark.sql(f"""
+        MERGE INTO {dedup_table} t
+        USING dedup_chunks s
+        ON t.chunk_uid = s.chunk_uid
+        WHEN MATCHED AND NOT ({unchanged}) THEN UPDATE SET *
+        WHEN NOT MATCHED THEN INSERT *
+        WHEN NOT MATCHED BY SOURCE THEN DELETE
+        """)
+
+    n_chunks = sum(len(c.members) for c in clusters)
+    print("Dedup:", dedup_table, "| chunks:", n_chunks, "| canonical:", len(clusters),
+          "| removed:", n_chunks - len(clusters))
+
+# COMMAND ----------
+
+# BM25 inverted index over the chunks the vector index reads; rebuilt on every run (seconds for
+# thousands of chunks) so it always matches the table
+BM25_PATH = bm25_index_path(cfg)
 
-print("Created table:", f"{cfg.catalog}.{cfg.schema}.contracts_chunks", "rows:", df.count())
+t0 = time.perf_counter()
+bm25_rows = (
+    r.asDict()
+    for r in spark.read.table(index_source_table(cfg))
+        .select("chunk_uid", "doc_name", "page", "page_end", "content")
+        .toLocalIterator()
+)
+bm25 = BM25Index.build(bm25_rows, columns=["chunk_uid", "doc_name", "page", "page_end", "content"])
+bm25.save(BM25_PATH)
+print("BM25:", BM25_PATH, "| chunks:", len(bm25), "| terms:", len(bm25.vocab),
+      "| postings:", round(bm25.nbytes / 1e3, 1), "KB | build:", round(time.perf_counter() - t0, 2), "s")
 
 # COMMAND ----------
 
@@ -4,7 +4,14 @@
 # MAGIC
 # MAGIC - Endpoint: `cfg.vector_search_endpoint`
 # MAGIC - Index: `cfg.vector_search_index`
-# MAGIC - Source: `cfg.source_table`
+# MAGIC - Source: `cfg.index_source_table` (deduplicated chunks, see notebook 02), or `cfg.source_table`
+# MAGIC
+# MAGIC - Embeddings: `cfg.embedding_mode` = `managed` (the service embeds `content` with
+# MAGIC   `cfg.embedding_model_endpoint`) or `precomputed` (the `embedding` column filled by notebook 02)
+# MAGIC
+# MAGIC A sync is triggered only when the source table has a Delta version newer than the last
+# MAGIC indexed one. Each run appends rows changed, update (embedding) time and commit-to-searchable
+# MAGIC lag to `contracts_index_sync_log`.
 # MAGIC
 # MAGIC Docs: Vector Search can be created via UI, SDK, or REST.
 
@@ -16,7 +23,8 @@
 # COMMAND ----------
 
 from databricks.vector_search.client import VectorSearchClient
-from src.lib.config import load_config
+from src.lib.config import index_source_table, load_config
+from src.lib.index_sync import SyncController, rows_changed, table_version, write_metrics_delta
 import os, time
 
 # COMMAND ----------
@@ -31,10 +39,11 @@ vsc = VectorSearchClient()
 
 endpoint_name = cfg.vector_search_endpoint
 index_name = cfg.vector_search_index
+source_table = index_source_table(cfg)
 
 print("Endpoint:", endpoint_name)
 print("Index:", index_name)
-print("Source table:", cfg.source_table)
+print("Source table:", source_table)
 
 # COMMAND ----------
 
@@ -74,35 +83,50 @@ except Exception:
     wait_for_endpoint_ready(vsc, endpoint_name)
 
 # 2) Create index (Delta Sync) if not exists
-def wait_for_index_ready(vsc, endpoint_name, index_name, timeout=300, interval=10):
-    start = time.time()
-    while True:
-        index = vsc.get_index(endpoint_name=endpoint_name, index_name=index_name)
-        state = index.get("status", {}).get("ready", "")
-        if state == "READY":
-            print(f"Index '{index_name}' is READY.")
-            break
-        if time.time() - start > timeout:
-            print(f"Notebook timeout: Index '{index_name}' was not ready within 5 minutes.")
-            break
-        print(f"Waiting for index '{index_name}' to be READY. Current state: {state}")
-        time.sleep(interval)
-
 try:
     vsc.get_index(endpoint_name=endpoint_name, index_name=index_name)
     print("Index already created.")
 except Exception:
     print("Creating index (delta sync)...")
+    columns_to_sync = (["doc_id", "source_path", "doc_name", "page", "page_end", "chunk_id", "content", "lang"]
+                       + (["duplicate_count", "sources"] if source_table != cfg.source_table else []))
+    if cfg.embedding_mode == "precomputed":
+        # vectors computed in batches by notebook 02; queries must then pass query_vector (same embedder)
+        dim = (spark.read.table(source_table)
+               .selectExpr("size(embedding) AS dim").where("dim > 0").first())
+        if dim is None:
+            raise RuntimeError(f"No embeddings in {source_table}: run notebook 02 with embedding_mode: precomputed")
+        embedding_args = {"embedding_vector_column": "embedding", "embedding_dimension": dim["dim"]}
+    else:
+        embedding_args = {
+            "embedding_source_column": "content",
+            "embedding_model_endpoint_name": cfg.embedding_model_endpoint,
+        }
     vsc.create_delta_sync_index(
         endpoint_name=endpoint_name,
         index_name=index_name,
-        source_table_name=cfg.source_table,
+        source_table_name=source_table,
         pipeline_type="TRIGGERED",
-        primary_key="doc_id",
-        embedding_source_column="content",
-        embedding_model_endpoint_name=cfg.embedding_model_endpoint,
-        columns_to_sync=["source_path", "doc_name", "page", "chunk_id", "content", "lang"],
+        primary_key="chunk_uid",
+        columns_to_sync=columns_to_sync,
+        **embedding_args,
     )
-    wait_for_index_ready(vsc, endpoint_name, index_name)
+
+# COMMAND ----------
+
+# 3) Sync only if the source table moved past the indexed version, then log the sync metrics
+sync_log_table = f"{cfg.catalog}.{cfg.schema}.contracts_index_sync_log"
+controller = SyncController(vsc, endpoint_name, index_name, initial_interval=2, max_interval=60, timeout=1800)
+
+version, commit_at = table_version(spark, source_table)
+sync = controller.sync_if_stale(version, commit_at=commit_at, source_table=source_table)
+sync.rows_changed = rows_changed(spark, source_table, sync.indexed_version_before, version)
+write_metrics_delta(spark, sync_log_table, sync)
+
+print(f"Sync: {sync.status} | source version {version} | indexed {sync.indexed_version_before} -> "
+      f"{sync.indexed_version} | rows changed {sync.rows_changed} | "
+      f"embedding {sync.embedding_s} s | commit -> searchable {sync.lag_s} s")
+if sync.status in ("failed", "timeout"):
+    raise RuntimeError(f"Index '{index_name}' sync {sync.status}: {sync.message}")
 
 print("OK. Now you can test queries in notebook 4.")
\ No newline at end of file
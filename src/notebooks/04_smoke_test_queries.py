@@ -3,6 +3,11 @@
 # MAGIC # 04 - Smoke test (demo questions)
 # MAGIC
 # MAGIC Runs some queries on Vector Search and prints the excerpts with (doc, page).
+# MAGIC `BACKEND = "local"` runs them on an in-process index instead (`src/lib/local_index.py`).
+# MAGIC
+# MAGIC The last cell scores the golden questions (`conf/benchmark_questions.yml`: recall@k, MRR, nDCG,
+# MAGIC latency) against the thresholds in that file and the previous run saved in the Volume, and fails
+# MAGIC the notebook on a regression (`src/lib/golden_eval.py`).
 
 # COMMAND ----------
 
@@ -12,8 +17,15 @@
 # COMMAND ----------
 
 from databricks.vector_search.client import VectorSearchClient
-from src.lib.config import load_config
+from src.lib.config import index_source_table, load_config, volume_local_path
+from src.lib.embeddings import get_embedder
+from src.lib.golden_eval import EVAL_COLUMNS, check_thresholds, diff_runs, run_golden
+from src.lib.local_index import LocalVectorIndex, TieredIndex
+from src.lib.loadtest import similarity_search_fn
+import datetime
+import json
 import os
+import yaml
 
 vsc = VectorSearchClient(disable_notice=True) # Ensure the notice is disabled
 
@@ -25,7 +37,25 @@ REPO_ROOT = os.path.dirname(NOTRBOOK_PARENT)
 CONFIG_PATH = os.path.join(REPO_ROOT, "conf", "demo_config.yml")
 cfg = load_config(CONFIG_PATH)
 
-idx = vsc.get_index(endpoint_name=cfg.vector_search_endpoint, index_name=cfg.vector_search_index)
+# "remote": Vector Search endpoint; "local": in-process index (int8 + IVF) loaded from the index source table;
+# "tiered": local first, remote when the local index has no good match
+BACKEND = "remote"
+
+remote_idx = vsc.get_index(endpoint_name=cfg.vector_search_endpoint, index_name=cfg.vector_search_index)
+
+# an index with precomputed embeddings is queried with vectors from the same embedder
+embedder = get_embedder(cfg.embedder, cfg.embedding_model_endpoint) if cfg.embedding_mode == "precomputed" else None
+
+if BACKEND == "remote":
+    idx = remote_idx
+else:
+    # precomputed vectors are loaded as is; otherwise `content` is embedded with the configured embedder
+    local_idx = LocalVectorIndex.from_table(
+        spark, index_source_table(cfg), ["chunk_uid", "content", "doc_name", "page", "page_end"],
+        embedder=embedder or get_embedder(cfg.embedder, cfg.embedding_model_endpoint),
+    )
+    print("Local index:", len(local_idx), "vectors,", round(local_idx.nbytes / 1e6, 1), "MB")
+    idx = local_idx if BACKEND == "local" else TieredIndex(local_idx, remote_idx, min_score=0.5)
 
 
 # COMMAND ----------
@@ -46,10 +76,45 @@ r = ""
 for q in queries:
     print("\n" + "="*100)
     print("Q:", q)
-    r = idx.similarity_search(query_text=q, columns=["content", "doc_name", "page"], num_results=4,disable_notice=True)
+    query = {"query_vector": embedder.embed([q])[0].tolist()} if embedder else {"query_text": q}
+    r = idx.similarity_search(**query, columns=["content", "doc_name", "page"], num_results=4,disable_notice=True)
     # r é dict; resultados em r['result']['data_array']
     arr = r["result"]["data_array"]
     for i, row in enumerate(arr, start=1):
         content, doc_name, page = row[0], row[1], row[2]
         print(f"\n--- Match {i} | {doc_name} | pág {page} ---")
-        print(content[:650] + ("..." if len(content)>650 else ""))
\ No newline at end of file
+        print(content[:650] + ("..." if len(content)>650 else ""))
+
+# COMMAND ----------
+
+# golden-set regression gate: thresholds from the golden file, drops measured against the last passing
+# run of this backend (failed runs are kept as failed_golden_*.json and never become the baseline)
+with open(os.path.join(REPO_ROOT, "conf", "benchmark_questions.yml"), "r", encoding="utf-8") as f:
+    golden = yaml.safe_load(f)
+
+runs_dir = f"{volume_local_path(cfg)}/_benchmarks/golden"
+os.makedirs(runs_dir, exist_ok=True)
+previous = sorted(p for p in os.listdir(runs_dir) if p.startswith(f"golden_{BACKEND}_"))
+baseline = None
+if previous:
+    with open(f"{runs_dir}/{previous[-1]}", "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+search = similarity_search_fn(idx, EVAL_COLUMNS, num_results=5, embedder=embedder,
+                              queries=[g["question"] for g in golden["questions"]])
+run = run_golden(search, golden["questions"], ks=(1, 3, 5), repeats=3)
+run.update(label=f"{BACKEND}:{cfg.vector_search_index}", backend=BACKEND,
+           generated_at=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"))
+failures = check_thresholds(run, golden.get("thresholds") or {}, baseline)
+run["failures"] = failures
+
+stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+with open(f"{runs_dir}/{'failed_' if failures else ''}golden_{BACKEND}_{stamp}.json", "w", encoding="utf-8") as f:
+    json.dump(run, f, ensure_ascii=False, indent=2)
+
+print(json.dumps(run["metrics"], indent=2))
+if baseline:
+    changed = diff_runs(baseline, run)["queries"]
+    print("Changed vs", previous[-1], ":", changed or "none")
+if failures:
+    raise RuntimeError("Golden-set regression:\n" + "\n".join(failures))
@@ -0,0 +1,84 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # 06 - Retrieval load test
+# MAGIC
+# MAGIC Runs the benchmark questions (`conf/benchmark_questions.yml`, or any text file with one query per
+# MAGIC line) against the Vector Search index at increasing concurrency and reports p50/p95/p99 latency,
+# MAGIC throughput, error rate and result sizes per level (`src/lib/loadtest.py`). Use it to size the
+# MAGIC endpoint before peak season: the level where p95 climbs or errors appear is the endpoint's limit.
+# MAGIC
+# MAGIC `BACKEND = "stub"` (fixed-latency stand-in) or `"local"` (in-process index over the bundled PDFs)
+# MAGIC run without touching the endpoint. Reports are saved as JSON to the Volume (`_benchmarks/`).
+
+# COMMAND ----------
+
+# MAGIC %pip install -q databricks-vectorsearch pypdf pyyaml
+# MAGIC %restart_python
+
+# COMMAND ----------
+
+import datetime
+import json
+import os
+from databricks.vector_search.client import VectorSearchClient
+from src.lib.config import load_config, volume_local_path
+from src.lib.embeddings import get_embedder
+from src.lib.loadtest import (
+    DEFAULT_COLUMNS, StubRetriever, load_queries, local_index_fn, print_table, run_sweep, similarity_search_fn,
+)
+
+NOTEBOOK_DIR = os.getcwd()
+REPO_ROOT = os.path.dirname(os.path.dirname(NOTEBOOK_DIR))
+cfg = load_config(os.path.join(REPO_ROOT, "conf", "demo_config.yml"))
+
+# COMMAND ----------
+
+# "remote": Vector Search endpoint; "local": in-process index; "stub": simulated 40 ms endpoint
+BACKEND = "remote"
+QUERIES_PATH = os.path.join(REPO_ROOT, "conf", "benchmark_questions.yml")
+CONCURRENCY = [1, 2, 4, 8, 16, 32]
+WARMUP = 10
+# per concurrency level: a fixed duration in seconds, or a fixed number of requests (DURATION_S = None)
+DURATION_S = 30
+REQUESTS = 200
+NUM_RESULTS = 4
+MODE = "threads"  # or "asyncio"
+
+queries = load_queries(QUERIES_PATH)
+if BACKEND == "remote":
+    index = VectorSearchClient(disable_notice=True).get_index(
+        endpoint_name=cfg.vector_search_endpoint, index_name=cfg.vector_search_index
+    )
+    embedder = get_embedder(cfg.embedder, cfg.embedding_model_endpoint) if cfg.embedding_mode == "precomputed" else None
+    search = similarity_search_fn(index, DEFAULT_COLUMNS, NUM_RESULTS, embedder=embedder, queries=queries)
+elif BACKEND == "local":
+    search = local_index_fn(os.path.join(REPO_ROOT, cfg.pdf_source_dir), num_results=NUM_RESULTS)
+else:
+    search = StubRetriever(num_results=NUM_RESULTS)
+
+print("Backend:", BACKEND, "| queries:", len(queries), "| concurrency:", CONCURRENCY)
+
+# COMMAND ----------
+
+report = run_sweep(
+    search, queries, CONCURRENCY, warmup=WARMUP, mode=MODE,
+    duration_s=DURATION_S, requests=None if DURATION_S else REQUESTS,
+)
+report.update(backend=BACKEND, index=cfg.vector_search_index, endpoint=cfg.vector_search_endpoint)
+print_table(report, file=None)
+
+# COMMAND ----------
+
+out_dir = f"{volume_local_path(cfg)}/_benchmarks"
+os.makedirs(out_dir, exist_ok=True)
+stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+out_path = f"{out_dir}/retrieval_load_{BACKEND}_{stamp}.json"
+with open(out_path, "w", encoding="utf-8") as f:
+    json.dump(report, f, ensure_ascii=False, indent=2)
+print("Report:", out_path)
+
+display(spark.createDataFrame([
+    (r["concurrency"], r["requests"], r["throughput_qps"], r["latency_ms"].get("p50"), r["latency_ms"].get("p95"),
+     r["latency_ms"].get("p99"), r["error_rate"])
+    for r in report["runs"]
+], "concurrency INT, requests INT, qps DOUBLE, p50_ms DOUBLE, p95_ms DOUBLE, p99_ms DOUBLE, error_rate DOUBLE"))
@@ -0,0 +1,28 @@
+from src.lib.chunking import ChunkerConfig, chunk_document, document_text, normalize_page
+
+
+def test_offsets_index_the_normalized_document_text():
+    pages = ["Cláusula 1 Objeto.\n  O  contrato   cobre a  prestação de serviços. ", "", "\tSegunda página\n\nfim."]
+    text, page_starts = document_text(pages)
+    assert text == "Cláusula 1 Objeto.\nO contrato cobre a prestação de serviços.\nSegunda página\nfim."
+    assert page_starts == [0, 61, 61]
+    chunks = chunk_document(pages, ChunkerConfig(max_chars=60, overlap=10))
+    for c in chunks:
+        assert c.content == text[c.char_start:c.char_end].replace("\n", " ")
+    assert (chunks[0].page_start, chunks[-1].page_end) == (1, 3)
+    assert chunks[-1].char_end == len(text)
+
+
+def test_chunks_end_on_a_heading_in_the_second_half_of_the_window():
+    body = "O pagamento será feito em até trinta dias corridos após o aceite da nota fiscal. "
+    pages = [body * 4 + "\nCláusula 2 Prazo\n" + body * 4]
+    chunks = chunk_document(pages, ChunkerConfig(max_chars=500, overlap=60))
+    assert chunks[0].content == " ".join([body.strip()] * 4)
+    assert "Cláusula 2 Prazo" in chunks[1].content
+    assert all(len(c.content) <= 500 for c in chunks)
+
+
+def test_normalize_page_matches_the_full_rewrite_on_clean_and_dirty_pages():
+    for page in ["já normal\nsem espaços extras", " a\n", "a  b", "a\n\nb", "a b", "a\tb\r\nc", ""]:
+        expected = "\n".join(filter(None, [" ".join(line.split()) for line in page.split("\n")]))
+        assert normalize_page(page) == expected
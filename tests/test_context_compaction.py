@@ -0,0 +1,84 @@
+from src.lib.chunking import estimate_tokens
+from src.lib.context_compaction import ContextCompactor, Passage, merge_overlaps
+
+
+def _text(start: int, words: int) -> str:
+    # distinct words, so the only overlaps are the ones a test builds
+    return " ".join(f"termo{i}" for i in range(start, start + words))
+
+
+def test_non_retrieval_output_passes_through_and_counts_against_the_budget():
+    compactor = ContextCompactor(budget_tokens=4000)
+    output = {"valor_total": 1250.5, "moeda": "BRL"}
+    assert compactor.compact(output) == str(output)
+    assert compactor.stats.calls == 1
+    assert compactor.stats.tokens == estimate_tokens(str(output))
+    assert compactor.remaining_tokens == 4000 - estimate_tokens(str(output))
+
+
+def test_retrieved_chunks_render_as_citations():
+    assert Passage("a.pdf", [3], "texto").render() == "[a.pdf p.3] texto"
+    assert Passage("a.pdf", [2, 3], "texto").citation() == "[a.pdf p.2-3]"
+    assert Passage("a.pdf", [None], "texto").citation() == "[a.pdf]"
+    rows = [
+        {"doc_name": "a.pdf", "page": 1, "content": "Aviso prévio   de 30 dias."},
+        {"page_content": "Multa de 10%.", "metadata": {"doc_uri": "b.pdf", "page_start": 4}},
+    ]
+    assert ContextCompactor().compact(rows) == "[a.pdf p.1] Aviso prévio de 30 dias.\n[b.pdf p.4] Multa de 10%."
+
+
+def test_chunks_already_in_the_conversation_are_dropped():
+    rows = [{"doc_name": "a.pdf", "page": 1, "content": _text(0, 20)}]
+    compactor = ContextCompactor()
+    compactor.compact(rows)
+    assert compactor.compact(rows).startswith("No new passages")
+    assert compactor.stats.duplicates == 1
+
+    # the same chunk in an earlier turn of the conversation (history), whatever its format
+    from_history = ContextCompactor(history=[f"Tool output: {rows}"])
+    assert from_history.compact(rows).startswith("No new passages")
+    assert from_history.stats.duplicates == 1
+
+
+def test_adjacent_chunks_sharing_their_120_char_overlap_are_merged():
+    a = _text(0, 40)
+    overlap = a[-120:]
+    b = overlap + " " + _text(100, 20)
+    merged, merges = merge_overlaps([Passage("d.pdf", [1], a), Passage("d.pdf", [2], b)])
+    assert merges == 1
+    assert merged == [Passage("d.pdf", [1, 2], a + " " + _text(100, 20))]
+    # the better ranked chunk keeps its position; other documents are left alone
+    other = Passage("e.pdf", [1], overlap)
+    merged, merges = merge_overlaps([Passage("d.pdf", [2], b), other, Passage("d.pdf", [1], a)])
+    assert merges == 1
+    assert merged == [Passage("d.pdf", [1, 2], a + " " + _text(100, 20)), other]
+
+
+def test_budget_spans_compact_calls_and_the_last_chunk_is_cut_at_a_word():
+    compactor = ContextCompactor(budget_tokens=120, min_cut_tokens=10)
+    first = compactor.compact([{"doc_name": "a.pdf", "page": 1, "content": _text(0, 15)}])
+    assert compactor.stats.over_budget == 0
+    used = compactor.stats.tokens
+    assert used == estimate_tokens(first) + 1
+
+    long_text = _text(500, 60)
+    second = compactor.compact([{"doc_name": "a.pdf", "page": 2, "content": long_text}])
+    assert second.startswith("[a.pdf p.2] ") and second.endswith(" …")
+    kept = second[len("[a.pdf p.2] "):-len(" …")]
+    assert long_text.startswith(kept) and long_text[len(kept)] == " "
+    assert compactor.stats.over_budget == 1
+    assert compactor.stats.tokens <= 120
+
+    third = compactor.compact([{"doc_name": "a.pdf", "page": 3, "content": _text(900, 10)}])
+    assert third.startswith("Context budget exhausted")
+
+
+def test_tokens_saved():
+    rows = [{"doc_name": "a.pdf", "page": p, "content": _text(p * 100, 30)} for p in range(3)]
+    compactor = ContextCompactor()
+    compactor.compact(rows)
+    compactor.compact(rows)
+    stats = compactor.stats
+    assert stats.raw_tokens == 2 * estimate_tokens(str(rows))
+    assert stats.tokens_saved == stats.raw_tokens - stats.tokens > estimate_tokens(str(rows))
+    assert stats.as_dict()["tokens_saved"] == stats.tokens_saved
@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.lib.agent_bench import RawClient
+from src.lib.llm_client import CircuitBreaker, CircuitOpenError, FirstTokenTimeout, ResilientLLMClient, expo
+from src.lib.llm_stub import StubLLMServer
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def _client(**kwargs) -> ResilientLLMClient:
+    # requests with {"fail": status} raise that status, others stream two chunks
+    def open_stream(endpoint: str, request: dict):
+        if "fail" in request:
+            raise StatusError(request["fail"])
+        return iter(["a", "b"])
+
+    async def open_astream(endpoint: str, request: dict):
+        if "fail" in request:
+            raise StatusError(request["fail"])
+        for chunk in ("a", "b"):
+            yield chunk
+
+    return ResilientLLMClient(open_stream, ["primary"], open_astream=open_astream, max_retries=0,
+                              failure_threshold=3, reset_s=60, sleep=lambda s: None, **kwargs)
+
+
+def _scripted(*script):
+    # open_stream that serves one script entry per call: an exception to raise before any chunk,
+    # or a list of chunks where an exception entry is raised mid-stream and a float is a delay
+    calls = []
+
+    def open_stream(endpoint: str, request: dict):
+        step = script[min(len(calls), len(script) - 1)]
+        calls.append(endpoint)
+        if isinstance(step, Exception):
+            raise step
+
+        def chunks():
+            for item in step:
+                if isinstance(item, Exception):
+                    raise item
+                if isinstance(item, float):
+                    time.sleep(item)
+                else:
+                    yield item
+        return chunks()
+
+    return open_stream, calls
+
+
+def test_request_errors_do_not_open_the_circuit():
+    client = _client()
+    for _ in range(5):
+        with pytest.raises(StatusError):
+            list(client.stream({"fail": 400}))
+    assert client.breakers["primary"].state == "closed"
+    assert list(client.stream({})) == ["a", "b"]
+
+
+def test_request_errors_do_not_open_the_circuit_async():
+    client = _client()
+
+    async def run() -> list:
+        for _ in range(5):
+            with pytest.raises(StatusError):
+                async for _ in client.astream({"fail": 400}):
+                    pass
+        return [chunk async for chunk in client.astream({})]
+
+    assert asyncio.run(run()) == ["a", "b"]
+    assert client.breakers["primary"].state == "closed"
+
+
+def test_endpoint_failures_open_the_circuit():
+    client = _client()
+    for _ in range(3):
+        with pytest.raises(StatusError):
+            list(client.stream({"fail": 503}))
+    assert client.breakers["primary"].state == "open"
+    with pytest.raises(CircuitOpenError):
+        list(client.stream({}))
+
+
+def test_half_open_probe_rejected_as_bad_request_closes_the_circuit():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_s=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.state == "open"
+    now[0] = 11.0
+    assert breaker.allow()
+    breaker.record_request_error()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_throttling_and_unavailable_are_retried_with_jitter_before_the_first_token():
+    open_stream, calls = _scripted(StatusError(429), StatusError(503), ["a", "b"])
+    jittered, slept = [], []
+    client = ResilientLLMClient(open_stream, ["primary"], max_retries=3, wait_gen=lambda: expo(0.1),
+                                jitter=lambda v: jittered.append(v) or v / 2, sleep=slept.append)
+    assert list(client.stream({})) == ["a", "b"]
+    assert len(calls) == 3
+    assert jittered == [0.1, 0.2] and slept == [0.05, 0.1]
+    assert client.stats["retries"] == 2 and client.stats["failures"] == 0
+
+
+def test_no_retry_once_a_token_has_streamed():
+    open_stream, calls = _scripted(["a", StatusError(503)], ["a", "b"])
+    client = ResilientLLMClient(open_stream, ["primary"], max_retries=3, sleep=lambda s: None)
+    received = []
+    with pytest.raises(StatusError):
+        for chunk in client.stream({}):
+            received.append(chunk)
+    assert received == ["a"] and len(calls) == 1
+    assert client.stats["retries"] == 0 and client.stats["failures"] == 1
+
+
+def test_first_token_timeout():
+    release = threading.Event()
+
+    def open_stream(endpoint: str, request: dict):
+        release.wait(5)
+        return iter(["late"])
+
+    client = ResilientLLMClient(open_stream, ["primary"], max_retries=0, ttft_timeout_s=0.1)
+    t0 = time.monotonic()
+    try:
+        with pytest.raises(FirstTokenTimeout):
+            list(client.stream({}))
+    finally:
+        release.set()
+    assert 0.1 <= time.monotonic() - t0 < 1.0
+    assert client.stats["ttft_timeouts"] == 1
+
+
+def test_hedge_goes_out_after_the_p95_and_wins():
+    # three fast requests set the p95; the fourth is stuck and its hedge (fifth call) streams at once
+    open_stream, calls = _scripted(["a"], ["a"], ["a"], [2.0, "slow"], ["hedged"])
+    client = ResilientLLMClient(open_stream, ["primary"], hedge=True, hedge_min_s=0.05, hedge_min_samples=3)
+    for _ in range(3):
+        assert list(client.stream({})) == ["a"]
+    assert client.stats["hedges"] == 0
+    t0 = time.monotonic()
+    assert list(client.stream({})) == ["hedged"]
+    assert time.monotonic() - t0 < 1.0
+    assert len(calls) == 5
+    assert client.stats["hedges"] == 1 and client.stats["hedge_wins"] == 1
+
+
+def test_fallback_to_the_secondary_endpoint_when_the_primary_circuit_is_open():
+    with StubLLMServer(ttft_s=0.01, tokens=3, error_rate=1.0, error_status=503) as primary, \
+            StubLLMServer(ttft_s=0.01, tokens=3) as secondary:
+        clients = {"primary": RawClient(primary.base_url), "secondary": RawClient(secondary.base_url)}
+        client = ResilientLLMClient(lambda endpoint, req: clients[endpoint].stream(req["messages"]),
+                                    ["primary", "secondary"], max_retries=0, failure_threshold=2, reset_s=60)
+        request = {"messages": [{"role": "user", "content": "Qual o aviso prévio?"}]}
+        for _ in range(3):
+            chunks = list(client.stream(request))
+            assert chunks[-1]["choices"][0]["finish_reason"] is not None
+        # two primary failures open its circuit: the third request goes straight to the secondary
+        assert primary.stats["requests"] == 2 and secondary.stats["requests"] == 3
+        assert client.breakers["primary"].state == "open"
+        assert client.stats["fallbacks"] == 3 and client.stats["short_circuits"] == 1
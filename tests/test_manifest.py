@@ -0,0 +1,39 @@
+from src.lib.extract import CHUNK_COLUMNS, to_chunk_rows
+from src.lib.manifest import FileState, plan_ingestion, stale_chunks_predicate
+
+
+def _file(name: str, doc_id: str) -> FileState:
+    return FileState(doc_name=name, source_path=f"dbfs:/v/{name}", doc_id=doc_id, size_bytes=1, modified_at=0.0)
+
+
+def test_rechunked_chunks_get_new_uids():
+    chunks = [(1, 0, "texto", 1, 0, 5)]
+    old = to_chunk_rows("a.pdf", "dbfs:/v", "d1", chunks, "pt-BR", "legacy:900:120")
+    new = to_chunk_rows("a.pdf", "dbfs:/v", "d1", chunks, "pt-BR", "sentence:900:120")
+    assert old[0]["chunk_uid"] != new[0]["chunk_uid"]
+    assert new[0]["chunker"] == "sentence:900:120"
+    assert list(new[0]) == CHUNK_COLUMNS
+
+
+def test_stale_predicate_covers_rechunked_docs_after_the_write():
+    manifest = {"a.pdf": ("d1", "legacy:900:120"), "b.pdf": ("d2", "legacy:900:120"), "gone.pdf": ("d3", None)}
+    plan = plan_ingestion([_file("a.pdf", "d1"), _file("b.pdf", "d9")], manifest, chunker="sentence:900:120")
+    assert [f.doc_name for f in plan.rechunked] == ["a.pdf"]
+    assert [f.doc_name for f in plan.changed] == ["b.pdf"]
+    stale = stale_chunks_predicate(plan, chunker="sentence:900:120")
+    assert "(doc_name = 'a.pdf' AND NOT chunker <=> 'sentence:900:120')" in stale
+    assert "(doc_name = 'b.pdf' AND doc_id <> 'd9')" in stale
+    assert "doc_name IN ('gone.pdf')" in stale
+
+
+def test_failed_rechunked_doc_keeps_its_chunks():
+    plan = plan_ingestion([_file("a.pdf", "d1")], {"a.pdf": ("d1", "legacy:900:120")}, chunker="sentence:900:120")
+    assert stale_chunks_predicate(plan, skip={"a.pdf"}, chunker="sentence:900:120") is None
+
+
+def test_identical_files_under_two_names_get_distinct_uids():
+    chunks = [(1, 0, "texto", 1, 0, 5), (1, 1, "mais texto", 1, 6, 16)]
+    a = to_chunk_rows("a.pdf", "dbfs:/v", "d1", chunks, "pt-BR", "sentence:900:120")
+    b = to_chunk_rows("copia de a.pdf", "dbfs:/v", "d1", chunks, "pt-BR", "sentence:900:120")
+    assert {r["doc_id"] for r in a + b} == {"d1"}
+    assert len({r["chunk_uid"] for r in a + b}) == 4
@@ -0,0 +1,26 @@
+import os
+import time
+
+from src.lib.staging import remove_stale_temp_files, stage_pdfs
+
+
+def test_only_old_temp_files_are_removed(tmp_path):
+    old, in_flight = tmp_path / "a.pdf.1.tmp", tmp_path / "b.pdf.2.tmp"
+    old.write_bytes(b"partial")
+    in_flight.write_bytes(b"partial")
+    two_hours_ago = time.time() - 7200
+    os.utime(old, (two_hours_ago, two_hours_ago))
+    assert remove_stale_temp_files(str(tmp_path)) == 1
+    assert not old.exists() and in_flight.exists()
+
+
+def test_staging_leaves_a_concurrent_runs_copy_alone(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    dst.mkdir()
+    (src / "contrato.pdf").write_bytes(b"%PDF-1.4 contrato")
+    in_flight = dst / "outro.pdf.3f2a.tmp"
+    in_flight.write_bytes(b"%PDF-1.4 part")
+    results = stage_pdfs(str(src), str(dst))
+    assert [r.status for r in results] == ["copied"]
+    assert in_flight.exists()
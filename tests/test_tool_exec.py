@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from src.lib.tool_exec import ParallelToolRunner, ToolCapacityExhausted, run_in_thread
+
+
+def _run_requests(runner: ParallelToolRunner, requests: int, calls_per_request: int, seconds: float) -> list:
+    # one thread per serving request, all sharing the agent's runner
+    results, lock = [], threading.Lock()
+
+    def request() -> None:
+        calls = [lambda: time.sleep(seconds) or "ok" for _ in range(calls_per_request)]
+        out = list(runner.run(calls))
+        with lock:
+            results.extend(out)
+
+    threads = [threading.Thread(target=request) for _ in range(requests)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_requests_do_not_queue_behind_each_other():
+    runner = ParallelToolRunner(max_workers=4, timeout_s=0.5)
+    t0 = time.monotonic()
+    results = _run_requests(runner, requests=8, calls_per_request=1, seconds=0.3)
+    assert len(results) == 8
+    assert all(r.error is None and r.output == "ok" for r in results)
+    assert time.monotonic() - t0 < 0.45
+
+
+def test_timeout_counts_from_each_call_start():
+    # five calls, four at a time: the fifth starts after the first wave and still gets its full timeout
+    runner = ParallelToolRunner(max_workers=4, timeout_s=0.5)
+    results = list(runner.run([lambda: time.sleep(0.3) or "ok" for _ in range(5)]))
+    assert sorted(r.index for r in results) == [0, 1, 2, 3, 4]
+    assert all(r.error is None for r in results)
+
+
+def test_stuck_tool_does_not_starve_other_requests():
+    runner = ParallelToolRunner(max_workers=4, timeout_s=0.2)
+    stuck = [r for _ in range(4) for r in runner.run([lambda: time.sleep(2.0)])]
+    assert all(r.timed_out for r in stuck)
+    t0 = time.monotonic()
+    results = list(runner.run([lambda: "ok"]))
+    assert results[0].output == "ok"
+    assert time.monotonic() - t0 < 0.1
+
+
+def test_results_in_completion_order_with_call_index():
+    runner = ParallelToolRunner(max_workers=4, timeout_s=1.0)
+    results = list(runner.run([lambda: time.sleep(0.2) or "slow", lambda: "fast", lambda: 1 / 0]))
+    assert [r.index for r in results][-1] == 0
+    by_index = {r.index: r for r in results}
+    assert by_index[1].output == "fast"
+    assert by_index[2].error.startswith("Error: ZeroDivisionError")
+
+
+def test_stuck_calls_can_not_push_live_tool_threads_past_the_cap():
+    capacity = threading.BoundedSemaphore(3)
+    runner = ParallelToolRunner(max_workers=4, timeout_s=0.05, capacity=capacity)
+    release = threading.Event()
+    baseline = threading.active_count()
+    results = []
+    for _ in range(5):  # five requests while a dependency hangs: 10 calls, 3 threads
+        results += runner.run([lambda: release.wait(5), lambda: release.wait(5)])
+        assert threading.active_count() - baseline <= 3
+    assert sum(r.timed_out for r in results) == 3
+    rejected = [r for r in results if r.rejected]
+    assert len(rejected) == 7 and all(r.error.startswith("Error: tool capacity exhausted") for r in rejected)
+    with pytest.raises(ToolCapacityExhausted):
+        run_in_thread(lambda: "ok", capacity=capacity)
+
+    release.set()  # the dependency recovers: the stuck threads return their slots
+    deadline = time.monotonic() + 2.0
+    while threading.active_count() > baseline and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [r.output for r in runner.run([lambda: "ok"] * 3)] == ["ok"] * 3